@@ -0,0 +1,111 @@
+"""Microbenchmark of window extraction from memory mapped track stores.
+
+Compares TrackStore.extract (grouped, strided gather with masked mirroring)
+against the per-interval slicing loop of the deprecated MemmappedExtractor,
+for batch sizes from 32 to 4096.
+
+Example:
+        $ python bench_extraction.py --width 500 --repeats 20
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fiddle'))
+from io_tools import TrackStore, _ONE_HOT_LOOKUP, _write_store_metadata
+
+BATCH_SIZES = [32, 128, 512, 1024, 4096]
+
+
+def make_stores(store_dir, chrom_sizes, height=2, seed=0):
+    """Writes a random DNA store and a random bigwig-like store"""
+    rng = np.random.RandomState(seed)
+    for kind, track_height in [('fasta', 4), ('bigwig', height)]:
+        track_dir = os.path.join(store_dir, kind)
+        os.makedirs(track_dir)
+        file_shapes = {}
+        for chrom, size in chrom_sizes.items():
+            if kind == 'fasta':
+                data = rng.choice(np.frombuffer(b'ACGT', dtype=np.uint8), size)
+            else:
+                data = rng.exponential(size=(track_height, size)).astype(np.float32)
+            np.save(os.path.join(track_dir, chrom + '.npy'), data)
+            file_shapes[chrom] = data.shape
+        _write_store_metadata(track_dir, {'type': 'npy_memmap', 'kind': kind, 'height': track_height,
+                                          'file_shapes': file_shapes, 'source': 'synthetic'})
+    return {kind: TrackStore(os.path.join(store_dir, kind)) for kind in ['fasta', 'bigwig']}
+
+
+def loop_extract(store, chroms, starts, width, to_mirror):
+    """Per-interval extraction as done by the deprecated extractors"""
+    out = np.zeros((len(starts), store.height, width, 1), dtype=np.float32)
+    for index, (chrom, start) in enumerate(zip(chroms, starts)):
+        window = store._data[chrom][..., start:start + width]
+        if store.kind == 'fasta':
+            window = _ONE_HOT_LOOKUP[window].T
+        out[index, :, :, 0] = window
+    for index, flip in enumerate(to_mirror):
+        if flip:
+            out[index, :, :, :] = out[index, ::-1, ::-1, :]
+    return out
+
+
+def time_it(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return float(np.median(timings))
+
+
+def main():
+    parser = OptionParser('usage: %prog [options]')
+    parser.add_option('-w', '--width', dest='width', type='int', default=500, help='Window width [Default: %default]')
+    parser.add_option('-n', '--repeats', dest='repeats', type='int', default=10, help='Repeats per measurement [Default: %default]')
+    parser.add_option('-c', '--chromSize', dest='chrom_size', type='int', default=2000000, help='Size of each synthetic chromosome [Default: %default]')
+    parser.add_option('-o', '--output', dest='output', default=None, help='Write results as json to this file [Default: %default]')
+    (options, args) = parser.parse_args()
+
+    chrom_sizes = {'chr' + str(ix): options.chrom_size for ix in range(1, 5)}
+    store_dir = tempfile.mkdtemp(prefix='fiddle_bench_')
+    results = []
+    try:
+        stores = make_stores(store_dir, chrom_sizes)
+        rng = np.random.RandomState(1)
+        print('{:>8} {:>7} {:>12} {:>12} {:>8}'.format('kind', 'batch', 'loop (ms)', 'batch (ms)', 'speedup'))
+        for kind, store in sorted(stores.items()):
+            for batch_size in BATCH_SIZES:
+                chroms = rng.choice(sorted(chrom_sizes), batch_size)
+                starts = rng.randint(0, options.chrom_size - options.width, batch_size)
+                to_mirror = rng.rand(batch_size) < 0.5
+                out = np.empty((batch_size, store.height, options.width, 1), dtype=np.float32)
+                assert np.array_equal(loop_extract(store, chroms, starts, options.width, to_mirror),
+                                      store.extract(chroms, starts, options.width, to_mirror=to_mirror, out=out))
+                t_loop = time_it(lambda: loop_extract(store, chroms, starts, options.width, to_mirror), options.repeats)
+                t_batch = time_it(lambda: store.extract(chroms, starts, options.width, to_mirror=to_mirror, out=out),
+                                  options.repeats)
+                results.append({'kind': kind, 'batch_size': batch_size, 'width': options.width,
+                                'loop_secs': t_loop, 'batch_secs': t_batch})
+                print('{:>8} {:>7} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(kind, batch_size, 1e3 * t_loop,
+                                                                         1e3 * t_batch, t_loop / t_batch))
+    finally:
+        shutil.rmtree(store_dir)
+
+    if options.output is not None:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Standard FIDDLE throughput benchmarks.
+
+Generates (or reuses) a synthetic multi-track dataset and measures
+    one_hot      one hot encoding of DNA sequences
+    batcher      MultiModalData training batches read from train.h5
+    train_step   Integrator.train latency
+    validation   Integrator.validate on the held out validation examples
+    export       analysis.py representation and prediction export of test.h5
+and writes the results as json, to be compared across commits with
+compare_benchmarks.py. The last three need TensorFlow and Keras.
+
+Example:
+        $ python bench_fiddle.py -n 20000 -t dnaseq,chipseq,tssseq -o results_$(git rev-parse --short HEAD).json
+        $ python compare_benchmarks.py results_a1b2c3d.json results_e4f5a6b.json
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+import h5py
+import numpy as np
+
+from synthetic_data import FIDDLE_DIR, generate_dataset
+
+sys.path.append(FIDDLE_DIR)
+from io_tools import MultiModalData, one_hot_encode_sequence
+
+BENCHMARKS = ['one_hot', 'batcher', 'train_step', 'validation', 'export']
+
+
+def timings_summary(timings, num_items=None):
+    """Median, 90th percentile and total of repeated timings, plus throughput if num_items is given"""
+    timings = np.asarray(timings)
+    summary = {'median_secs': float(np.median(timings)),
+               'p90_secs': float(np.percentile(timings, 90)),
+               'total_secs': float(timings.sum()),
+               'repeats': len(timings)}
+    if num_items is not None:
+        summary['items_per_sec'] = num_items / summary['median_secs']
+    return summary
+
+
+def time_repeats(func, repeats, warmup=1):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeats):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return timings
+
+
+def bench_one_hot(options, paths):
+    rng = np.random.RandomState(0)
+    bases = np.frombuffer(b'ACGTN', dtype=np.uint8)
+    sequences = [rng.choice(bases, options.width, p=[0.245, 0.245, 0.245, 0.245, 0.02]).tobytes()
+                 for _ in range(1000)]
+    timings = time_repeats(lambda: [one_hot_encode_sequence(seq) for seq in sequences], options.repeats)
+    return timings_summary(timings, num_items=len(sequences))
+
+
+def bench_batcher(options, paths):
+    with h5py.File(paths['train'], 'r') as train_h5_handle:
+        batcher = MultiModalData(train_h5_handle, batch_size=options.batch_size).batcher()
+        timings = time_repeats(lambda: next(batcher), 10 * options.repeats)
+    result = timings_summary(timings, num_items=options.batch_size)
+    result['batch_size'] = options.batch_size
+    return result
+
+
+def _build_model(paths, save_dir):
+    from models import Integrator, byteify
+    with open(paths['configuration']) as fp:
+        config = byteify(json.load(fp))
+    model = Integrator(config=config, architecture_path=paths['architecture'], model_path=save_dir)
+    model.initialize()
+    model.create_monitor_variables(show_filters=False)
+    return model
+
+
+def bench_train_step(options, paths, model):
+    with h5py.File(paths['train'], 'r') as train_h5_handle:
+        batcher = MultiModalData(train_h5_handle, batch_size=options.batch_size).batcher()
+        batches = [next(batcher) for _ in range(10)]
+    timings = []
+    for ix in range(options.repeats + 1):
+        batch = batches[ix % len(batches)]
+        start = time.time()
+        model.train(batch, inp_dropout=0., batch_size=options.batch_size)
+        timings.append(time.time() - start)
+    result = timings_summary(timings[1:], num_items=options.batch_size)
+    result['batch_size'] = options.batch_size
+    return result
+
+
+def bench_validation(options, paths, model):
+    with h5py.File(paths['validation'], 'r') as validation_h5_handle:
+        to_size = min(validation_h5_handle.values()[0].shape[0], 1000)
+        validation_data = {key: validation_h5_handle[key][:to_size] for key in validation_h5_handle.keys()}
+    timings = time_repeats(lambda: model.validate(validation_data), options.repeats)
+    result = timings_summary(timings, num_items=to_size)
+    result['examples'] = to_size
+    return result
+
+
+def bench_export(options, paths, model, save_dir):
+    from analysis import chunk_test_data, export_batched
+    result = {}
+    with h5py.File(paths['test'], 'r') as test_h5_handle:
+        start = time.time()
+        test_data_list = chunk_test_data(test_h5_handle, model.inputs, chunk_size=50)
+        result['read_secs'] = time.time() - start
+    for name, run_function in [('representations', model.get_representations), ('predictions', model.predict)]:
+        start = time.time()
+        num_examples = export_batched(run_function, test_data_list, os.path.join(save_dir, name + '.h5'))
+        secs = time.time() - start
+        result[name + '_secs'] = secs
+        result[name + '_items_per_sec'] = num_examples / secs
+    result['examples'] = num_examples
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=FIDDLE_DIR).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    env = {'python': platform.python_version(), 'numpy': np.__version__, 'h5py': h5py.__version__,
+           'host': socket.gethostname(), 'platform': platform.platform(), 'commit': git_commit(),
+           'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    try:
+        import tensorflow as tf
+        env['tensorflow'] = tf.__version__
+    except ImportError:
+        env['tensorflow'] = None
+    return env
+
+
+def main():
+    parser = OptionParser('usage: %prog [options]')
+    parser.add_option('-d', '--dataDir', dest='data_dir', default=None, help='Existing synthetic dataset, generated in a temporary directory if not given [Default: %default]')
+    parser.add_option('-n', '--examples', dest='num_examples', type='int', default=10000, help='Number of synthetic examples [Default: %default]')
+    parser.add_option('-t', '--tracks', dest='tracks', default='dnaseq,chipseq,netseq,tssseq', help='Comma separated tracks [Default: %default]')
+    parser.add_option('--outputs', dest='outputs', default='tssseq', help='Comma separated output tracks [Default: %default]')
+    parser.add_option('-w', '--width', dest='width', type='int', default=500, help='Window width [Default: %default]')
+    parser.add_option('-b', '--batchSize', dest='batch_size', type='int', default=20, help='Training batch size [Default: %default]')
+    parser.add_option('-r', '--repeats', dest='repeats', type='int', default=20, help='Repeats per measurement [Default: %default]')
+    parser.add_option('-s', '--select', dest='select', default=','.join(BENCHMARKS), help='Comma separated benchmarks to run [Default: %default]')
+    parser.add_option('-o', '--output', dest='output', default=None, help='Write results as json to this file [Default: %default]')
+    (options, args) = parser.parse_args()
+
+    selected = options.select.split(',')
+    for name in selected:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark: ' + name)
+
+    work_dir = tempfile.mkdtemp(prefix='fiddle_bench_')
+    try:
+        if options.data_dir is None:
+            print('Generating {} synthetic examples of {}'.format(options.num_examples, options.tracks))
+            data_dir = os.path.join(work_dir, 'data')
+            generate_dataset(data_dir, tracks=options.tracks.split(','), outputs=options.outputs.split(','),
+                             num_examples=options.num_examples, width=options.width)
+        else:
+            data_dir = options.data_dir
+        paths = {name: os.path.join(data_dir, name + '.h5') for name in ['train', 'validation', 'test']}
+        paths['configuration'] = os.path.join(data_dir, 'configurations.json')
+        paths['architecture'] = os.path.join(data_dir, 'architecture.json')
+
+        results = {}
+        model = None
+        for name in BENCHMARKS:
+            if name not in selected:
+                continue
+            print('Running ' + name)
+            if name in ['one_hot', 'batcher']:
+                results[name] = globals()['bench_' + name](options, paths)
+                continue
+            if model is None:
+                model = _build_model(paths, os.path.join(work_dir, 'model'))
+            if name == 'export':
+                results[name] = bench_export(options, paths, model, work_dir)
+            else:
+                results[name] = globals()['bench_' + name](options, paths, model)
+        if model is not None:
+            model.sess.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+    report = {'environment': environment(),
+              'parameters': {key: getattr(options, key) for key in
+                             ['num_examples', 'tracks', 'outputs', 'width', 'batch_size', 'repeats', 'data_dir']},
+              'results': results}
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if options.output is not None:
+        with open(options.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark of GFF3 annotation reading for region generation.
+
+Compares the deprecated parseGFF3 (plus filtering in Python) with
+data_prep/annotation.read_gff3 on an annotation such as the Ensembl human
+GFF3, or on a synthetic annotation if no file is given.
+
+Example:
+        $ python bench_gff3.py Homo_sapiens.GRCh38.90.gff3.gz
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import tempfile
+from optparse import OptionParser
+
+import numpy as np
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(BASE_DIR, 'fiddle', 'data_prep'))
+sys.path.append(os.path.join(BASE_DIR, '_deprecated'))
+from annotation import read_gff3
+from parse_gff3 import parseGFF3
+
+
+def make_annotation(filename, num_records, seed=0):
+    """Writes a gzipped GFF3 file with Ensembl-like records"""
+    rng = np.random.RandomState(seed)
+    types = ['gene', 'mRNA', 'exon', 'CDS', 'five_prime_UTR', 'three_prime_UTR']
+    sources = ['ensembl', 'havana', 'ensembl_havana']
+    with gzip.open(filename, 'wb') as fp:
+        fp.write(b'##gff-version 3\n')
+        for ix in range(num_records):
+            start = rng.randint(1, 10 ** 8)
+            line = '{}\t{}\t{}\t{}\t{}\t.\t{}\t.\tParent=transcript:ENST{:011d};Name=gene%20{};protein_id=ENSP{:011d}\n'.format(
+                rng.randint(1, 23), sources[ix % 3], types[ix % 6], start, start + rng.randint(100, 5000),
+                '+-'[ix % 2], ix, ix, ix)
+            fp.write(line.encode('ascii'))
+
+
+def parse_gff3_baseline(filename, loci_of_interest, source):
+    starts = []
+    for record in parseGFF3(filename):
+        if (record['type'] != loci_of_interest) or (record['source'] != source):
+            continue
+        starts.append(record['start'])
+    return len(starts)
+
+
+def main():
+    parser = OptionParser('usage: %prog [options] [annotation.gff3[.gz]]')
+    parser.add_option('-t', dest='loci_of_interest', default='CDS', help='Record type to keep [Default: %default]')
+    parser.add_option('-n', dest='num_records', type='int', default=500000, help='Synthetic records if no file is given [Default: %default]')
+    parser.add_option('-o', '--output', dest='output', default=None, help='Write results as json to this file [Default: %default]')
+    (options, args) = parser.parse_args()
+
+    tmp_dir = None
+    if args:
+        filename = args[0]
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='fiddle_bench_')
+        filename = os.path.join(tmp_dir, 'annotation.gff3.gz')
+    try:
+        if tmp_dir is not None:
+            make_annotation(filename, options.num_records)
+
+        start = time.time()
+        n_baseline = parse_gff3_baseline(filename, options.loci_of_interest, 'ensembl')
+        t_baseline = time.time() - start
+
+        start = time.time()
+        loci = read_gff3(filename, columns=['seqid', 'start', 'end', 'strand'],
+                         types=[options.loci_of_interest], sources=['ensembl'])
+        t_fast = time.time() - start
+        assert len(loci['start']) == n_baseline
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    results = {'file': filename, 'records_kept': n_baseline,
+               'parseGFF3_secs': t_baseline, 'read_gff3_secs': t_fast}
+    print('parseGFF3: {:.2f}s  read_gff3: {:.2f}s  ({:.1f}x, {} records kept)'.format(
+        t_baseline, t_fast, t_baseline / t_fast, n_baseline))
+    if options.output is not None:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
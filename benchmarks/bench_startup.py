@@ -0,0 +1,90 @@
+"""Startup time of the FIDDLE entry points.
+
+Imports each entry point module in a fresh interpreter, repeatedly, and
+reports the median wall time together with the heavy packages (TensorFlow,
+Keras, matplotlib, pandas ...) the import pulled in. Entry points whose
+imports fail in the current environment are reported with their error.
+
+Example:
+        $ python bench_startup.py --repeats 5 -o startup.json
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import json
+import time
+import subprocess
+from optparse import OptionParser
+
+import numpy as np
+
+FIDDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fiddle')
+ENTRY_POINTS = ['main', 'analysis', 'visualization', 'models', 'io_tools', 'profiling']
+HEAVY_MODULES = ['tensorflow', 'keras', 'matplotlib', 'pandas', 'scipy', 'h5py', 'viz_sequence']
+
+IMPORT_SCRIPT = """
+import sys, json
+sys.argv = sys.argv[:1]
+import {module}
+print(json.dumps(sorted(name for name in {heavy!r} if name in sys.modules)))
+"""
+
+
+def time_import(module, python=sys.executable):
+    """Imports module in a fresh interpreter
+
+    Args:
+        :param module: (string) module of the fiddle directory
+        :param python: (string, default = current interpreter) python executable
+
+    Returns:
+        tuple: (wall time in seconds, list of heavy modules loaded, error message or None)
+    """
+    script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    start = time.time()
+    process = subprocess.Popen([python, '-c', script], cwd=FIDDLE_DIR,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    secs = time.time() - start
+    if process.returncode != 0:
+        return secs, [], stderr.decode('utf-8', 'replace').strip().splitlines()[-1]
+    return secs, json.loads(stdout.decode('utf-8').strip().splitlines()[-1]), None
+
+
+def main():
+    parser = OptionParser('usage: %prog [options] [<module> ...]')
+    parser.add_option('-n', '--repeats', dest='repeats', type='int', default=5, help='Imports per entry point [Default: %default]')
+    parser.add_option('-p', '--python', dest='python', default=sys.executable, help='Python interpreter [Default: %default]')
+    parser.add_option('-o', '--output', dest='output', default=None, help='Write results as json to this file [Default: %default]')
+    (options, args) = parser.parse_args()
+
+    baseline = np.median([time_import('os', options.python)[0] for _ in range(options.repeats)])
+    results = {'interpreter_secs': float(baseline), 'entry_points': {}}
+    print('interpreter startup: {:.3f}s'.format(baseline))
+    print('{:<15} {:>10} {:>10}  {}'.format('module', 'total(s)', 'import(s)', 'heavy modules loaded'))
+    for module in args or ENTRY_POINTS:
+        timings, error = [], None
+        for _ in range(options.repeats):
+            secs, loaded, error = time_import(module, options.python)
+            if error is not None:
+                break
+            timings.append(secs)
+        if error is not None:
+            results['entry_points'][module] = {'error': error}
+            print('{:<15} {:>10} {:>10}  {}'.format(module, '-', '-', error))
+            continue
+        median = float(np.median(timings))
+        results['entry_points'][module] = {'median_secs': median, 'import_secs': median - baseline,
+                                           'heavy_modules': loaded}
+        print('{:<15} {:>10.3f} {:>10.3f}  {}'.format(module, median, median - baseline, ', '.join(loaded)))
+
+    if options.output is not None:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
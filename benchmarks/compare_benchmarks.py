@@ -0,0 +1,77 @@
+"""Compares two result files of bench_fiddle.py, e.g. from two commits.
+
+Throughputs (*_per_sec) are better when higher and timings (*_secs) when
+lower; changes beyond the threshold in the wrong direction are reported as
+regressions and make the script exit with status 1.
+
+Example:
+        $ python compare_benchmarks.py baseline.json candidate.json -t 0.1
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import sys
+import json
+from optparse import OptionParser
+
+
+def flatten_results(report):
+    """{(benchmark, metric): value} of the timing and throughput metrics of a report"""
+    return {(name, metric): value
+            for name, metrics in report['results'].items()
+            for metric, value in metrics.items()
+            if metric.endswith('_secs') or metric.endswith('_per_sec')}
+
+
+def compare(baseline, candidate, threshold=0.1):
+    """Relative changes of the metrics present in both reports
+
+    Args:
+        :param baseline: (dictionary) bench_fiddle.py report
+        :param candidate: (dictionary) bench_fiddle.py report
+        :param threshold: (float, default = 0.1) relative slowdown reported as a regression
+
+    Returns:
+        list: (benchmark, metric, baseline value, candidate value, speedup, is regression) tuples
+    """
+    base_values = flatten_results(baseline)
+    cand_values = flatten_results(candidate)
+    rows = []
+    for key in sorted(set(base_values) & set(cand_values)):
+        base, cand = base_values[key], cand_values[key]
+        if base <= 0 or cand <= 0:
+            continue
+        speedup = cand / base if key[1].endswith('_per_sec') else base / cand
+        rows.append(key + (base, cand, speedup, speedup < 1. / (1. + threshold)))
+    return rows
+
+
+def main():
+    parser = OptionParser('usage: %prog [options] <baseline.json> <candidate.json>')
+    parser.add_option('-t', '--threshold', dest='threshold', type='float', default=0.1, help='Relative slowdown reported as a regression [Default: %default]')
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error('Expected a baseline and a candidate result file')
+
+    reports = []
+    for path in args:
+        with open(path) as fp:
+            reports.append(json.load(fp))
+    for name, report in zip(['baseline', 'candidate'], reports):
+        env = report['environment']
+        print('{:<10} commit {} on {} ({})'.format(name, env['commit'], env['host'], env['date']))
+    if reports[0]['parameters'] != reports[1]['parameters']:
+        print('WARNING: benchmark parameters differ, {} vs {}'.format(reports[0]['parameters'], reports[1]['parameters']))
+
+    rows = compare(reports[0], reports[1], threshold=options.threshold)
+    print('\n{:<12} {:<30} {:>14} {:>14} {:>9}'.format('benchmark', 'metric', 'baseline', 'candidate', 'speedup'))
+    for name, metric, base, cand, speedup, regression in rows:
+        print('{:<12} {:<30} {:>14.5g} {:>14.5g} {:>8.2f}x{}'.format(name, metric, base, cand, speedup,
+                                                                    '  REGRESSION' if regression else ''))
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
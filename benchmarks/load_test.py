@@ -0,0 +1,138 @@
+"""Load test of the FIDDLE prediction server (fiddle/server.py).
+
+Sends random inputs, shaped after the /health description of the served
+model, from concurrent clients and reports latency percentiles, request and
+example throughput, and the batching the server achieved.
+
+Example:
+        $ python load_test.py --url http://127.0.0.1:8470 -c 16 -n 2000 -b 4 -o load.json
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import io
+import json
+import time
+import threading
+from optparse import OptionParser
+
+import numpy as np
+from six.moves.urllib.request import Request, urlopen
+
+
+def get_json(url):
+    response = urlopen(url)
+    try:
+        return json.loads(response.read().decode('utf-8'))
+    finally:
+        response.close()
+
+
+def random_inputs(input_shapes, num_examples, rng):
+    """Random one hot sequences for dnaseq, random non negative signal for the other tracks"""
+    inputs = {}
+    for key, shape in input_shapes.items():
+        if key == 'dnaseq':
+            codes = rng.randint(0, shape[0], size=(num_examples, shape[1]))
+            inputs[key] = np.eye(shape[0], dtype=np.float32)[codes].transpose(0, 2, 1)[..., None]
+        else:
+            inputs[key] = rng.poisson(1., size=[num_examples] + shape).astype(np.float32)
+    return inputs
+
+
+def encode_inputs(inputs):
+    buf = io.BytesIO()
+    np.savez(buf, **inputs)
+    return buf.getvalue()
+
+
+def run_client(url, bodies, num_requests, latencies, errors):
+    """Sends num_requests requests one after the other, appending latencies (seconds) and errors"""
+    for ix in range(num_requests):
+        request = Request(url, data=bodies[ix % len(bodies)], headers={'Content-Type': 'application/octet-stream'})
+        start = time.time()
+        try:
+            response = urlopen(request)
+            response.read()
+            response.close()
+        except Exception as error:
+            errors.append(repr(error))
+            continue
+        latencies.append(time.time() - start)
+
+
+def load_test(url, endpoint='predict', concurrency=16, num_requests=2000, examples_per_request=1, seed=0):
+    """Runs the load test
+
+    Args:
+        :param url: (string) base url of the server
+        :param endpoint: (string, default = predict) predict or representations
+        :param concurrency: (int, default = 16) number of concurrent clients
+        :param num_requests: (int, default = 2000) total number of requests
+        :param examples_per_request: (int, default = 1) examples in every request
+        :param seed: (int, default = 0) seed of the random inputs
+
+    Returns:
+        dictionary: latency percentiles (ms), throughputs and server batching statistics
+    """
+    health = get_json(url + '/health')
+    rng = np.random.RandomState(seed)
+    bodies = [encode_inputs(random_inputs(health['inputs'], examples_per_request, rng)) for _ in range(8)]
+    stats_before = health['stats']
+
+    latencies, errors = [], []
+    per_client = [num_requests // concurrency + (ix < num_requests % concurrency) for ix in range(concurrency)]
+    threads = [threading.Thread(target=run_client, args=(url + '/' + endpoint, bodies, count, latencies, errors))
+               for count in per_client]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    secs = time.time() - start
+
+    stats_after = get_json(url + '/health')['stats']
+    batches = stats_after['batches'] - stats_before['batches']
+    latencies_ms = np.asarray(latencies) * 1000.
+    return {'parameters': {'endpoint': endpoint, 'concurrency': concurrency, 'requests': num_requests,
+                           'examples_per_request': examples_per_request,
+                           'max_batch_size': health['max_batch_size'], 'max_latency': health['max_latency']},
+            'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies) else None,
+            'p90_ms': float(np.percentile(latencies_ms, 90)) if len(latencies) else None,
+            'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies) else None,
+            'max_ms': float(latencies_ms.max()) if len(latencies) else None,
+            'requests_per_sec': len(latencies) / secs,
+            'examples_per_sec': len(latencies) * examples_per_request / secs,
+            'mean_batch_examples': (stats_after['examples'] - stats_before['examples']) / batches if batches else None,
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None}
+
+
+def main():
+    parser = OptionParser('usage: %prog [options]')
+    parser.add_option('-u', '--url', dest='url', default='http://127.0.0.1:8470', help='Server url [Default: %default]')
+    parser.add_option('-e', '--endpoint', dest='endpoint', default='predict', help='predict or representations [Default: %default]')
+    parser.add_option('-c', '--concurrency', dest='concurrency', type='int', default=16, help='Concurrent clients [Default: %default]')
+    parser.add_option('-n', '--requests', dest='requests', type='int', default=2000, help='Total requests [Default: %default]')
+    parser.add_option('-b', '--examples', dest='examples', type='int', default=1, help='Examples per request [Default: %default]')
+    parser.add_option('-o', '--output', dest='output', default=None, help='Write results as json to this file [Default: %default]')
+    (options, args) = parser.parse_args()
+
+    results = load_test(options.url.rstrip('/'), options.endpoint, options.concurrency, options.requests, options.examples)
+    print('requests: {requests} x {examples_per_request} examples, {concurrency} clients'.format(**results['parameters']))
+    if results['p50_ms'] is not None:
+        print('latency:  p50 {p50_ms:.2f} ms   p90 {p90_ms:.2f} ms   p99 {p99_ms:.2f} ms   max {max_ms:.2f} ms'.format(**results))
+    print('throughput: {requests_per_sec:.1f} requests/s, {examples_per_sec:.1f} examples/s'.format(**results))
+    if results['mean_batch_examples'] is not None:
+        print('server batches: {:.1f} examples on average'.format(results['mean_batch_examples']))
+    if results['errors']:
+        print('errors: {errors} (first: {first_error})'.format(**results))
+
+    if options.output is not None:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Synthetic multi-track datasets for benchmarking FIDDLE.
+
+Writes train.h5, validation.h5 and test.h5 with the layout produced by
+data_prep/create_hdf5.py, i.e. one (N, input_height, width, 1) dataset per
+track of configurations.json: random one hot DNA for dnaseq and sparse
+Poisson peaks for the sequencing tracks. A matching configurations.json and
+architecture.json are written next to them.
+
+Example:
+        $ python synthetic_data.py /tmp/fiddle_bench -n 20000 -t dnaseq,chipseq,tssseq -o tssseq
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import copy
+import json
+from optparse import OptionParser
+
+import h5py
+import numpy as np
+
+FIDDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fiddle')
+CHUNK_SIZE = 10000 # examples generated at once
+
+
+def synthetic_track(rng, size, height, width, key):
+    """Random data of one track
+
+    Args:
+        :param rng: (np.random.RandomState) random state
+        :param size: (int) number of examples
+        :param height: (int) input height of the track
+        :param width: (int) window width
+        :param key: (string) track name, dnaseq is one hot encoded
+
+    Returns:
+        numpy array: (size, height, width, 1) float32
+    """
+    if key == 'dnaseq':
+        data = np.zeros((size, height, width, 1), dtype=np.float32)
+        bases = rng.randint(height, size=(size, width))
+        data[np.arange(size)[:, None], bases, np.arange(width)[None, :], 0] = 1
+        return data
+    # background reads plus a few peaks per example
+    rate = np.full((size, height, width), 0.05)
+    positions = np.arange(width)[None, None, :]
+    for _ in range(3):
+        centers = rng.randint(width, size=(size, height, 1))
+        heights = rng.exponential(20., size=(size, height, 1))
+        rate += heights * np.exp(-0.5 * ((positions - centers) / 5.) ** 2)
+    return rng.poisson(rate)[..., None].astype(np.float32)
+
+
+def make_config(config, tracks, outputs, data_name):
+    """Restricts a configurations.json dictionary to the benchmarked tracks"""
+    config = copy.deepcopy(config)
+    config['Tracks'] = {key: val for key, val in config['Tracks'].items() if key in tracks}
+    # outputs stay inputs if they were, the router blocks them from their own decoder
+    config['Options']['Inputs'] = [key for key in tracks
+                                   if key not in outputs or key in config['Options']['Inputs']]
+    config['Options']['Outputs'] = list(outputs)
+    config['Options']['DataName'] = data_name
+    return config
+
+
+def make_architecture(architecture, width):
+    """Sets the input and representation width of an architecture.json dictionary"""
+    architecture = copy.deepcopy(architecture)
+    architecture['Modules']['input_width'] = width
+    architecture['Modules']['representation_width'] = width
+    architecture['Scaffold']['representation_width'] = width
+    return architecture
+
+
+def generate_dataset(output_dir, tracks=None, outputs=None, num_examples=10000, width=500,
+                     split=(0.8, 0.1, 0.1), seed=0, config_path=os.path.join(FIDDLE_DIR, 'configurations.json'),
+                     architecture_path=os.path.join(FIDDLE_DIR, 'architecture.json')):
+    """Writes a synthetic dataset matching the configurations.json schema
+
+    Args:
+        :param output_dir: (string) directory of the dataset, i.e. <dataDir>/<DataName>
+        :param tracks: (list, default = None) tracks to generate, all inputs and outputs of the configuration if None
+        :param outputs: (list, default = None) output tracks, those of the configuration if None
+        :param num_examples: (int, default = 10000) total number of examples
+        :param width: (int, default = 500) window width
+        :param split: (tuple, default = (0.8, 0.1, 0.1)) fractions of train, validation and test examples
+        :param seed: (int, default = 0) random seed
+        :param config_path: (string) template configurations.json
+        :param architecture_path: (string) template architecture.json
+
+    Returns:
+        dictionary: paths of the written configuration, architecture and hdf5 files
+    """
+    with open(config_path) as fp:
+        config = json.load(fp)
+    with open(architecture_path) as fp:
+        architecture = json.load(fp)
+    if outputs is None:
+        outputs = config['Options']['Outputs']
+    if tracks is None:
+        tracks = config['Options']['Inputs'] + [key for key in outputs if key not in config['Options']['Inputs']]
+    for key in tracks:
+        if key not in config['Tracks']:
+            raise ValueError('Unknown track: ' + key)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    paths = {'configuration': os.path.join(output_dir, 'configurations.json'),
+             'architecture': os.path.join(output_dir, 'architecture.json')}
+    with open(paths['configuration'], 'w') as fp:
+        json.dump(make_config(config, tracks, outputs, os.path.basename(os.path.normpath(output_dir))), fp, indent=2)
+    with open(paths['architecture'], 'w') as fp:
+        json.dump(make_architecture(architecture, width), fp, indent=2)
+
+    rng = np.random.RandomState(seed)
+    sizes = [int(fraction * num_examples) for fraction in split]
+    for name, size in zip(['train', 'validation', 'test'], sizes):
+        paths[name] = os.path.join(output_dir, name + '.h5')
+        with h5py.File(paths[name], 'w') as h5_handle:
+            for key in tracks:
+                height = config['Tracks'][key]['input_height']
+                dataset = h5_handle.create_dataset(key, (size, height, width, 1), dtype=np.float32)
+                for ix in range(0, size, CHUNK_SIZE):
+                    chunk = min(CHUNK_SIZE, size - ix)
+                    dataset[ix:ix + chunk] = synthetic_track(rng, chunk, height, width, key)
+    return paths
+
+
+def main():
+    usage = 'usage: %prog [options] <output_dir>'
+    parser = OptionParser(usage)
+    parser.add_option('-n', dest='num_examples', type='int', default=10000, help='Total number of examples [Default: %default]')
+    parser.add_option('-w', dest='width', type='int', default=500, help='Window width [Default: %default]')
+    parser.add_option('-t', dest='tracks', default=None, help='Comma separated tracks, all of the configuration if not given [Default: %default]')
+    parser.add_option('-o', dest='outputs', default=None, help='Comma separated output tracks [Default: %default]')
+    parser.add_option('-s', dest='seed', type='int', default=0, help='Random seed [Default: %default]')
+    (options, args) = parser.parse_args()
+
+    paths = generate_dataset(args[0],
+                             tracks=options.tracks.split(',') if options.tracks else None,
+                             outputs=options.outputs.split(',') if options.outputs else None,
+                             num_examples=options.num_examples, width=options.width, seed=options.seed)
+    for name, path in sorted(paths.items()):
+        print(name + ': ' + path)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,9 +19,10 @@ FLAGS:
     --dataDir               '../data/hdf5datasets'  directory where hdf5datasets are stored
     --saveDataForLater      True                    save results as hdf5 format to use later
     --configuration         'configurations.json'   parameters of data inputs and outputs [json file]
+    --pcaComponents         0                       principal components of the representations added as <key>_pca (see pca.py), 0 skips
 
 Todo:
-    incorporate t-SNE, PCA, filter visualizations
+    incorporate t-SNE, filter visualizations
 """
 
 from __future__ import absolute_import
@@ -46,6 +47,7 @@ flags.DEFINE_string('resultsDir', '../results', '(DEFAULT: ../results) - directo
 flags.DEFINE_string('dataDir', '../data/hdf5datasets', '(DEFAULT: ../data/hdf5datasets) - directory where hdf5datasets are stored')
 flags.DEFINE_boolean('saveDataForLater', True, '(DEFAULT: True) - save results as hdf5 format to use later')
 flags.DEFINE_string('configuration', 'configurations.json', '(DEFAULT: configurations.json) - parameters of data inputs and outputs [json file]')
+flags.DEFINE_integer('pcaComponents', 0, '(DEFAULT: 0) - principal components of the representations added as <key>_pca (see pca.py), 0 skips')
 FLAGS = flags.FLAGS
 
 def main(_):
@@ -58,67 +60,68 @@ def main(_):
 
     #### temporary ####
     test_h5_handle = h5py.File(os.path.join(FLAGS.dataDir, config['Options']['DataName'], 'test.h5'), 'r')
-    model = Integrator(config=config,
-                       architecture_path=os.path.join(FLAGS.savePath, 'architecture.json'),
-                       model_path=FLAGS.savePath)
-
-    model.config['Options']['Reload'] = 'all'
-    data_size = test_h5_handle.values()[0].shape[0]
-    chunk_size = 50
-    qq = 0
-    test_data_list=[]
-    while (qq+chunk_size)<=data_size:
-        test_data_list.append({key: test_h5_handle[key][qq:(qq+chunk_size)] for key in model.inputs})
-        qq+=chunk_size
-    test_data_list.append({key: test_h5_handle[key][qq:] for key in model.inputs})
-    model.initialize()
+    model = load_integrator(FLAGS.savePath)
+    test_data_list = chunk_test_data(test_h5_handle, model.inputs, chunk_size=50)
 
     print('Generating representations')
-    repr_h5_handle = h5py.File(os.path.join(FLAGS.savePath, 'representations.h5'), 'w')
-    # get representations for each tracks and scaffolds.
-    tmp_dct = {}
-    reprDict = model.get_representations({key:val[:2] for key,val in test_data_list[0].items()})
-    for key, val in reprDict.items():
-        tmp_dct[key] = np.zeros((data_size,) + reprDict[key].shape[1:])
-    qq = 0
-    for test_data in tq(test_data_list):
-        reprDict = model.get_representations(test_data)
-        for key,val in reprDict.items():
-            tmp_dct[key][qq:(qq+val.shape[0]),:] = val[:]
-        qq += val.shape[0]
+    export_batched(model.get_representations, test_data_list, os.path.join(FLAGS.savePath, 'representations.h5'))
+    #TODO: 2.visualization (t-SNE etc.)
+    print('Generating predictions')
+    export_batched(model.predict, test_data_list, os.path.join(FLAGS.savePath, 'predictions.h5'))
+    #TODO: filter visualization
+    model.sess.close()
 
-    for key, val in reprDict.items():
-        tmp = repr_h5_handle.create_dataset(key, tmp_dct[key].shape)
-        tmp[:] = tmp_dct[key][:]
+    if FLAGS.pcaComponents > 0:
+        # single process: workers must not be forked from a process that ran TensorFlow, pca.py runs several
+        from pca import pca_representations # only loaded when representations are reduced
+        print('Reducing representations')
+        pca_representations(os.path.join(FLAGS.savePath, 'representations.h5'),
+                            os.path.join(FLAGS.savePath, 'pca.h5'),
+                            num_components=FLAGS.pcaComponents,
+                            processes=1)
 
-    repr_h5_handle.close()
 
-        #TODO: 2.dimensionality reduction and visualization (t-SNE, PCA etc.)
-    print('Saving representations')
-    pred_h5_handle = h5py.File(os.path.join(FLAGS.savePath, 'predictions.h5'), 'w')
-    # get representations for each tracks and scaffolds.
-    print('Generating predictions')
-    tmp_dct = {}
-    reprDict = model.get_representations({key: val[:2] for key, val in test_data_list[0].items()})
-    for key, val in reprDict.items():
-        tmp_dct[key] = np.zeros((data_size,) + reprDict[key].shape[1:])
-    qq = 0
+def chunk_test_data(test_h5_handle, keys, chunk_size=50):
+    """Reads the test data into memory as a list of chunks
 
-    for test_data in tq(test_data_list):
-        reprDict = model.predict(test_data)
-        for key,val in reprDict.items():
-            tmp_dct[key][qq:(qq + val.shape[0]),:] = val[:]
-        qq += reprDict[key].shape[0]
+    Args:
+        :param test_h5_handle: (h5py.File) test data
+        :param keys: (iterable) tracks to read
+        :param chunk_size: (int, default = 50) number of examples per chunk
 
-    for key, val in reprDict.items():
-        tmp = pred_h5_handle.create_dataset(key, tmp_dct[key].shape)
-        tmp[:] = tmp_dct[key][:]
+    Returns:
+        list: dictionaries {key = track name, value = chunk of data}
+    """
+    data_size = test_h5_handle.values()[0].shape[0]
+    return [{key: test_h5_handle[key][qq:(qq + chunk_size)] for key in keys}
+            for qq in range(0, data_size, chunk_size)]
 
-    pred_h5_handle.close()
-    print('Saving presentations')
-    #TODO: filter visualization
-    model.sess.close()
 
+def export_batched(run_function, data_list, output_path):
+    """Runs a model method (e.g. model.predict) over chunks of data and saves the concatenated results
+
+    Args:
+        :param run_function: (callable) returns a dictionary of arrays for a chunk of data
+        :param data_list: (list) chunks of data, as returned by chunk_test_data
+        :param output_path: (string) hdf5 file, overwritten
+
+    Returns:
+        int: number of examples written
+    """
+    data_size = sum(test_data.values()[0].shape[0] for test_data in data_list)
+    h5_handle = h5py.File(output_path, 'w')
+    datasets = {}
+    qq = 0
+    for test_data in tq(data_list):
+        result_dict = run_function(test_data)
+        for key, val in result_dict.items():
+            if key not in datasets:
+                datasets[key] = h5_handle.create_dataset(key, (data_size,) + val.shape[1:])
+            datasets[key][qq:(qq + val.shape[0])] = val
+        qq += val.shape[0]
+    h5_handle.close()
+    print('Saved ' + output_path)
+    return qq
 
 #def blah(self, predict_data):
 #    """
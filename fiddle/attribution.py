@@ -0,0 +1,184 @@
+"""'attribution.py' exports gradient based attributions of the predictions of a
+trained model to its input tracks, for a range of test regions.
+
+Methods:
+    saliency                gradients of the attributed output w.r.t. the inputs
+    grad_x_input            gradients multiplied by the inputs
+    integrated_gradients    integrated gradients from a baseline (uniform bases for dnaseq, zero signal otherwise)
+
+The attributed output is the sum of the logits (or predictions) of an output
+track over all, or a selected range of, positions. Regions are processed in
+chunks and attributions are streamed to hdf5: one group per output track
+holding a (N, height, width) dataset per input track.
+
+Example:
+        $ python attribution.py --runName your_experiment --method integrated_gradients --positions 200:300 --stop 5000
+
+FLAGS:
+    flag:                   default:                description:
+
+    --runName               'experiment'            name of run
+    --resultsDir            '../results'            directory where results from runName are stored
+    --dataDir               '../data/hdf5datasets'  directory where hdf5datasets are stored
+    --outputs               'all'                   comma separated output tracks to attribute
+    --method                'saliency'              saliency, grad_x_input or integrated_gradients
+    --quantity              'logits'                attributed decoder tensor, logits or prediction
+    --positions             ''                      start:end of the attributed output positions (on every strand), empty for all
+    --steps                 20                      interpolation steps of integrated gradients
+    --start                 0                       first test example
+    --stop                  -1                      end of the test examples, -1 for all
+    --chunkSize             256                     regions read and written at once
+    --batchSize             512                     examples (or interpolation steps) per session run
+    --float16               True                    store attributions as float16
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+
+import tensorflow as tf
+import numpy as np
+import h5py
+from tqdm import tqdm as tq
+
+### FIDDLE specific tools ###
+from models import load_integrator
+#############################
+
+METHODS = ['saliency', 'grad_x_input', 'integrated_gradients']
+
+
+def position_weights(width, positions='', height=1):
+    """Indicator of the attributed output positions, parsed from 'start:end' (empty selects all)
+
+    Args:
+        :param width: (int) positions per strand
+        :param positions: (string, default = '') start:end of the attributed positions
+        :param height: (int, default = 1) strands of the output, the range is selected on every strand
+
+    Returns:
+        numpy vector: (height * width,) weights, laid out like the flattened logits of the decoder
+    """
+    weights = np.zeros((height, width), dtype=np.float32)
+    if not positions:
+        weights[:] = 1
+        return weights.ravel()
+    start, end = [int(val) for val in positions.split(':')]
+    weights[:, start:end] = 1
+    return weights.ravel()
+
+
+def attribute(model, data, output_key, method='saliency', weights=None, quantity='logits', steps=20, batch_size=512):
+    """Attributions of one output track for a chunk of regions
+
+    Args:
+        :param model: (models.Integrator) trained model
+        :param data: (dictionary) keys = input track names, values = (N, height, width, 1) signal
+        :param output_key: (string) output track
+        :param method: (string, default = saliency) see METHODS
+        :param weights: (numpy vector, default = None) weights of the output positions
+        :param quantity: (string, default = logits) logits or prediction
+        :param steps: (int, default = 20) interpolation steps of integrated gradients
+        :param batch_size: (int, default = 512) examples (or interpolation steps) per session run
+
+    Returns:
+        dictionary: {key = input track name, value = (N, height, width, 1) attributions}
+    """
+    if method == 'integrated_gradients':
+        return model.integrated_gradients(data, output_key, weights, quantity, steps=steps, batch_size=batch_size)
+    size = data.values()[0].shape[0]
+    attributions = {}
+    for begin in range(0, size, batch_size):
+        batch = {key: val[begin:begin + batch_size] for key, val in data.items()}
+        grads = model.gradients(batch, output_key, weights, quantity)
+        for key, val in grads.items():
+            if method == 'grad_x_input':
+                val = val * batch[key]
+            attributions.setdefault(key, []).append(val)
+    return {key: np.concatenate(val) for key, val in attributions.items()}
+
+
+def export_attributions(model, test_path, output_path, output_keys, method='saliency', positions='',
+                        quantity='logits', steps=20, start=0, stop=-1, chunk_size=256, batch_size=512,
+                        dtype='float16'):
+    """Streams attributions of test regions [start, stop) to output_path, one group per output track
+
+    Returns:
+        int: number of regions written
+    """
+    if method not in METHODS:
+        raise ValueError('Unknown method: ' + str(method))
+    input_keys = list(model.architecture['Inputs'])
+    with h5py.File(test_path, 'r') as test_h5_handle, h5py.File(output_path, 'w') as output_handle:
+        size = test_h5_handle[input_keys[0]].shape[0]
+        stop = size if stop < 0 else min(stop, size)
+        output_handle.create_dataset('example_index', data=np.arange(start, stop))
+        output_handle.attrs['method'] = method
+        output_handle.attrs['quantity'] = quantity
+        output_handle.attrs['positions'] = positions
+        datasets = {}
+        for output_key in output_keys:
+            group = output_handle.create_group(output_key)
+            for key in input_keys:
+                shape = test_h5_handle[key].shape[1:3]
+                datasets[(output_key, key)] = group.create_dataset(key, (stop - start,) + shape, dtype=dtype,
+                                                                   chunks=(min(chunk_size, stop - start),) + shape)
+        for begin in tq(range(start, stop, chunk_size)):
+            end = min(begin + chunk_size, stop)
+            data = {key: test_h5_handle[key][begin:end] for key in input_keys}
+            for output_key in output_keys:
+                # Double strand logits hold the strands one after the other, the range applies to each of them
+                height = model.architecture['Modules'][output_key]['input_height'] \
+                    if model.config['Options']['Strand'] == 'Double' else 1
+                width = model.decoders[output_key].logits.get_shape().as_list()[1] // height
+                attributions = attribute(model, data, output_key, method, position_weights(width, positions, height),
+                                         quantity, steps, batch_size)
+                for key, val in attributions.items():
+                    datasets[(output_key, key)][begin - start:end - start] = val[..., 0]
+    return stop - start
+
+
+flags = tf.app.flags
+flags.DEFINE_string('runName', 'experiment', '(DEFAULT: experiment) - name of run')
+flags.DEFINE_string('resultsDir', '../results', '(DEFAULT: ../results) - directory where results from runName are stored')
+flags.DEFINE_string('dataDir', '../data/hdf5datasets', '(DEFAULT: ../data/hdf5datasets) - directory where hdf5datasets are stored')
+flags.DEFINE_string('outputs', 'all', '(DEFAULT: all) - comma separated output tracks to attribute')
+flags.DEFINE_string('method', 'saliency', '(DEFAULT: saliency) - saliency, grad_x_input or integrated_gradients')
+flags.DEFINE_string('quantity', 'logits', '(DEFAULT: logits) - attributed decoder tensor, logits or prediction')
+flags.DEFINE_string('positions', '', '(DEFAULT: all) - start:end of the attributed output positions (on every strand)')
+flags.DEFINE_integer('steps', 20, '(DEFAULT: 20) - interpolation steps of integrated gradients')
+flags.DEFINE_integer('start', 0, '(DEFAULT: 0) - first test example')
+flags.DEFINE_integer('stop', -1, '(DEFAULT: -1) - end of the test examples, -1 for all')
+flags.DEFINE_integer('chunkSize', 256, '(DEFAULT: 256) - regions read and written at once')
+flags.DEFINE_integer('batchSize', 512, '(DEFAULT: 512) - examples (or interpolation steps) per session run')
+flags.DEFINE_boolean('float16', True, '(DEFAULT: True) - store attributions as float16')
+FLAGS = flags.FLAGS
+
+def main(_):
+    """Load the trained model, export attributions of the test regions"""
+
+    FLAGS.savePath = os.path.join(FLAGS.resultsDir, FLAGS.runName)
+    model = load_integrator(FLAGS.savePath)
+    output_keys = list(model.decoders.keys()) if FLAGS.outputs == 'all' else FLAGS.outputs.split(',')
+    output_path = os.path.join(FLAGS.savePath, 'attributions_{}.h5'.format(FLAGS.method))
+    written = export_attributions(model,
+                                  os.path.join(FLAGS.dataDir, model.config['Options']['DataName'], 'test.h5'),
+                                  output_path,
+                                  output_keys,
+                                  method=FLAGS.method,
+                                  positions=FLAGS.positions,
+                                  quantity=FLAGS.quantity,
+                                  steps=FLAGS.steps,
+                                  start=FLAGS.start,
+                                  stop=FLAGS.stop,
+                                  chunk_size=FLAGS.chunkSize,
+                                  batch_size=FLAGS.batchSize,
+                                  dtype='float16' if FLAGS.float16 else 'float32')
+    print('Saved {} regions to {}'.format(written, output_path))
+    model.sess.close()
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,77 @@
+"""Precomputes the training targets of output tracks in hdf5 datasets.
+
+For every requested track, target transform (pdf, standardize) and strand
+option (Single, Double), a <track>_<transform>_<strand> dataset is added to
+the hdf5 files, e.g. tssseq_pdf_single. The Integrator feeds these as they
+are instead of transforming the raw tracks at every step.
+
+Usage:
+        $ python add_targets.py -t tssseq,chipnexus -o pdf -s Single train.h5 validation.h5 test.h5
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+from optparse import OptionParser
+import h5py
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from io_tools import transform_targets, target_key
+
+CHUNK_SIZE = 10000 # examples transformed at once
+
+
+def add_targets(h5_handle, track_names, options=('pdf',), strands=('Single',), chunk_size=CHUNK_SIZE):
+    """Adds precomputed target datasets to an hdf5 file
+
+    Args:
+        :param h5_handle: (h5py.File) file opened in append mode
+        :param track_names: (list) output tracks, (N, height, width, 1) datasets of the file
+        :param options: (tuple, default = ('pdf',)) target transforms, see io_tools.TARGET_TRANSFORMS
+        :param strands: (tuple, default = ('Single',)) strand options of configurations.json
+        :param chunk_size: (int, default = 10000) number of examples transformed at once
+
+    Returns:
+        list: names of the written datasets
+    """
+    written = []
+    for track_name in track_names:
+        track = h5_handle[track_name]
+        for option in options:
+            for strand in strands:
+                key = target_key(track_name, option, strand)
+                if key in h5_handle:
+                    del h5_handle[key]
+                width = track.shape[2] if strand == 'Single' else track.shape[1] * track.shape[2]
+                dataset = h5_handle.create_dataset(key, (track.shape[0], width), dtype='float32')
+                for ix in range(0, track.shape[0], chunk_size):
+                    dataset[ix:ix + chunk_size] = transform_targets(track[ix:ix + chunk_size], option=option,
+                                                                    strand=strand)
+                dataset.attrs['track'] = track_name
+                dataset.attrs['option'] = option
+                dataset.attrs['strand'] = strand
+                written.append(key)
+    return written
+
+
+def main():
+    usage = 'usage: %prog [options] <file.h5> [<file.h5> ...]'
+    parser = OptionParser(usage)
+    parser.add_option('-t', dest='tracks', type='str', help='Comma separated output tracks')
+    parser.add_option('-o', dest='options', default='pdf', type='str', help='Comma separated target transforms, pdf and/or standardize [Default: %default]')
+    parser.add_option('-s', dest='strands', default='Single', type='str', help='Comma separated strand options, Single and/or Double [Default: %default]')
+    parser.add_option('-c', dest='chunk_size', type='int', default=CHUNK_SIZE, help='Examples transformed at once [Default: %default]')
+    (options, args) = parser.parse_args()
+    if not options.tracks or not args:
+        parser.error('Output tracks and at least one hdf5 file are required')
+
+    for path in args:
+        with h5py.File(path, 'a') as h5_handle:
+            written = add_targets(h5_handle, options.tracks.split(','), options.options.split(','),
+                                  options.strands.split(','), chunk_size=options.chunk_size)
+        print(path + ': ' + ', '.join(written))
+
+
+if __name__ == '__main__':
+    main()
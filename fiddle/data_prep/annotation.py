@@ -0,0 +1,111 @@
+"""Projection-aware GFF3 annotation reader for region generation.
+
+Only the requested columns are converted, records are filtered by type and
+source while scanning, and the attributes column is left undecoded unless
+asked for. Plain and gzipped files are read in large blocks.
+
+Usage:
+        > from annotation import read_gff3
+        > loci = read_gff3('Homo_sapiens.GRCh38.gff3.gz', types=['CDS'], sources=['ensembl'])
+"""
+
+import gzip
+import numpy as np
+
+try:
+    from urllib import unquote  # python 2
+except ImportError:
+    from urllib.parse import unquote
+
+GFF3_COLUMNS = ['seqid', 'source', 'type', 'start', 'end', 'score', 'strand', 'phase', 'attributes']
+DEFAULT_COLUMNS = ('seqid', 'source', 'type', 'start', 'end', 'strand')
+BLOCK_SIZE = 1 << 24 # 16MB
+
+
+def iter_lines(filename, block_size=BLOCK_SIZE):
+    """Iterates over the lines of a (optionally gzipped) file, reading it in large blocks
+
+    Args:
+        :param filename: (string) path to file, gzipped if it ends with .gz
+        :param block_size: (int, default = 16MB) number of bytes read at once
+
+    Returns:
+        iterator: lines as bytes, without the trailing newline
+    """
+    open_func = gzip.open if filename.endswith('.gz') else open
+    with open_func(filename, 'rb') as fp:
+        remainder = b''
+        while True:
+            block = fp.read(block_size)
+            if not block:
+                break
+            lines = (remainder + block).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line
+        if remainder:
+            yield remainder
+
+
+def parse_attributes(attribute_string):
+    """Parses the GFF3 attribute column into a dictionary"""
+    if attribute_string == '.':
+        return {}
+    attributes = {}
+    for attribute in attribute_string.split(';'):
+        if attribute:
+            key, value = attribute.split('=', 1)
+            attributes[unquote(key)] = unquote(value)
+    return attributes
+
+
+def read_gff3(filename, columns=DEFAULT_COLUMNS, types=None, sources=None, block_size=BLOCK_SIZE):
+    """Reads selected columns of the records of a GFF3 file into arrays
+
+    Args:
+        :param filename: (string) gff3 file, gzipped if it ends with .gz
+        :param columns: (iterable, default = seqid, source, type, start, end, strand) columns to return,
+                        'attributes' returns a list of decoded dictionaries
+        :param types: (iterable, default = None) keep only records of these types
+        :param sources: (iterable, default = None) keep only records from these sources
+        :param block_size: (int, default = 16MB) number of bytes read at once
+
+    Returns:
+        dictionary: {key = column name, value = numpy array}, '.' fields are kept as '.' (or -1 for start/end)
+    """
+    for column in columns:
+        if column not in GFF3_COLUMNS:
+            raise ValueError('Unknown GFF3 column: ' + column)
+    col_idx = [GFF3_COLUMNS.index(column) for column in columns]
+    types = None if types is None else set(t.encode('ascii') for t in types)
+    sources = None if sources is None else set(s.encode('ascii') for s in sources)
+    # only split as far as the last column that is needed
+    max_split = max(col_idx + [1 if sources else 0, 2 if types else 0]) + 1
+
+    values = [[] for _ in columns]
+    for line_number, line in enumerate(iter_lines(filename, block_size), 1):
+        if line.startswith(b'##FASTA'):
+            # the rest of the file holds sequences, not features
+            break
+        if not line.strip() or line.startswith(b'#'):
+            continue
+        if line.count(b'\t') < len(GFF3_COLUMNS) - 1:
+            raise ValueError('{}:{}: expected {} tab separated columns in GFF3 feature line'.format(
+                filename, line_number, len(GFF3_COLUMNS)))
+        parts = line.split(b'\t', max_split)
+        if (types is not None and parts[2] not in types) or (sources is not None and parts[1] not in sources):
+            continue
+        for vals, ix in zip(values, col_idx):
+            vals.append(parts[ix])
+
+    result = {}
+    for column, vals in zip(columns, values):
+        if column in ('start', 'end'):
+            result[column] = np.array([-1 if val == b'.' else int(val) for val in vals], dtype=np.int64)
+        elif column == 'score':
+            result[column] = np.array([np.nan if val == b'.' else float(val) for val in vals])
+        elif column == 'attributes':
+            result[column] = [parse_attributes(val.rstrip(b'\r').decode('utf-8')) for val in vals]
+        else:
+            result[column] = np.array(vals).astype(str)
+    return result
@@ -0,0 +1,107 @@
+"""Content addressed cache for data preparation stages.
+
+Each stage result (a dictionary of numpy arrays) is stored under a key built
+from the digests of its input files and its parameters, so rerunning data
+preparation only recomputes the stages whose inputs or parameters changed.
+
+Usage:
+        > from cache import PrepCache
+        > cache = PrepCache('.fiddle_cache')
+        > arrays = cache.run('sequences', [fasta_path], {'mirror': False}, encode_function)
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+DIGEST_BLOCK_SIZE = 1 << 20 # 1MB
+
+
+class PrepCache(object):
+    """Stores data preparation stage outputs keyed by input file digests and parameters"""
+
+    def __init__(self, cache_dir, verbose=True):
+        """
+        Args:
+            :param cache_dir: (string) directory of the cache, created if missing
+            :param verbose: (boolean, default = True) print cache hits and misses
+        """
+        self.cache_dir = cache_dir
+        self.verbose = verbose
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._digest_file = os.path.join(cache_dir, 'digests.json')
+        self._digests = {}
+        if os.path.exists(self._digest_file):
+            with open(self._digest_file) as fp:
+                self._digests = json.load(fp)
+
+    def file_digest(self, path):
+        """SHA1 of the file content, only recomputed when its size or modification time changes
+
+        Args:
+            :param path: (string) input file
+
+        Returns:
+            string: hex digest
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self._digests.get(path)
+        if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+            return known['digest']
+        sha = hashlib.sha1()
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(DIGEST_BLOCK_SIZE), b''):
+                sha.update(block)
+        self._digests[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': sha.hexdigest()}
+        with open(self._digest_file, 'w') as fp:
+            json.dump(self._digests, fp)
+        return sha.hexdigest()
+
+    def key(self, stage, inputs, params):
+        """Cache key of a stage
+
+        Args:
+            :param stage: (string) name of the stage
+            :param inputs: (list) input file paths
+            :param params: (dictionary) parameters the stage output depends on, e.g. width, stride, seed
+
+        Returns:
+            string: hex digest identifying the stage output
+        """
+        description = {'stage': stage,
+                       'inputs': [self.file_digest(path) for path in inputs],
+                       'params': params}
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, stage, key):
+        return os.path.join(self.cache_dir, '{}-{}.npz'.format(stage, key))
+
+    def run(self, stage, inputs, params, func):
+        """Returns the cached output of a stage, computing and storing it if missing
+
+        Args:
+            :param stage: (string) name of the stage
+            :param inputs: (list) input file paths
+            :param params: (dictionary) parameters the stage output depends on
+            :param func: (callable) computes the stage, returns a dictionary of numpy arrays
+
+        Returns:
+            dictionary: {key = array name, value = numpy array}
+        """
+        path = self._path(stage, self.key(stage, inputs, params))
+        if os.path.exists(path):
+            if self.verbose:
+                print('Using cached ' + stage + ' for ' + ', '.join(inputs))
+            with np.load(path) as cached:
+                return {name: cached[name] for name in cached.files}
+        if self.verbose:
+            print('Computing ' + stage + ' for ' + ', '.join(inputs))
+        result = func()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            np.savez(fp, **result)
+        os.rename(tmp_path, path)
+        return result
@@ -1,10 +1,16 @@
 import numpy as np
 from tqdm import tqdm as tq
+import os
 import sys
 sys.path.append('/Users/umut/Projects/ClassifySpecies/analysis/')
 from genericFunctions import *
 from optparse import OptionParser
 import h5py
+from cache import PrepCache
+from qc import region_qc, subset_qc, write_qc, summarize_qc
+from add_targets import add_targets
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from io_tools import sequence_to_codes, codes_to_one_hot
 
 from optparse import OptionParser
 
@@ -12,20 +18,16 @@ usage = 'usage: %prog <out_file_name>'
 parser = OptionParser(usage)
 parser.add_option('-e', dest='width', type='int', default=500, help='Extend all sequences to this length [Default: %default]')
 parser.add_option('-r', dest='stride', default=20, type='int', help='Stride sequences [Default: %default]')
+parser.add_option('-c', dest='cache_dir', default='.fiddle_cache', type='str', help='Directory caching prepared stages [Default: %default]')
+parser.add_option('-s', dest='seed', default=None, type='int', help='Seed of the train/validation/test split [Default: %default]')
+parser.add_option('-t', dest='targets', default=None, type='str', help='Comma separated target transforms (pdf, standardize) to precompute for the output tracks [Default: %default]')
+parser.add_option('-d', dest='strands', default='Single', type='str', help='Comma separated strand options (Single, Double) of the precomputed targets [Default: %default]')
+parser.add_option('-k', dest='target_tracks', default='tssseq,chipnexus', type='str', help='Comma separated output tracks of the precomputed targets [Default: %default]')
 
 (options,args) = parser.parse_args()
 f_name = args[0]
 
 
-def one_hot_encode_sequence(seq):
-    # the order of the letters is not arbitrary.
-    # Flip the matrix up-down and left-right for reverse compliment
-    seq = seq.lower()
-    letterdict = {'a': [1, 0, 0, 0], 'c': [0, 1, 0, 0], 'g': [0, 0, 1, 0], 't': [0, 0, 0, 1],
-               'n': [0.25, 0.25, 0.25, 0.25]}
-    result = np.array([letterdict[x] for x in seq])
-    return result.T
-
 def get_fasta(file_path):
     seqs=[]
     with open(file_path, 'r') as fr:
@@ -37,50 +39,64 @@ def get_fasta(file_path):
                 break
     return seqs
 
+def encode_fasta(file_path):
+    # byte codes of the sequences, cached at one byte per base and expanded by decode_sequences
+    return {'codes': np.array([sequence_to_codes(seq) for seq in get_fasta(file_path)])}
+
+def decode_sequences(codes, mirror=False):
+    # one hot encoded sequences, reverse complemented if mirror
+    seqs_array = codes_to_one_hot(codes)
+    if mirror:
+        seqs_array = seqs_array[:, ::-1, ::-1]
+    return seqs_array
+
+def load_matrix(file_path, width, flip=False):
+    # sense/antisense halves of a bwtool matrix
+    tmp = np.genfromtxt(file_path)
+    if flip:
+        tmp = np.fliplr(tmp)
+    return {'sense': tmp[:, :width],
+            'antisense': tmp[:, width:]}
+
+def load_strand(cache, fasta_path, matrix_paths, flip=False):
+    # cached stages for one strand: region QC, encoded sequences and per-track windows
+    params = {'width': options.width, 'stride': options.stride, 'flip': flip}
+    qc = cache.run('qc', [matrix_paths[key] for key in sorted(matrix_paths)], {},
+                   lambda: region_qc(matrix_paths))
+    summarize_qc(qc)
+    keep = qc['valid']
+    codes = cache.run('sequence_codes', [fasta_path], {}, lambda: encode_fasta(fasta_path))['codes']
+    dnaseq = decode_sequences(codes, mirror=flip)
+    tracks = {key: cache.run('track', [path], params, lambda path=path: load_matrix(path, options.width, flip))
+              for key, path in matrix_paths.items()}
+    data = {key + '_se': track['sense'][keep] for key, track in tracks.items()}
+    data.update({key + '_as': track['antisense'][keep] for key, track in tracks.items()})
+    data['dnaseq'] = dnaseq[keep]
+    # every kept region is valid, so the split QC files carry the statistics only
+    data['qc'] = subset_qc({key: val for key, val in qc.items() if key != 'valid'}, keep)
+    data['all_qc'] = qc
+    return data
+
 
 
 def main():
-    seqs = get_fasta('sense.fa')
-    seqs_array = np.array(map(one_hot_encode_sequence, seqs))
+    cache = PrepCache(options.cache_dir)
     smpl = 'Dia_Cnt'
     print('Reading ' + smpl + ' sense')
-
-    tmp_ts = np.genfromtxt('Dia_Cnt.ts.sense_asense.txt')
-    tmp_cn = np.genfromtxt('Dia_Cnt.cn.sense_asense.txt')
-
-    tf1 = np.sum(np.isnan(tmp_ts),axis=1)>0
-    tf2 = np.sum(np.isnan(tmp_cn),axis=1)>0
-    tf3 = ~(tf1|tf2)
-    tssseq_se = tmp_ts[tf3, :500]
-    tssseq_as = tmp_ts[tf3, 500:]
-    chipnexus_se = tmp_cn[tf3, :500]
-    chipnexus_as = tmp_cn[tf3, 500:]
-    dnaseq = seqs_array[tf3, :, :]
+    sense = load_strand(cache, 'sense.fa', {'tssseq': 'Dia_Cnt.ts.sense_asense.txt',
+                                            'chipnexus': 'Dia_Cnt.cn.sense_asense.txt'})
 
     print('Reading ' + smpl + ' antisense')
+    antisense = load_strand(cache, 'asense_tbf.fa', {'tssseq': 'Dia_Cnt.ts.asense_sense_tbf.txt',
+                                                     'chipnexus': 'Dia_Cnt.cn.asense_sense_tbf.txt'}, flip=True)
 
-    seqs = get_fasta('asense_tbf.fa')
-    seqs_array = np.array(map(one_hot_encode_sequence, seqs))
-
-    tmp_ts = np.fliplr(np.genfromtxt('Dia_Cnt.ts.asense_sense_tbf.txt'))
-    tmp_cn = np.fliplr(np.genfromtxt('Dia_Cnt.cn.asense_sense_tbf.txt'))
-    idx = np.sort(np.unique(np.r_[np.where(np.sum(np.isnan(tmp_ts), axis=1) == 0)[0],
-                                  np.where(np.sum(np.isnan(tmp_cn), axis=1) == 0)[0]]))
-
-    tf1 = np.sum(np.isnan(tmp_ts),axis=1)>0
-    tf2 = np.sum(np.isnan(tmp_cn),axis=1)>0
-    tf3 = ~(tf1|tf2)
-
-    tssseq_se = np.r_[tssseq_se, tmp_ts[tf3, :500]]
-    tssseq_as = np.r_[tssseq_as, tmp_ts[tf3, 500:]]
-    chipnexus_se = np.r_[chipnexus_se, tmp_cn[tf3, :500]]
-    chipnexus_as = np.r_[chipnexus_as, tmp_cn[tf3, 500:]]
-
-    tmparr =seqs_array[tf3,:,:]
-    for ii in range(tmparr.shape[0]):
-        tmparr[ii] = np.flipud(np.fliplr(tmparr[ii, :, :]))
-
-    dnaseq = np.r_[dnaseq, tmparr]
+    tssseq_se = np.r_[sense['tssseq_se'], antisense['tssseq_se']]
+    tssseq_as = np.r_[sense['tssseq_as'], antisense['tssseq_as']]
+    chipnexus_se = np.r_[sense['chipnexus_se'], antisense['chipnexus_se']]
+    chipnexus_as = np.r_[sense['chipnexus_as'], antisense['chipnexus_as']]
+    dnaseq = np.r_[sense['dnaseq'], antisense['dnaseq']]
+    qc = {key: np.r_[sense['qc'][key], antisense['qc'][key]] for key in sense['qc']}
+    all_qc = {key: np.r_[sense['all_qc'][key], antisense['all_qc'][key]] for key in sense['all_qc']}
 
     print('data were read...')
 
@@ -90,7 +106,7 @@ def main():
     test_ratio=0.1
 
     idx = np.arange(tssseq_se.shape[0])
-    np.random.shuffle(idx)
+    np.random.RandomState(options.seed).shuffle(idx)
     validation_size = int(len(idx)*validation_ratio)
     test_size = int(len(idx)*test_ratio)
     train_size = len(idx)-validation_size-test_size
@@ -139,9 +155,23 @@ def main():
     test[:,0,:,0] = chipnexus_se[idx[(train_size+validation_size):]]
     test[:,1,:,0] = chipnexus_as[idx[(train_size+validation_size):]]
 
+    if options.targets is not None:
+        print('creating h5 files... precomputed targets')
+        for h5_handle in [train_h5, validation_h5, test_h5]:
+            add_targets(h5_handle, options.target_tracks.split(','), options.targets.split(','),
+                        options.strands.split(','))
+
     train_h5.close()
     validation_h5.close()
     test_h5.close()
+
+    print('creating h5 files... region QC')
+    # region statistics aligned with the rows of each split, for filtering and sampling
+    write_qc(subset_qc(qc, idx[:train_size]), os.path.join(directory, 'train_qc.h5'))
+    write_qc(subset_qc(qc, idx[train_size:(train_size+validation_size)]), os.path.join(directory, 'validation_qc.h5'))
+    write_qc(subset_qc(qc, idx[(train_size+validation_size):]), os.path.join(directory, 'test_qc.h5'))
+    # all regions of the sense, then antisense matrices, before filtering; 'valid' marks the kept ones
+    write_qc(all_qc, os.path.join(directory, 'regions_qc.h5'))
     print('Done...')
 
 
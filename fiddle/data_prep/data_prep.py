@@ -1,5 +1,10 @@
+import os
+import sys
 import h5py
 import numpy as np
+from cache import PrepCache
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from io_tools import sequence_to_codes, codes_to_one_hot
 
 def main():
 
@@ -10,18 +15,22 @@ def main():
     chipnexus = h5pnt.create_dataset('chipnexus', (max_size, 2, 500, 1))
     quality = h5pnt.create_dataset('quality', (max_size,))
 
+    cache = PrepCache('.fiddle_cache')
     qq = 0
     qq2 = 0
     qual = ['HQ', 'MQ', 'LQ']
     for ix in range(3):
         if qq2 == max_size:
             break
-        seqs = get_fasta('/Users/umut/Projects/intragenicTranscription/data/extracts/' + qual[ix] + '.fa')
-        seqs_array = np.array(map(one_hot_encode_sequence, seqs))
+        fasta_path = '/Users/umut/Projects/intragenicTranscription/data/extracts/' + qual[ix] + '.fa'
+        seqs_array = codes_to_one_hot(cache.run('sequence_codes', [fasta_path], {},
+                                                lambda: encode_fasta(fasta_path))['codes'])
         for smpl in ['Dia', 'Dia_Cnt']:
             print('Doing ' + smpl + ' ' + qual[ix])
-            tmp_ts = np.genfromtxt('/Users/umut/Projects/intragenicTranscription/data/extracts/' + qual[ix] + '_' + smpl + '.ts.pos_neg.txt')
-            tmp_cn = np.genfromtxt('/Users/umut/Projects/intragenicTranscription/data/extracts/' + qual[ix] + '_' + smpl + '.cn.pos_neg.txt')
+            ts_path = '/Users/umut/Projects/intragenicTranscription/data/extracts/' + qual[ix] + '_' + smpl + '.ts.pos_neg.txt'
+            cn_path = '/Users/umut/Projects/intragenicTranscription/data/extracts/' + qual[ix] + '_' + smpl + '.cn.pos_neg.txt'
+            tmp_ts = cache.run('matrix', [ts_path], {}, lambda: {'matrix': np.genfromtxt(ts_path)})['matrix']
+            tmp_cn = cache.run('matrix', [cn_path], {}, lambda: {'matrix': np.genfromtxt(cn_path)})['matrix']
             idx = np.sort(np.unique(np.r_[np.where(np.sum(np.isnan(tmp_ts), axis=1) == 0)[0],
                                           np.where(np.sum(np.isnan(tmp_cn), axis=1) == 0)[0]]))
             qq2 = (qq + len(idx))
@@ -75,14 +84,9 @@ def main():
 
 
 
-def one_hot_encode_sequence(seq):
-    # the order of the letters is not arbitrary.
-    # Flip the matrix up-down and left-right for reverse compliment
-    seq = seq.lower()
-    letterdict = {'a': [1, 0, 0, 0], 'c': [0, 1, 0, 0], 'g': [0, 0, 1, 0], 't': [0, 0, 0, 1],
-               'n': [0.25, 0.25, 0.25, 0.25]}
-    result = np.array([letterdict[x] for x in seq])
-    return result.T
+def encode_fasta(file_path):
+    # byte codes of the sequences of a fasta file, cached at one byte per base
+    return {'codes': np.array([sequence_to_codes(seq) for seq in get_fasta(file_path)])}
 
 def get_fasta(file_path):
     seqs=[]
@@ -3,8 +3,12 @@ from optparse import OptionParser
 import os
 import numpy as np
 from tqdm import tqdm as tq
+from multiprocessing import Pool
+from annotation import read_gff3
 import pdb
 
+CHUNK_SIZE = 1000000 # number of regions formatted per worker task
+
 def main():
     usage = 'usage: %prog [options] <chr_size> <out_file_name> <annotation_file_path> '
     parser = OptionParser(usage)
@@ -14,59 +18,175 @@ def main():
     parser.add_option('-u', dest='upstream', default=500, type='int', help='Upstream distance to locus of interest to include [Default: %default]')
     parser.add_option('-d', dest='downstream', default=500, type='int', help='Upstream distance to locus of interest to include [Default: %default]')
     parser.add_option('-s', dest='split', default=2, type='int', help='Split into validation and test sets i.e. 0: only train, 1:train and test, 2: train test and validation [Default: %default]')
+    parser.add_option('-p', dest='processes', default=4, type='int', help='Number of processes writing the BED file [Default: %default]')
     (options, args) = parser.parse_args()
 
     # Make directory for the project, establish indexing bounds
-    directory = "~/Projects/FIDDLE/data/regions/"
+    directory = os.path.expanduser("~/Projects/FIDDLE/data/regions/")
     if not os.path.exists(directory):
         os.makedirs(directory)
 
     save_path = os.path.join(directory, args[1])
-    xran_pos = np.arange(-options.upstream, options.downstream, options.stride)
-    xran_neg = np.arange(-options.downstream, options.upstream, options.stride)
-
+    with open(args[0], 'r') as f:
+        chr_sizes = {line.split('\t')[0]: int(line.split('\t')[-1].split('\n')[0]) for line in f if line.strip()}
 
     if 'gff' in args[2][-4:]:
-        from parse_gff3 import parseGFF3
-        with open(args[0], 'r') as f:
-            chr_sizes = {line.split('\t')[0]: (1, int(line.split('\t')[-1].split('\n')[0])) for line in f.readlines()}
         # Read in gff3 annotation file
-        with open(save_path, 'w') as fw:
-            for record in tq(parseGFF3(args[2])):
-                if (record['type'] != options.loci_of_interest) or \
-                        (record['source'] != 'ensembl') or \
-                        (record['seqid'] == 'Mito') or \
-                        ((record['end'] - max(options.upstream, options.downstream)) > chr_sizes['chr' + record['seqid']]):
-                    continue
-                starts = record['start'] + xran_pos if record['strand'] == '+' else record['end'] + xran_neg
-                starts = starts[starts > 0]
-                list_to_write = ['chr' + record['seqid'] + '\t' + str(st) + '\t' + str(st + options.width) + '\t.\t.\t' + record['strand']
-                                 for st in starts]
-                fw.write('\n'.join(list_to_write)+'\n')
+        loci = read_gff3_loci(args[2], options.loci_of_interest)
+        xran_pos = np.arange(-options.upstream, options.downstream, options.stride)
+        xran_neg = np.arange(-options.downstream, options.upstream, options.stride)
+        regions = expand_windows(loci, xran_pos, xran_neg, options.width)
+        columns = 6
     elif 'bed' in args[2][-4:]:
         import pandas as pd
 
-        df = pd.read_csv(args[2],sep='\t', header=None)
-        df.drop(df.columns[3:], axis=1, inplace=True)
-        df.columns=['chr', 'start', 'end']
+        df = pd.read_csv(args[2], sep='\t', header=None, usecols=[0, 1, 2])
+        df.columns = ['chr', 'start', 'end']
 
         print('Random striding ...')
-        # pdb.set_trace()
+        regions = random_shift_windows(df['chr'].values.astype(str), df['start'].values, df['end'].values,
+                                       width=500, max_shift=1000, repeats=10)
+        columns = 3
+
+    regions = filter_by_chrom_sizes(regions, chr_sizes)
+    write_bed(regions, save_path, columns=columns, processes=options.processes)
+    index_path = save_region_index(regions, save_path)
+    print('Saved to: ' + save_path + ' (index: ' + index_path + ')')
+
+
+def read_gff3_loci(annotation_path, loci_of_interest, source='ensembl'):
+    """Collects the loci of interest of a gff3 annotation into arrays
+
+    Args:
+        :param annotation_path: (string) gff3 (optionally gzipped) annotation file
+        :param loci_of_interest: (string) record type to keep, e.g. CDS
+        :param source: (string, default = ensembl) record source to keep
+
+    Returns:
+        dictionary: {chrom, start, end, strand} numpy arrays, one entry per locus
+    """
+    loci = read_gff3(annotation_path, columns=['seqid', 'start', 'end', 'strand'],
+                     types=[loci_of_interest], sources=[source])
+    keep = loci['seqid'] != 'Mito'
+    return {'chrom': np.char.add('chr', loci['seqid'][keep]),
+            'start': loci['start'][keep],
+            'end': loci['end'][keep],
+            'strand': loci['strand'][keep]}
+
+
+def expand_windows(loci, xran_pos, xran_neg, width):
+    """Expands every locus into strided windows with broadcasting
+
+    Windows are anchored at the start of plus strand loci and at the end of
+    minus strand loci.
+
+    Args:
+        :param loci: (dictionary) {chrom, start, end, strand} arrays
+        :param xran_pos: (array) window offsets for plus strand loci
+        :param xran_neg: (array) window offsets for minus strand loci
+        :param width: (int) window width
+
+    Returns:
+        dictionary: {chrom, start, end, strand} numpy arrays, one entry per window
+    """
+    is_pos = loci['strand'] == '+'
+    anchors = np.where(is_pos, loci['start'], loci['end'])
+    starts = anchors[:, None] + np.where(is_pos[:, None], xran_pos[None, :], xran_neg[None, :])
+    num_offsets = starts.shape[1]
+    return {'chrom': np.repeat(loci['chrom'], num_offsets),
+            'start': starts.ravel(),
+            'end': starts.ravel() + width,
+            'strand': np.repeat(loci['strand'], num_offsets)}
+
+
+def random_shift_windows(chroms, starts, ends, width=500, max_shift=1000, repeats=10, seed=None):
+    """Centers regions and adds randomly shifted copies of each of them
+
+    Args:
+        :param chroms, starts, ends: (arrays) regions to center windows on
+        :param width: (int, default = 500) window width
+        :param max_shift: (int, default = 1000) maximum random shift
+        :param repeats: (int, default = 10) number of shifted copies per region
+        :param seed: (int, default = None) random seed
+
+    Returns:
+        dictionary: {chrom, start, end, strand} numpy arrays, centered windows first
+    """
+    centered = ((starts + ends) / 2).astype(np.int64) - max_shift // 2
+    shifts = np.random.RandomState(seed).randint(max_shift, size=(repeats, len(centered)))
+    new_starts = np.concatenate([centered, (centered[None, :] + shifts).ravel()])
+    return {'chrom': np.tile(chroms, repeats + 1),
+            'start': new_starts,
+            'end': new_starts + width,
+            'strand': np.repeat(np.array(['.']), len(new_starts))}
+
+
+def filter_by_chrom_sizes(regions, chr_sizes):
+    """Removes windows on unknown chromosomes or outside of chromosome bounds
+
+    Args:
+        :param regions: (dictionary) {chrom, start, end, strand} arrays
+        :param chr_sizes: (dictionary) {key = chromosome name, value = chromosome length}
+
+    Returns:
+        dictionary: regions that fit in their chromosome
+    """
+    chrom_names, chrom_idx = np.unique(regions['chrom'], return_inverse=True)
+    sizes = np.array([chr_sizes.get(chrom, -1) for chrom in chrom_names], dtype=np.int64)[chrom_idx]
+    keep = (regions['start'] > 0) & (regions['end'] <= sizes)
+    print('Keeping {} of {} regions'.format(keep.sum(), len(keep)))
+    return {key: val[keep] for key, val in regions.items()}
+
+
+def _format_bed_chunk(chunk):
+    chroms, starts, ends, strands, columns = chunk
+    if columns == 3:
+        lines = ['{}\t{}\t{}'.format(*row) for row in zip(chroms, starts.tolist(), ends.tolist())]
+    else:
+        lines = ['{}\t{}\t{}\t.\t.\t{}'.format(*row) for row in zip(chroms, starts.tolist(), ends.tolist(), strands)]
+    return '\n'.join(lines) + '\n'
+
+
+def write_bed(regions, save_path, columns=6, processes=4):
+    """Writes regions as a BED file, formatting chunks of lines in parallel
+
+    Args:
+        :param regions: (dictionary) {chrom, start, end, strand} arrays
+        :param save_path: (string) output BED file
+        :param columns: (int, default = 6) 3 for chrom/start/end only, 6 to include the strand
+        :param processes: (int, default = 4) number of worker processes
+    """
+    size = len(regions['start'])
+    chunks = ((regions['chrom'][ix:ix + CHUNK_SIZE], regions['start'][ix:ix + CHUNK_SIZE],
+               regions['end'][ix:ix + CHUNK_SIZE], regions['strand'][ix:ix + CHUNK_SIZE], columns)
+              for ix in range(0, size, CHUNK_SIZE))
+    with open(save_path, 'w') as fw:
+        if processes > 1 and size > CHUNK_SIZE:
+            pool = Pool(processes)
+            for text in pool.imap(_format_bed_chunk, chunks):
+                fw.write(text)
+            pool.close()
+            pool.join()
+        else:
+            for chunk in chunks:
+                fw.write(_format_bed_chunk(chunk))
 
-        shp = df.shape[0]
-        starts = ((df['start'].values+df['end'].values)/2).astype(int) - 500
-        chrs = df['chr'].values
 
+def save_region_index(regions, save_path):
+    """Saves the regions as a binary index alongside the BED file
 
-        df_new = pd.DataFrame({'chr':chrs, 'start': starts, 'end': starts + 500})
+    Args:
+        :param regions: (dictionary) {chrom, start, end, strand} arrays
+        :param save_path: (string) BED file path, the index is saved as <name>.npz
 
+    Returns:
+        string: path of the index
+    """
+    index_path = (os.path.splitext(save_path)[0] if save_path.endswith('.bed') else save_path) + '.npz'
+    with open(index_path, 'wb') as fp:
+        np.savez(fp, **regions)
+    return index_path
 
-        for ix in tq(range(10)):
-            rands = np.random.randint(1000, size=shp)
-            new_starts = starts + rands
-            df_new = df_new.append(pd.DataFrame({'chr':chrs, 'start': new_starts, 'end': new_starts + 500}))
 
-        df_new.to_csv(save_path, sep='\t', header=False, index=False, columns=['chr', 'start', 'end'])
-        print('Saved to: ' + save_path)
 if __name__ == '__main__':
     main()
@@ -0,0 +1,112 @@
+"""Streaming region quality control for data preparation.
+
+Reads the bwtool matrices of all tracks side by side in chunks and computes,
+in a single pass, a per-region validity mask (no NaN in any track) along with
+per-track coverage and signal statistics. Neither filtering nor sampling
+needs to reload the raw matrices afterwards.
+
+Usage:
+        $ python qc.py regions_qc.h5 tssseq=Dia.ts.sense_asense.txt chipnexus=Dia.cn.sense_asense.txt
+"""
+
+from __future__ import print_function
+
+import itertools
+from optparse import OptionParser
+import numpy as np
+import h5py
+
+CHUNK_SIZE = 10000 # regions parsed at once
+
+
+def _chunk_stats(matrix):
+    is_nan = np.isnan(matrix)
+    total_signal = np.where(is_nan, 0, matrix).sum(axis=1)
+    return {'nan_count': is_nan.sum(axis=1).astype(np.int32),
+            'total_signal': total_signal,
+            'coverage': ((matrix != 0) & ~is_nan).mean(axis=1).astype(np.float32),
+            'zero_signal': total_signal == 0}
+
+
+def region_qc(matrix_paths, chunk_size=CHUNK_SIZE):
+    """Computes validity masks and signal statistics of all tracks in one chunked pass
+
+    Args:
+        :param matrix_paths: (dictionary) {key = track name, value = bwtool matrix file}, all with the same regions
+        :param chunk_size: (int, default = 10000) number of regions parsed at once
+
+    Returns:
+        dictionary: 'valid' boolean mask, and <track>_nan_count, <track>_total_signal,
+                    <track>_coverage (fraction of non-zero bases) and <track>_zero_signal per region
+    """
+    names = sorted(matrix_paths)
+    handles = [open(matrix_paths[name]) for name in names]
+    stats = {name: [] for name in names}
+    valid = []
+    try:
+        while True:
+            chunks = [list(itertools.islice(fp, chunk_size)) for fp in handles]
+            sizes = set(len(chunk) for chunk in chunks)
+            if len(sizes) > 1:
+                raise ValueError('Matrices do not have the same number of regions: ' + ', '.join(names))
+            if sizes.pop() == 0:
+                break
+            chunk_valid = None
+            for name, chunk in zip(names, chunks):
+                chunk_stats = _chunk_stats(np.atleast_2d(np.genfromtxt(chunk)))
+                stats[name].append(chunk_stats)
+                no_nan = chunk_stats['nan_count'] == 0
+                chunk_valid = no_nan if chunk_valid is None else (chunk_valid & no_nan)
+            valid.append(chunk_valid)
+    finally:
+        for fp in handles:
+            fp.close()
+
+    qc = {'valid': np.concatenate(valid) if valid else np.zeros(0, dtype=bool)}
+    for name in names:
+        for stat in ['nan_count', 'total_signal', 'coverage', 'zero_signal']:
+            qc[name + '_' + stat] = np.concatenate([chunk_stats[stat] for chunk_stats in stats[name]]) \
+                if stats[name] else np.zeros(0)
+    return qc
+
+
+def subset_qc(qc, index):
+    """Selects (and reorders) the regions of a qc dictionary"""
+    return {key: val[index] for key, val in qc.items()}
+
+
+def write_qc(qc, output_path):
+    """Writes a qc dictionary as datasets of an hdf5 file
+
+    Args:
+        :param qc: (dictionary) as returned by region_qc
+        :param output_path: (string) hdf5 file, overwritten
+    """
+    with h5py.File(output_path, 'w') as h5_handle:
+        for key, val in qc.items():
+            h5_handle.create_dataset(key, data=val)
+
+
+def summarize_qc(qc):
+    """Prints the number of valid regions and zero signal fractions per track"""
+    print('valid regions: {} of {}'.format(int(qc['valid'].sum()), len(qc['valid'])))
+    for key in sorted(qc):
+        if key.endswith('_zero_signal'):
+            print('{}: {:.1%} zero signal, {:.1%} mean coverage'.format(
+                key[:-len('_zero_signal')], qc[key].mean(), qc[key[:-len('zero_signal')] + 'coverage'].mean()))
+
+
+def main():
+    usage = 'usage: %prog [options] <out_file_name.h5> <track_name=matrix_file> [<track_name=matrix_file> ...]'
+    parser = OptionParser(usage)
+    parser.add_option('-c', dest='chunk_size', type='int', default=CHUNK_SIZE, help='Regions parsed at once [Default: %default]')
+    (options, args) = parser.parse_args()
+
+    matrix_paths = dict(arg.split('=', 1) for arg in args[1:])
+    qc = region_qc(matrix_paths, chunk_size=options.chunk_size)
+    write_qc(qc, args[0])
+    summarize_qc(qc)
+
+
+if __name__ == '__main__':
+    main()
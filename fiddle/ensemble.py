@@ -0,0 +1,196 @@
+"""'ensemble.py' predicts the test data with an ensemble of trained runs and
+writes the mean and variance of their predictions.
+
+Every run is restored into its own graph and session. The test data is
+read once, in chunks prefetched on a background thread, and every chunk
+is fed to all members concurrently; session runs release the GIL, so
+members run in parallel. An ensemble therefore costs about one pass over
+the data instead of one per run. Members may use different subsets of the
+input tracks, but they must predict the same output tracks.
+
+Output (<resultsDir>/<ensembleName>/predictions.h5):
+    <track>_mean        (N, width) mean prediction of the members
+    <track>_variance    (N, width) variance of the member predictions
+    <track>_members     (K, N, width) member predictions, with --saveMembers
+
+Example:
+        $ python ensemble.py --runNames run_a,run_b,run_c --ensembleName abc_ensemble
+
+FLAGS:
+    flag:                   default:                description:
+
+    --runNames              'experiment'            comma separated names of the runs
+    --resultsDir            '../results'            directory where results from the runs are stored
+    --dataDir               '../data/hdf5datasets'  directory where hdf5datasets are stored
+    --ensembleName          'ensemble'              results subdirectory of the ensemble predictions
+    --chunkSize             512                     examples read and predicted at once
+    --saveMembers           False                   also write the predictions of every member
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+
+import tensorflow as tf
+import numpy as np
+import h5py
+from six.moves import queue
+from tqdm import tqdm as tq
+
+### FIDDLE specific tools ###
+from models import load_integrator
+#############################
+
+
+class Ensemble(object):
+    """Trained runs restored into separate graphs and sessions, predicting concurrently"""
+
+    def __init__(self, model_paths, fill='mean'):
+        """
+        Args:
+            :param model_paths: (list) results directories of main.py runs
+            :param fill: (string, default = mean) representations of missing input tracks, see models.load_integrator
+        """
+        self.model_paths = model_paths
+        self.members = []
+        for path in model_paths:
+            graph = tf.Graph()
+            with graph.as_default():
+                self.members.append((graph, load_integrator(path, fill=fill)))
+        outputs = [set(model.decoders.keys()) for _, model in self.members]
+        if any(member_outputs != outputs[0] for member_outputs in outputs):
+            raise ValueError('Ensemble members predict different output tracks: ' +
+                             ', '.join(','.join(sorted(member_outputs)) for member_outputs in outputs))
+        self.outputs = sorted(outputs[0])
+        self.inputs = sorted(set(key for _, model in self.members for key in model.architecture['Inputs']))
+        self.pool = ThreadPool(len(self.members))
+
+    def _predict_member(self, member, data):
+        graph, model = member
+        # fetches are local, the global PREDICTION_FETCHES of models.py is shared by all members
+        with graph.as_default():
+            fetches = {key: model.decoders[key].prediction for key in self.outputs}
+            return model._run(fetches, model.inference_feed(data))
+
+    def predict_members(self, data):
+        """Predictions of every member
+
+        Args:
+            :param data: (dictionary) keys = input track names, values = (N, height, width, 1) signal
+
+        Returns:
+            dictionary: {key = output track, value = (K, N, width) predictions}
+        """
+        results = self.pool.map(lambda member: self._predict_member(member, data), self.members)
+        return {key: np.stack([result[key].reshape(len(result[key]), -1) for result in results])
+                for key in self.outputs}
+
+    def predict(self, data, with_members=False):
+        """Mean and variance of the member predictions
+
+        Args:
+            :param data: (dictionary) keys = input track names, values = (N, height, width, 1) signal
+            :param with_members: (boolean, default = False) also return the member predictions
+
+        Returns:
+            dictionary: {<track>_mean: (N, width), <track>_variance: (N, width)[, <track>_members: (K, N, width)]}
+        """
+        members = self.predict_members(data)
+        result = {}
+        for key, val in members.items():
+            result[key + '_mean'] = val.mean(axis=0)
+            result[key + '_variance'] = val.var(axis=0)
+            if with_members:
+                result[key + '_members'] = val
+        return result
+
+    def close(self):
+        self.pool.close()
+        for _, model in self.members:
+            model.sess.close()
+
+
+def prefetch(chunks, size=2):
+    """Iterates over chunks read ahead on a background thread"""
+    buffer = queue.Queue(maxsize=size)
+    done = object()
+
+    def read():
+        for chunk in chunks:
+            buffer.put(chunk)
+        buffer.put(done)
+
+    thread = threading.Thread(target=read)
+    thread.daemon = True
+    thread.start()
+    while True:
+        chunk = buffer.get()
+        if chunk is done:
+            break
+        yield chunk
+
+
+def predict_dataset(ensemble, test_path, output_path, chunk_size=512, save_members=False):
+    """Streams the test data through the ensemble and writes mean and variance predictions
+
+    Returns:
+        int: number of examples written
+    """
+    with h5py.File(test_path, 'r') as test_h5_handle, h5py.File(output_path, 'w') as output_handle:
+        size = test_h5_handle[ensemble.inputs[0]].shape[0]
+        output_handle.attrs['members'] = json.dumps(ensemble.model_paths)
+        datasets = {}
+        chunks = ((begin, {key: test_h5_handle[key][begin:begin + chunk_size] for key in ensemble.inputs})
+                  for begin in range(0, size, chunk_size))
+        for begin, data in tq(prefetch(chunks), total=(size + chunk_size - 1) // chunk_size):
+            for name, result in ensemble.predict(data, with_members=save_members).items():
+                if name.endswith('_members'):
+                    if name not in datasets:
+                        datasets[name] = output_handle.create_dataset(
+                            name, (result.shape[0], size) + result.shape[2:], dtype='float32')
+                    datasets[name][:, begin:begin + result.shape[1]] = result
+                else:
+                    if name not in datasets:
+                        datasets[name] = output_handle.create_dataset(name, (size,) + result.shape[1:], dtype='float32')
+                    datasets[name][begin:begin + len(result)] = result
+    return size
+
+
+flags = tf.app.flags
+flags.DEFINE_string('runNames', 'experiment', '(DEFAULT: experiment) - comma separated names of the runs')
+flags.DEFINE_string('resultsDir', '../results', '(DEFAULT: ../results) - directory where results from the runs are stored')
+flags.DEFINE_string('dataDir', '../data/hdf5datasets', '(DEFAULT: ../data/hdf5datasets) - directory where hdf5datasets are stored')
+flags.DEFINE_string('ensembleName', 'ensemble', '(DEFAULT: ensemble) - results subdirectory of the ensemble predictions')
+flags.DEFINE_integer('chunkSize', 512, '(DEFAULT: 512) - examples read and predicted at once')
+flags.DEFINE_boolean('saveMembers', False, '(DEFAULT: False) - also write the predictions of every member')
+FLAGS = flags.FLAGS
+
+def main(_):
+    """Restore the members, predict the test data once for all of them"""
+
+    model_paths = [os.path.join(FLAGS.resultsDir, run_name) for run_name in FLAGS.runNames.split(',')]
+    data_names = set()
+    for path in model_paths:
+        with open(os.path.join(path, 'configuration.json')) as fp:
+            data_names.add(json.load(fp)['Options']['DataName'])
+    if len(data_names) != 1:
+        raise ValueError('Ensemble members were trained on different datasets: ' + ', '.join(sorted(data_names)))
+    output_dir = os.path.join(FLAGS.resultsDir, FLAGS.ensembleName)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    ensemble = Ensemble(model_paths)
+    output_path = os.path.join(output_dir, 'predictions.h5')
+    written = predict_dataset(ensemble, os.path.join(FLAGS.dataDir, data_names.pop(), 'test.h5'), output_path,
+                              chunk_size=FLAGS.chunkSize, save_members=FLAGS.saveMembers)
+    ensemble.close()
+    print('Saved {} examples to {}'.format(written, output_path))
+
+
+if __name__ == '__main__':
+    tf.app.run()
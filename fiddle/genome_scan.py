@@ -0,0 +1,302 @@
+"""'genome_scan.py' predicts output tracks along whole chromosomes with a
+trained model.
+
+Chromosomes are tiled into overlapping windows at a configurable stride,
+windows are cut from the input track stores (see io_tools.TrackStore) and
+predicted in large batches, and overlapping predictions are stitched by
+weighted averaging. Chromosomes are processed in blocks of windows and
+accumulated in memory mapped arrays, so memory stays bounded by the block
+size regardless of genome size.
+
+The stitched predictions are written per chromosome as .npy files (a track
+store, readable with io_tools.TrackStore) and/or as bedGraph files, which
+bedGraphToBigWig converts to bigwig.
+
+Example:
+    Assuming a trained run and track stores for its inputs, the following
+    command writes "genome_scan/" to the results directory.
+
+        $ python genome_scan.py --runName your_experiment --storeDir ../data/stores --stride 50 --format both
+
+FLAGS:
+    flag:                   default:                description:
+
+    --runName               'experiment'            name of run
+    --resultsDir            '../results'            directory where results from runName are stored
+    --storeDir              '../data/stores'        directory of per-track memory mapped stores of the model inputs, missing stores are substituted
+    --chroms                'all'                   comma separated chromosomes to scan
+    --stride                50                      distance between consecutive windows, must divide the window width
+    --batchSize             256                     windows predicted per session run
+    --blockSize             8192                    windows cut from the stores at once
+    --weighting             'triangle'              position weights of overlapping windows [triangle or uniform]
+    --format                'npy'                   output format [npy, bedgraph or both]
+    --bedGraphDigits        6                       decimals of bedGraph values
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import json
+
+import tensorflow as tf
+import numpy as np
+from tqdm import tqdm as tq
+
+### FIDDLE specific tools ###
+from models import load_integrator
+from io_tools import TrackStore, _write_store_metadata
+#############################
+
+BEDGRAPH_CHUNK = 1000000 # positions formatted at once
+
+################################################################################
+# Tiling and stitching
+################################################################################
+def window_starts(chrom_size, width, stride):
+    """Start coordinates of the windows tiling a chromosome
+
+    Args:
+        :param chrom_size: (int) chromosome length
+        :param width: (int) window width
+        :param stride: (int) distance between consecutive windows
+
+    Returns:
+        tuple: (regular starts at multiples of stride, extra start covering the chromosome end or None)
+    """
+    if chrom_size < width:
+        return np.zeros(0, dtype=np.int64), None
+    starts = np.arange(0, chrom_size - width + 1, stride, dtype=np.int64)
+    tail = chrom_size - width if starts[-1] != chrom_size - width else None
+    return starts, tail
+
+
+def position_weights(width, kind='triangle'):
+    """Weights of the positions of a window when averaging overlapping predictions
+
+    Args:
+        :param width: (int) window width
+        :param kind: (string, default = triangle) triangle down-weights window edges, uniform weighs all equally
+
+    Returns:
+        numpy vector: (width,) positive float32 weights
+    """
+    if kind == 'uniform':
+        return np.ones(width, dtype=np.float32)
+    if kind == 'triangle':
+        ramp = np.minimum(np.arange(1, width + 1), np.arange(width, 0, -1)).astype(np.float32)
+        return ramp / ramp.max()
+    raise ValueError('Unknown weighting: ' + str(kind))
+
+
+def accumulate_regular(total, weight_total, predictions, first_start, stride, weights):
+    """Adds weighted predictions of windows at first_start + i * stride to the running sums
+
+    Every window is split into width / stride segments; segment j of all
+    windows covers a contiguous stretch of the chromosome, so each segment
+    is added with a single vectorized operation.
+
+    Args:
+        :param total: (numpy array) (height, chrom_size) weighted prediction sums
+        :param weight_total: (numpy vector) (chrom_size,) weight sums, None leaves them as they are
+        :param predictions: (numpy array) (n, height, width) predictions of consecutive windows
+        :param first_start: (int) start of the first window
+        :param stride: (int) distance between consecutive windows
+        :param weights: (numpy vector) (width,) position weights
+    """
+    num_windows, height, width = predictions.shape
+    num_segments = width // stride
+    weighted = (predictions * weights).reshape(num_windows, height, num_segments, stride)
+    for jx in range(num_segments):
+        begin = first_start + jx * stride
+        end = begin + num_windows * stride
+        total[:, begin:end] += weighted[:, :, jx, :].transpose(1, 0, 2).reshape(height, -1)
+        if weight_total is not None:
+            weight_total[begin:end] += np.tile(weights[jx * stride:(jx + 1) * stride], num_windows)
+
+
+def finalize(total, weight_total, block_size=BEDGRAPH_CHUNK):
+    """Divides the prediction sums by the weight sums in place, uncovered positions become NaN"""
+    for begin in range(0, total.shape[1], block_size):
+        weight = weight_total[begin:begin + block_size]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            total[:, begin:begin + block_size] /= np.where(weight > 0, weight, np.nan)
+
+
+################################################################################
+# Scanning
+################################################################################
+def scan_chromosome(model, stores, chrom, output_dirs, stride=50, batch_size=256, block_size=8192,
+                    weighting='triangle'):
+    """Predicts all output tracks along a chromosome and writes the stitched arrays
+
+    Args:
+        :param model: (models.Integrator) trained model
+        :param stores: (dictionary) {key = input track name, value = io_tools.TrackStore}
+        :param chrom: (string) chromosome name
+        :param output_dirs: (dictionary) {key = output track name, value = directory of its <chrom>.npy}
+        :param stride: (int, default = 50) distance between consecutive windows, must divide the window width
+        :param batch_size: (int, default = 256) windows predicted per session run
+        :param block_size: (int, default = 8192) windows cut from the stores at once
+        :param weighting: (string, default = triangle) see position_weights
+
+    Returns:
+        dictionary: {key = output track name, value = (height, chrom_size) memory mapped predictions}, or
+                    None if the chromosome is shorter than a window
+    """
+    width = model.architecture['Modules'][model.architecture['Inputs'][0]]['input_width']
+    if width % stride != 0:
+        raise ValueError('Stride {} does not divide the window width {}'.format(stride, width))
+    block_size = max(batch_size, block_size - block_size % batch_size)
+    chrom_size = stores.values()[0].chrom_sizes[chrom]
+    starts, tail = window_starts(chrom_size, width, stride)
+    if len(starts) == 0:
+        print('Skipping {}, shorter than a window'.format(chrom))
+        return None
+
+    weights = position_weights(width, weighting)
+    weight_total = np.zeros(chrom_size, dtype=np.float32)
+    totals = {}
+    for key in model.decoders.keys():
+        single = model.config['Options']['Strand'] == 'Single' and key != 'dnaseq'
+        height = 1 if single else model.architecture['Modules'][key]['input_height']
+        totals[key] = np.lib.format.open_memmap(os.path.join(output_dirs[key], chrom + '.npy'), mode='w+',
+                                                dtype=np.float32, shape=(height, chrom_size))
+        totals[key][:] = 0
+
+    buffers = {key: np.empty((block_size, store.height, width, 1), dtype=store.dtype) for key, store in stores.items()}
+    blocks = [starts[ix:ix + block_size] for ix in range(0, len(starts), block_size)]
+    if tail is not None:
+        blocks.append(np.array([tail]))
+    for block_starts in tq(blocks, desc=chrom):
+        num_windows = len(block_starts)
+        chroms = np.repeat(np.array([chrom]), num_windows)
+        block = {key: np.nan_to_num(store.extract(chroms, block_starts, width, out=buffers[key][:num_windows]))
+                 for key, store in stores.items()}
+        predictions = {key: [] for key in totals}
+        for ix in range(0, num_windows, batch_size):
+            batch_predictions = model.predict({key: val[ix:ix + batch_size] for key, val in block.items()})
+            for key in totals:
+                predictions[key].append(batch_predictions[key])
+        is_tail = num_windows == 1 and block_starts[0] == tail
+        for ix, (key, total) in enumerate(sorted(totals.items())):
+            prediction = np.concatenate(predictions[key]).reshape(num_windows, total.shape[0], width)
+            if is_tail:
+                total[:, tail:tail + width] += prediction[0] * weights
+            else:
+                # weight sums are shared by all outputs, only the first one adds them
+                accumulate_regular(total, weight_total if ix == 0 else None,
+                                   prediction, int(block_starts[0]), stride, weights)
+        if is_tail:
+            weight_total[tail:tail + width] += weights
+
+    for total in totals.values():
+        finalize(total, weight_total)
+        total.flush()
+    return totals
+
+
+def write_bedgraph(array, chrom, fp, digits=6, chunk_size=BEDGRAPH_CHUNK):
+    """Appends a prediction track as bedGraph lines, merging runs of equal (rounded) values
+
+    Args:
+        :param array: (numpy vector) (chrom_size,) values, NaN positions are skipped
+        :param chrom: (string) chromosome name
+        :param fp: (file) open bedGraph file
+        :param digits: (int, default = 6) decimals the values are rounded to
+        :param chunk_size: (int, default = 1000000) positions formatted at once
+    """
+    for begin in range(0, len(array), chunk_size):
+        values = np.round(np.asarray(array[begin:begin + chunk_size], dtype=np.float64), digits)
+        change = np.flatnonzero((values[1:] != values[:-1]) | np.isnan(values[1:]) | np.isnan(values[:-1])) + 1
+        run_starts = np.r_[0, change]
+        run_ends = np.r_[change, len(values)]
+        keep = ~np.isnan(values[run_starts])
+        fmt = '{}\t{}\t{}\t{:.' + str(digits) + 'f}'
+        lines = [fmt.format(chrom, start, end, value) for start, end, value in
+                 zip((run_starts[keep] + begin).tolist(), (run_ends[keep] + begin).tolist(), values[run_starts[keep]].tolist())]
+        if lines:
+            fp.write('\n'.join(lines) + '\n')
+
+
+################################################################################
+# Main
+################################################################################
+flags = tf.app.flags
+flags.DEFINE_string('runName', 'experiment', '(DEFAULT: experiment) - name of run')
+flags.DEFINE_string('resultsDir', '../results', '(DEFAULT: ../results) - directory where results from runName are stored')
+flags.DEFINE_string('storeDir', '../data/stores', '(DEFAULT: ../data/stores) - directory of per-track memory mapped stores of the model inputs')
+flags.DEFINE_string('chroms', 'all', '(DEFAULT: all) - comma separated chromosomes to scan')
+flags.DEFINE_integer('stride', 50, '(DEFAULT: 50) - distance between consecutive windows, must divide the window width')
+flags.DEFINE_integer('batchSize', 256, '(DEFAULT: 256) - windows predicted per session run')
+flags.DEFINE_integer('blockSize', 8192, '(DEFAULT: 8192) - windows cut from the stores at once')
+flags.DEFINE_string('weighting', 'triangle', '(DEFAULT: triangle) - position weights of overlapping windows [triangle or uniform]')
+flags.DEFINE_string('format', 'npy', '(DEFAULT: npy) - output format [npy, bedgraph or both]')
+flags.DEFINE_integer('bedGraphDigits', 6, '(DEFAULT: 6) - decimals of bedGraph values')
+FLAGS = flags.FLAGS
+
+def main(_):
+    """Load the trained model, scan the chromosomes, write stitched predictions"""
+
+    FLAGS.savePath = os.path.join(FLAGS.resultsDir, FLAGS.runName)
+    output_dir = os.path.join(FLAGS.savePath, 'genome_scan')
+    model = load_integrator(FLAGS.savePath)
+    # input tracks without a store are substituted by the model, see Integrator.inference_feed
+    stores = {key: TrackStore(os.path.join(FLAGS.storeDir, key)) for key in model.architecture['Inputs']
+              if os.path.exists(os.path.join(FLAGS.storeDir, key, 'metadata.json'))}
+    if not stores:
+        raise ValueError('No track store of the inputs ' + ', '.join(model.architecture['Inputs']) + ' in ' + FLAGS.storeDir)
+    print('Scanning with inputs: ' + ', '.join(sorted(stores)))
+    chrom_sizes = stores.values()[0].chrom_sizes
+    chroms = sorted(chrom_sizes) if FLAGS.chroms == 'all' else FLAGS.chroms.split(',')
+
+    output_dirs = {}
+    for key in model.decoders.keys():
+        output_dirs[key] = os.path.join(output_dir, key)
+        if not os.path.exists(output_dirs[key]):
+            os.makedirs(output_dirs[key])
+    strand_names = ['plus', 'minus']
+    bedgraphs = {}
+    if FLAGS.format in ['bedgraph', 'both']:
+        for key in model.decoders.keys():
+            if model.config['Options']['Strand'] == 'Single':
+                bedgraphs[key] = [open(os.path.join(output_dir, key + '.bedGraph'), 'w')]
+            else:
+                bedgraphs[key] = [open(os.path.join(output_dir, '{}.{}.bedGraph'.format(key, name)), 'w')
+                                  for name in strand_names]
+
+    file_shapes = {key: {} for key in output_dirs}
+    for chrom in chroms:
+        totals = scan_chromosome(model, stores, chrom, output_dirs,
+                                 stride=FLAGS.stride,
+                                 batch_size=FLAGS.batchSize,
+                                 block_size=FLAGS.blockSize,
+                                 weighting=FLAGS.weighting)
+        if totals is None:
+            continue
+        for key, total in totals.items():
+            file_shapes[key][chrom] = total.shape
+            for row, fp in enumerate(bedgraphs.get(key, [])):
+                write_bedgraph(total[row], chrom, fp, digits=FLAGS.bedGraphDigits)
+            if FLAGS.format == 'bedgraph':
+                os.remove(os.path.join(output_dirs[key], chrom + '.npy'))
+
+    for key, handles in bedgraphs.items():
+        for fp in handles:
+            fp.close()
+    if FLAGS.format != 'bedgraph':
+        for key, directory in output_dirs.items():
+            _write_store_metadata(directory, {'type': 'npy_memmap',
+                                              'kind': 'prediction',
+                                              'height': file_shapes[key].values()[0][0] if file_shapes[key] else 1,
+                                              'file_shapes': file_shapes[key],
+                                              'source': FLAGS.savePath,
+                                              'stride': FLAGS.stride,
+                                              'weighting': FLAGS.weighting})
+    print('Saved to: ' + output_dir)
+    model.sess.close()
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -11,13 +11,51 @@ Usage:
         > from io_tools import *
 """
 
+from __future__ import print_function
+
 import pdb, traceback, sys
 import numpy as np
 import six
 import time
+import os
+import json
 from tqdm import tqdm as tq
 import itertools
 
+NUM_SEQ_CHARS = 4
+
+# byte value -> one hot row, anything that is not ACGT is treated as N
+_ONE_HOT_LOOKUP = np.full((256, NUM_SEQ_CHARS), 0.25, dtype=np.float32)
+for _ix, _char in enumerate('acgt'):
+    _ONE_HOT_LOOKUP[[ord(_char), ord(_char.upper())]] = np.eye(NUM_SEQ_CHARS, dtype=np.float32)[_ix]
+
+
+def sequence_to_codes(seq):
+    """Converts a DNA sequence string to an array of byte codes.
+
+    Args:
+        :param seq: (string) DNA sequence
+
+    Returns:
+        numpy vector: uint8 character codes, one per base
+    """
+    if not isinstance(seq, bytes):
+        seq = seq.encode('ascii')
+    return np.frombuffer(seq, dtype=np.uint8)
+
+
+def codes_to_one_hot(codes):
+    """Expands byte codes (see sequence_to_codes) into one hot sequences.
+
+    Args:
+        :param codes: (numpy array) (..., L) uint8 character codes
+
+    Returns:
+        numpy array: (..., 4, L) float32 one hot sequences
+    """
+    return np.swapaxes(_ONE_HOT_LOOKUP[codes], -1, -2)
+
+
 def one_hot_encode_sequence(seq):
     """Transforms DNA sequence to vector form.
 
@@ -31,23 +69,102 @@ def one_hot_encode_sequence(seq):
     Returns:
         numpy vector: one hot encoded DNA sequence
     """
-    seq = seq.lower()
-    letterdict = {'a': [1, 0, 0, 0], 'c': [0, 1, 0, 0], 'g': [0, 0, 1, 0],
-                  't': [0, 0, 0, 1], 'n': [0.25, 0.25, 0.25, 0.25]}
-    result = np.array([letterdict[x] for x in seq])
-    return result.T
+    return codes_to_one_hot(sequence_to_codes(seq))
+
+
+PDF_EPSILON = 1e-7 # same as keras.backend.epsilon(), keeps every target probability positive
+
+
+def track_to_pdf(track, strand='Single', epsilon=PDF_EPSILON):
+    """Normalizes sequencing tracks to the target distributions of the KL loss.
+
+    Done once in numpy, in the data pipeline, instead of at every step in
+    the graph.
+
+    Args:
+        :param track: (numpy array) (N, height, width, 1) raw signal
+        :param strand: (string, default = Single) Single uses the first (positive strand) row only,
+                       Double the whole (height, width) window
+        :param epsilon: (float, default = 1e-7) pseudo count added to every position
+
+    Returns:
+        numpy array: (N, width) or (N, height * width) float32 rows summing to one
+    """
+    if strand == 'Single':
+        track = track[:, :1]
+    pdf = track.reshape(track.shape[0], -1).astype(np.float32) + epsilon
+    pdf /= pdf.sum(axis=1, keepdims=True)
+    return pdf
+
+
+def track_to_standardized(track, strand='Single', epsilon=PDF_EPSILON):
+    """Standardizes sequencing tracks to zero mean and unit variance per example.
+
+    Args:
+        :param track: (numpy array) (N, height, width, 1) raw signal
+        :param strand: (string, default = Single) Single uses the first (positive strand) row only
+        :param epsilon: (float, default = 1e-7) added to the standard deviation of flat examples
+
+    Returns:
+        numpy array: (N, width) or (N, height * width) float32 rows
+    """
+    if strand == 'Single':
+        track = track[:, :1]
+    rows = track.reshape(track.shape[0], -1).astype(np.float32)
+    rows -= rows.mean(axis=1, keepdims=True)
+    rows /= rows.std(axis=1, keepdims=True) + epsilon
+    return rows
+
+
+TARGET_TRANSFORMS = {'pdf': track_to_pdf, 'standardize': track_to_standardized}
+
+
+def transform_targets(track, option='pdf', strand='Single'):
+    """Transforms sequencing tracks to training targets, see TARGET_TRANSFORMS for the options"""
+    if option not in TARGET_TRANSFORMS:
+        raise ValueError('Unknown target option: ' + str(option))
+    return TARGET_TRANSFORMS[option](track, strand=strand)
+
+
+def target_key(track_name, option='pdf', strand='Single'):
+    """Name of the precomputed target dataset of a track, e.g. tssseq_pdf_single"""
+    return '{}_{}_{}'.format(track_name, option, strand.lower())
+
+
+PCA_SUFFIX = '_pca' # principal components of a representation written back to representations.h5 by pca.py
+
+
+def representation_keys(h5_handle):
+    """Names of the representations of representations.h5, without their PCA projections"""
+    return sorted(key for key in h5_handle.keys() if not key.endswith(PCA_SUFFIX))
+
 
 class MultiModalData(object):
     """Training data object capable of being iterated through easily"""
 
-    def __init__(self, train_h5_handle, batch_size):
+    def __init__(self, train_h5_handle, batch_size, sampler=None, keys=None):
         """
         Args:
             :param train_h5_handle: (h5py.File) file object in Readonly mode
             :param batch_size: (int) batch input data size, defined in main FLAGS
+            :param sampler: (AliasSampler, default = None) draws weighted examples, sequential batches if None
+            :param keys: (list, default = None) datasets read for every batch (see Integrator.training_keys),
+                         None reads all datasets of the file
         """
         self.train_h5_handle = train_h5_handle
+        self.keys = list(train_h5_handle.keys()) if keys is None else list(keys)
         self.batch_size = batch_size
+        self.sampler = sampler
+        self.examples_seen = 0
+
+    @property
+    def size(self):
+        return self.train_h5_handle[self.keys[0]].shape[0]
+
+    @property
+    def epoch(self):
+        """Number of passes through the training data so far (fractional)"""
+        return self.examples_seen / float(self.size)
 
     def batcher(self):
         """Data iterator of input hdf5 dataset, discretized in batch_size segments
@@ -56,9 +173,615 @@ class MultiModalData(object):
             dictionary iterator: for {key = training input types, values = sequencing data}
         """
 
-        iterable = xrange(0, self.train_h5_handle.values()[0].shape[0] - self.batch_size, self.batch_size)
+        if self.sampler is not None:
+            while True:
+                self.examples_seen += self.batch_size
+                yield self.get(self.sampler.sample(self.batch_size))
+        iterable = six.moves.range(0, self.size - self.batch_size, self.batch_size)
+        for batchIdx in itertools.cycle(iterable):
+            self.examples_seen += self.batch_size
+            yield {key: self.train_h5_handle[key][batchIdx:(batchIdx + self.batch_size)] for key in self.keys}
+
+    def get(self, index):
+        """Reads the examples at index, in sorted order so that hdf5 reads stay sequential
+
+        Args:
+            :param index: (array) example indices, may contain duplicates
+
+        Returns:
+            dictionary: {key = training input types, values = sequencing data}
+        """
+        unique_idx, counts = np.unique(index, return_counts=True)
+        return {key: np.repeat(self.train_h5_handle[key][unique_idx.tolist()], counts, axis=0)
+                for key in self.keys}
+
+
+class AliasSampler(object):
+    """Weighted sampling of examples with replacement in O(1) per draw (Walker/Vose alias method)"""
+
+    def __init__(self, weights, seed=None):
+        """
+        Args:
+            :param weights: (array) non-negative weight of each example
+            :param seed: (int, default = None) random seed
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        if (weights < 0).any() or not np.isfinite(weights).all() or weights.sum() <= 0:
+            raise ValueError('Sampling weights must be finite, non-negative and not all zero')
+        self.size = len(weights)
+        self.prob, self.alias = self._build_table(weights * self.size / weights.sum())
+        self.rng = np.random.RandomState(seed)
+
+    @staticmethod
+    def _build_table(scaled):
+        prob = np.ones(len(scaled))
+        alias = np.arange(len(scaled))
+        small = list(np.flatnonzero(scaled < 1))
+        large = list(np.flatnonzero(scaled >= 1))
+        scaled = scaled.copy()
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        return prob, alias
+
+    def sample(self, size):
+        """Draws example indices
+
+        Args:
+            :param size: (int) number of draws
+
+        Returns:
+            numpy array: sorted example indices
+        """
+        idx = self.rng.randint(self.size, size=size)
+        return np.sort(np.where(self.rng.rand(size) < self.prob[idx], idx, self.alias[idx]))
+
+
+def example_weights(h5_handle, option='signal', keys=None, qc_h5_handle=None, chunk_size=10000):
+    """Precomputes a per-example sampling weight index
+
+    Args:
+        :param h5_handle: (h5py.File) training data
+        :param option: (string, default = signal) 'signal' weights examples by the total signal of the keys tracks,
+                       'quality' samples each quality label (as written by data_prep.py) equally often
+        :param keys: (list, default = None) tracks whose signal is summed, usually the outputs
+        :param qc_h5_handle: (h5py.File, default = None) region QC file aligned with h5_handle (e.g. train_qc.h5),
+                             its <track>_total_signal datasets are used instead of a pass over the data
+        :param chunk_size: (int, default = 10000) examples read at once
+
+    Returns:
+        numpy array: weight of each example
+    """
+    size = h5_handle.values()[0].shape[0]
+    if option == 'signal':
+        weights = np.zeros(size)
+        for key in keys:
+            if qc_h5_handle is not None and (key + '_total_signal') in qc_h5_handle:
+                weights += qc_h5_handle[key + '_total_signal'][:]
+                continue
+            for ix in six.moves.range(0, size, chunk_size):
+                chunk = h5_handle[key][ix:(ix + chunk_size)]
+                weights[ix:(ix + chunk_size)] += np.nansum(chunk.reshape(chunk.shape[0], -1), axis=1)
+        # keep zero signal examples reachable
+        return weights + max(weights.mean(), 1e-7) * 1e-2
+    elif option == 'quality':
+        labels = h5_handle['quality'][:]
+        classes, class_idx, counts = np.unique(labels, return_inverse=True, return_counts=True)
+        return 1. / counts[class_idx]
+    raise ValueError('Unknown sampling option: ' + str(option))
+
+
+def read_chrom_sizes(chrom_sizes_file):
+    """Reads a two column (chromosome, size) tab separated file
+
+    Args:
+        :param chrom_sizes_file: (string) path to chromosome sizes file, e.g. sacCer3.chrom.sizes
+
+    Returns:
+        dictionary: {key = chromosome name, value = chromosome length}
+    """
+    chrom_sizes = {}
+    with open(chrom_sizes_file) as fp:
+        for line in fp:
+            if line.strip():
+                chrom, size = line.split()[:2]
+                chrom_sizes[chrom] = int(size)
+    return chrom_sizes
+
+
+def read_fasta(fasta):
+    """Iterates through the records of a (optionally gzipped) fasta file
+
+    Args:
+        :param fasta: (string) path to fasta file
+
+    Returns:
+        iterator: (chromosome name, sequence) tuples
+    """
+    import gzip
+    open_func = gzip.open if fasta.endswith('.gz') else open
+    with open_func(fasta, 'rb') as fp:
+        name, chunks = None, []
+        for line in fp:
+            if line.startswith(b'>'):
+                if name is not None:
+                    yield name, b''.join(chunks)
+                name, chunks = line[1:].split()[0].decode('ascii'), []
+            else:
+                chunks.append(line.rstrip())
+        if name is not None:
+            yield name, b''.join(chunks)
+
+
+def read_regions(regions_file):
+    """Reads a BED file (or its .npz index from generate_regions.py) of regions of interest into arrays
+
+    Args:
+        :param regions_file: (string) BED file with at least chrom, start, end columns (strand is 6th column)
+
+    Returns:
+        dictionary: {chrom, start, end, strand} numpy arrays, one entry per region
+    """
+    if regions_file.endswith('.npz'):
+        with np.load(regions_file) as index:
+            return {key: index[key] for key in ['chrom', 'start', 'end', 'strand']}
+    chroms, starts, ends, strands = [], [], [], []
+    with open(regions_file) as fp:
+        for line in fp:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            chroms.append(fields[0])
+            starts.append(int(fields[1]))
+            ends.append(int(fields[2]))
+            strands.append(fields[5] if len(fields) > 5 else '.')
+    return {'chrom': np.array(chroms),
+            'start': np.array(starts, dtype=np.int64),
+            'end': np.array(ends, dtype=np.int64),
+            'strand': np.array(strands)}
+
+
+def _write_store_metadata(output_dir, metadata):
+    with open(os.path.join(output_dir, 'metadata.json'), 'w') as fp:
+        json.dump(metadata, fp)
+    return metadata
+
+
+def extract_fasta_to_npy(fasta, output_dir):
+    """Writes a fasta file as per-chromosome .npy files to be memory mapped by TrackStore
+
+    Sequences are kept as uint8 character codes (1 byte per base) and one hot
+    encoded only when windows are extracted.
+
+    Args:
+        :param fasta: (string) path to (optionally gzipped) genome fasta file
+        :param output_dir: (string) directory of the track store, created if missing
+
+    Returns:
+        dictionary: metadata of the track store
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    file_shapes = {}
+    for chrom, seq in read_fasta(fasta):
+        codes = sequence_to_codes(seq)
+        np.save(os.path.join(output_dir, chrom + '.npy'), codes)
+        file_shapes[chrom] = codes.shape
+    return _write_store_metadata(output_dir, {'type': 'npy_memmap',
+                                              'kind': 'fasta',
+                                              'height': NUM_SEQ_CHARS,
+                                              'file_shapes': file_shapes,
+                                              'source': fasta})
+
+
+def extract_bigwig_to_npy(bigwigs, output_dir, chrom_sizes, dtype=np.float32):
+    """Writes bigwig files as per-chromosome .npy files to be memory mapped by TrackStore
+
+    Requires pyBigWig. Bases not covered by a bigwig are stored as NaN.
+
+    Args:
+        :param bigwigs: (list) bigwig files corresponding to strands or channels of the same track
+        :param output_dir: (string) directory of the track store, created if missing
+        :param chrom_sizes: (dictionary) {key = chromosome name, value = chromosome length}
+        :param dtype: (numpy dtype, default = float32) storage precision
+
+    Returns:
+        dictionary: metadata of the track store
+    """
+    import pyBigWig
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    handles = [pyBigWig.open(bigwig) for bigwig in bigwigs]
+    file_shapes = {}
+    for chrom, size in tq(sorted(chrom_sizes.items())):
+        data = np.lib.format.open_memmap(os.path.join(output_dir, chrom + '.npy'), mode='w+',
+                                         dtype=dtype, shape=(len(handles), size))
+        for ix, bw in enumerate(handles):
+            if chrom in bw.chroms():
+                data[ix] = bw.values(chrom, 0, size, numpy=True)
+            else:
+                data[ix] = np.nan
+        data.flush()
+        file_shapes[chrom] = data.shape
+        del data
+    for bw in handles:
+        bw.close()
+    return _write_store_metadata(output_dir, {'type': 'npy_memmap',
+                                              'kind': 'bigwig',
+                                              'height': len(bigwigs),
+                                              'file_shapes': file_shapes,
+                                              'source': bigwigs})
+
+
+def strided_windows(data, width):
+    """Zero-copy view of all windows of a given width along the last axis
+
+    Args:
+        :param data: (numpy array or memmap) (length,) or (height, length) array
+        :param width: (int) window width
+
+    Returns:
+        numpy array: (length - width + 1, width) or (height, length - width + 1, width) read-only view
+    """
+    length = data.shape[-1]
+    if length < width:
+        raise ValueError('Window width {} is larger than the array ({})'.format(width, length))
+    shape = data.shape[:-1] + (length - width + 1, width)
+    strides = data.strides + (data.strides[-1],)
+    return np.lib.stride_tricks.as_strided(data, shape=shape, strides=strides, writeable=False)
+
+
+def mirror(data, to_mirror):
+    """Flips the windows of a (N, height, width, 1) batch in place
+
+    Flipping both axes gives the reverse complement for DNA and swaps
+    sense/antisense for stranded tracks; for single row tracks it only
+    reverses the window.
+
+    Args:
+        :param data: (numpy array) (N, height, width, 1) batch of windows
+        :param to_mirror: (boolean array) windows to flip
+
+    Returns:
+        numpy array: data, modified in place
+    """
+    mirror_idx = np.flatnonzero(to_mirror)
+    if len(mirror_idx):
+        data[mirror_idx] = data[mirror_idx, ::-1, ::-1, :]
+    return data
+
+
+class TrackStore(object):
+    """Memory mapped genome-wide track that windows are cut from on the fly
+
+    A track store is a directory with one .npy file per chromosome and a
+    metadata.json, as written by extract_fasta_to_npy or extract_bigwig_to_npy.
+    Nothing is read into memory until windows are extracted.
+    """
+
+    dtype = np.float32
+
+    def __init__(self, store_dir):
+        """
+        Args:
+            :param store_dir: (string) directory of the track store
+        """
+        with open(os.path.join(store_dir, 'metadata.json')) as fp:
+            self.metadata = json.load(fp)
+        if self.metadata.get('type') != 'npy_memmap':
+            raise ValueError('{} is not a npy_memmap track store'.format(store_dir))
+        self.store_dir = store_dir
+        self.kind = self.metadata['kind']
+        self.height = self.metadata['height']
+        self._data = {chrom: np.load(os.path.join(store_dir, chrom + '.npy'), mmap_mode='r')
+                      for chrom in self.metadata['file_shapes']}
+
+    @property
+    def chrom_sizes(self):
+        return {chrom: data.shape[-1] for chrom, data in self._data.items()}
+
+    def values(self, chrom, start, end):
+        """Stored values of an interval, uint8 character codes for fasta stores, (height, end - start) otherwise"""
+        return np.asarray(self._data[chrom][..., max(start, 0):end])
+
+    def extract(self, chroms, starts, width, to_mirror=None, out=None):
+        """Cuts a batch of equally sized windows out of the track
+
+        Intervals are grouped by chromosome and each group is gathered with a
+        single fancy-index operation on a strided window view of the
+        chromosome, written straight into the (preallocated) output.
+
+        Args:
+            :param chroms: (array) chromosome name of each window
+            :param starts: (array) 0-based start coordinate of each window
+            :param width: (int) window width
+            :param to_mirror: (boolean array, default = None) windows to flip (minus strand)
+            :param out: (numpy array, default = None) preallocated (N, height, width, 1) output
+
+        Returns:
+            numpy array: (N, height, width, 1) batch of windows
+        """
+        chroms = np.asarray(chroms)
+        starts = np.asarray(starts, dtype=np.int64)
+        out = self._check_or_create_output_array(len(starts), width, out)
+
+        # group intervals by chromosome with one stable sort
+        order = np.argsort(chroms, kind='mergesort')
+        sorted_chroms = chroms[order]
+        bounds = np.flatnonzero(sorted_chroms[1:] != sorted_chroms[:-1]) + 1
+        for group in np.split(order, bounds):
+            if len(group) == 0:
+                continue
+            chrom = chroms[group[0]]
+            windows = strided_windows(self._data[chrom], width)
+            group_starts = starts[group]
+            if (group_starts.min() < 0) or (group_starts.max() >= windows.shape[-2]):
+                raise ValueError('Windows out of bounds of {} (size {})'.format(chrom, self._data[chrom].shape[-1]))
+            if self.kind == 'fasta':
+                # (n, width) codes -> (n, width, 4) -> (n, 4, width)
+                out[group, :, :, 0] = _ONE_HOT_LOOKUP[windows[group_starts]].transpose(0, 2, 1)
+            else:
+                # (height, n, width) -> (n, height, width)
+                out[group, :, :, 0] = windows[:, group_starts].transpose(1, 0, 2)
+        if to_mirror is not None:
+            mirror(out, to_mirror)
+        return out
+
+    def _check_or_create_output_array(self, num_windows, width, out):
+        output_shape = (num_windows, self.height, width, 1)
+        if out is None:
+            return np.empty(output_shape, dtype=self.dtype)
+        if out.shape != output_shape:
+            raise ValueError('out array has incorrect shape: {} (need {})'.format(out.shape, output_shape))
+        return out
+
+
+class GenomeWindowData(object):
+    """Training data object that cuts regions from TrackStores on the fly
+
+    Drop-in replacement of MultiModalData for regions that have not been
+    materialized into hdf5; overlapping windows are never duplicated on disk.
+    """
+
+    def __init__(self, stores, regions, batch_size, width, sampler=None):
+        """
+        Args:
+            :param stores: (dictionary) {key = track name, value = TrackStore}
+            :param regions: (dictionary) region arrays as returned by read_regions
+            :param batch_size: (int) batch input data size, defined in main FLAGS
+            :param width: (int) window width, usually architecture input_width
+            :param sampler: (AliasSampler, default = None) draws weighted regions, sequential batches if None
+        """
+        self.stores = stores
+        self.regions = regions
+        self.batch_size = batch_size
+        self.width = width
+        self.sampler = sampler
+        self.examples_seen = 0
+
+    @property
+    def size(self):
+        return len(self.regions['start'])
+
+    @property
+    def epoch(self):
+        """Number of passes through the training regions so far (fractional)"""
+        return self.examples_seen / float(self.size)
+
+    def get(self, index):
+        """Extracts all tracks for the regions at index
+
+        Args:
+            :param index: (array) indices of regions
+
+        Returns:
+            dictionary: {key = track name, value = (N, height, width, 1) numpy array}
+        """
+        chroms = self.regions['chrom'][index]
+        starts = self.regions['start'][index]
+        to_mirror = self.regions['strand'][index] == '-'
+        return {key: store.extract(chroms, starts, self.width, to_mirror=to_mirror)
+                for key, store in self.stores.items()}
+
+    def hold_out(self, size, seed=0):
+        """Shuffles the regions and removes size of them for validation
+
+        Args:
+            :param size: (int) number of held out regions
+            :param seed: (int, default = 0) shuffling seed
+
+        Returns:
+            dictionary: validation data in the same format as get()
+        """
+        idx = np.random.RandomState(seed).permutation(self.size)
+        held_out = self.get(np.sort(idx[:size]))
+        self.regions = {key: val[idx[size:]] for key, val in self.regions.items()}
+        return held_out
+
+    def batcher(self):
+        """Data iterator over the regions, discretized in batch_size segments
+
+        Returns:
+            dictionary iterator: for {key = track name, values = sequencing data}
+        """
+        if self.sampler is not None:
+            while True:
+                self.examples_seen += self.batch_size
+                yield self.get(self.sampler.sample(self.batch_size))
+        iterable = six.moves.range(0, self.size - self.batch_size, self.batch_size)
         for batchIdx in itertools.cycle(iterable):
-            yield {key: inp[batchIdx:(batchIdx + self.batch_size)] for key, inp in self.train_h5_handle.items()}
+            self.examples_seen += self.batch_size
+            yield self.get(np.arange(batchIdx, batchIdx + self.batch_size))
+
+
+class TrainingScheduler(object):
+    """Early stopping and learning rate decay driven by the validation loss"""
+
+    def __init__(self, learning_rate, patience=50, lr_patience=10, lr_decay=0.5,
+                 min_learning_rate=1e-6, min_delta=0., max_epoch=None):
+        """
+        Args:
+            :param learning_rate: (float) initial learning rate
+            :param patience: (int, default = 50) validations without improvement before stopping, 0 disables
+            :param lr_patience: (int, default = 10) validations without improvement before decaying the learning rate
+            :param lr_decay: (float, default = 0.5) learning rate multiplier on plateau, 1 disables
+            :param min_learning_rate: (float, default = 1e-6) lower bound of the learning rate
+            :param min_delta: (float, default = 0.) minimum decrease of the loss that counts as improvement
+            :param max_epoch: (float, default = None) stop after this many epochs
+        """
+        self.learning_rate = learning_rate
+        self.patience = patience
+        self.lr_patience = lr_patience
+        self.lr_decay = lr_decay
+        self.min_learning_rate = min_learning_rate
+        self.min_delta = min_delta
+        self.max_epoch = max_epoch
+        self.best_loss = np.inf
+        self.bad_validations = 0
+        self.bad_validations_lr = 0
+        self.improved = False
+        self.should_stop = False
+        self.stop_reason = None
+
+    def step(self, validation_loss, epoch):
+        """Registers a validation loss
+
+        Args:
+            :param validation_loss: (float) current validation loss
+            :param epoch: (float) current (fractional) epoch
+
+        Returns:
+            float: learning rate to use from now on
+        """
+        self.improved = validation_loss < (self.best_loss - self.min_delta)
+        if self.improved:
+            self.best_loss = validation_loss
+            self.bad_validations = 0
+            self.bad_validations_lr = 0
+        else:
+            self.bad_validations += 1
+            self.bad_validations_lr += 1
+
+        if (self.lr_decay < 1) and (self.bad_validations_lr >= self.lr_patience) and \
+                (self.learning_rate > self.min_learning_rate):
+            self.learning_rate = max(self.learning_rate * self.lr_decay, self.min_learning_rate)
+            self.bad_validations_lr = 0
+            print('Validation loss plateaued, learning rate decayed to ' + str(self.learning_rate))
+
+        if (self.patience > 0) and (self.bad_validations >= self.patience):
+            self.should_stop = True
+            self.stop_reason = 'no validation improvement in {} validations'.format(self.patience)
+        elif (self.max_epoch is not None) and (epoch >= self.max_epoch):
+            self.should_stop = True
+            self.stop_reason = 'reached {} epochs'.format(self.max_epoch)
+        return self.learning_rate
+
+
+class MetricsLogger(object):
+    """Buffered, columnar metrics sink with a stable schema
+
+    Records are buffered in memory and appended to <path>.csv every
+    flush_every records. The columns are fixed by the first record (or the
+    columns argument): step and epoch first, then the remaining keys sorted.
+    Optionally the same records are appended to <path>.h5 (one dataset per
+    column) and converted to <path>.parquet on close (requires pandas and a
+    parquet engine).
+    """
+
+    def __init__(self, path, columns=None, flush_every=100, formats=('csv',)):
+        """
+        Args:
+            :param path: (string) output path without extension, e.g. results/experiment/train
+            :param columns: (list, default = None) column order, taken from the first record if None
+            :param flush_every: (int, default = 100) number of buffered records before writing
+            :param formats: (tuple, default = ('csv',)) any of 'csv', 'hdf5', 'parquet'
+        """
+        self.path = path
+        self.columns = None
+        self.flush_every = flush_every
+        self.formats = formats
+        self._buffer = []
+        self._csv_file = None
+        self._h5_handle = None
+        self._ignored = set()
+        if columns is not None:
+            self._set_columns(columns)
+
+    def _set_columns(self, keys):
+        leading = [key for key in ['step', 'epoch'] if key in keys]
+        self.columns = leading + sorted(key for key in keys if key not in leading)
+
+    def log(self, record=None, **kwargs):
+        """Buffers one record
+
+        Args:
+            :param record: (dictionary, default = None) {key = column, value = scalar}
+            :param kwargs: further columns, e.g. step=step
+        """
+        record = dict(record or {}, **kwargs)
+        if self.columns is None:
+            self._set_columns(list(record.keys()))
+        unknown = set(record) - set(self.columns) - self._ignored
+        if unknown:
+            print('MetricsLogger: ignoring columns not in the schema of ' + self.path + ': ' + ', '.join(sorted(unknown)))
+            self._ignored.update(unknown)
+        self._buffer.append([record.get(key, np.nan) for key in self.columns])
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered records"""
+        if not self._buffer:
+            return
+        import csv
+        if self._csv_file is None:
+            self._csv_file = open(self.path + '.csv', 'w')
+            self._csv_writer = csv.writer(self._csv_file)
+            self._csv_writer.writerow(self.columns)
+        self._csv_writer.writerows(self._buffer)
+        self._csv_file.flush()
+        if 'hdf5' in self.formats:
+            self._flush_hdf5()
+        self._buffer = []
+
+    def _flush_hdf5(self):
+        import h5py
+        values = np.array(self._buffer, dtype=np.float64)
+        if self._h5_handle is None:
+            self._h5_handle = h5py.File(self.path + '.h5', 'w')
+            for key in self.columns:
+                self._h5_handle.create_dataset(key, (0,), maxshape=(None,), dtype=np.float64, chunks=True)
+        for ix, key in enumerate(self.columns):
+            dataset = self._h5_handle[key]
+            dataset.resize((dataset.shape[0] + values.shape[0],))
+            dataset[-values.shape[0]:] = values[:, ix]
+        self._h5_handle.flush()
+
+    def close(self):
+        """Flushes and closes the outputs"""
+        self.flush()
+        if self._csv_file is not None:
+            self._csv_file.close()
+        if self._h5_handle is not None:
+            self._h5_handle.close()
+        if ('parquet' in self.formats) and os.path.exists(self.path + '.csv'):
+            import pandas as pd
+            pd.read_csv(self.path + '.csv').to_parquet(self.path + '.parquet')
+
+
+def scalar_metrics(return_dict):
+    """Keeps the numeric entries of an Integrator return dictionary as floats
+
+    Args:
+        :param return_dict: (dictionary) as returned by Integrator.train or Integrator.validate
+
+    Returns:
+        dictionary: {key = metric name, value = float}, summaries and optimizer ops are dropped
+    """
+    return {key: float(np.mean(val)) for key, val in return_dict.items()
+            if isinstance(val, (np.ndarray, np.generic, float, int)) and not isinstance(val, bool)}
 
 
 class Timer(object):
@@ -85,4 +808,4 @@ class Timer(object):
         self.secs = self.end - self.start
         self.msecs = self.secs * 1000  # millisecs
         if self.verbose:
-            print 'elapsed time: %f ms' % self.msecs
+            print('elapsed time: %f ms' % self.msecs)
@@ -25,12 +25,23 @@ FLAGS:
     --visualizePrediction   'offline'               prediction profiles to be plotted [online or offline]
     --savePredictionFreq    20                      frequency of profile saving w.r.t. number of iterations through batched data
     --maxEpoch              1000                    total number of epochs through training data
-    --totalIterations       1000                    total number of batched training examples
+    --totalIterations       1000                    maximum number of training iterations (validation runs)
+    --stepsPerIteration     10                      number of training batches between validation runs
+    --patience              0                       iterations without validation improvement before stopping, 0 disables early stopping
+    --lrPatience            10                      iterations without validation improvement before decaying the learning rate
+    --lrDecay               1                       learning rate multiplier on validation plateau (e.g. 0.5), 1 disables decay
+    --minLearningRate       1e-6                    lower bound of the decayed learning rate
     --batchSize             20                      batch size of training data
     --learningRate          0.001                   initial learning rate
     --resultsDir            '../results'            directory where results from runName will be stored
     --inputs                'None'                  inputs
     --outputs               'None'                  outputs
+    --storeDir              'None'                  directory of per-track memory mapped stores, used instead of train.h5 and validation.h5
+    --regions               'None'                  BED file (or .npz region index) of regions to cut from the track stores
+    --sampling              'uniform'               training example sampling [uniform, signal or quality]
+    --profile               False                   report timing histograms of batch fetch, session runs, validation etc. per iteration (profile.jsonl)
+    --timelineEvery         0                       trace a training step every this many steps into timeline.json, 0 disables
+    --numThreads            0                       threads of the TensorFlow session (e.g. cores pinned to a sweep trial), 0 uses all cores
 """
 
 from __future__ import absolute_import
@@ -52,7 +63,7 @@ import defopt
 # FIDDLE specific tools
 from models import *
 from io_tools import *
-import visualization as viz
+from profiling import *
 #############################
 
 flags = tf.app.flags
@@ -63,12 +74,23 @@ flags.DEFINE_string('architecture', 'architecture.json', '(DEFAULT: architecture
 flags.DEFINE_string('visualizePrediction', 'offline', '(DEFAULT: offline) - prediction profiles to be plotted [online or offline] ')
 flags.DEFINE_integer('savePredictionFreq', 20, '(DEFAULT: 20) - frequency of profile saving w.r.t. number of iterations through batched data')
 flags.DEFINE_integer('maxEpoch', 1000, '(DEFAULT: 1000) - total number of epochs through training data')
-flags.DEFINE_integer('totalIterations', 1000, '(DEFAULT: 1000) - total number of batched training examples')
+flags.DEFINE_integer('totalIterations', 1000, '(DEFAULT: 1000) - maximum number of training iterations (validation runs)')
+flags.DEFINE_integer('stepsPerIteration', 10, '(DEFAULT: 10) - number of training batches between validation runs')
+flags.DEFINE_integer('patience', 0, '(DEFAULT: 0) - iterations without validation improvement before stopping, 0 disables early stopping')
+flags.DEFINE_integer('lrPatience', 10, '(DEFAULT: 10) - iterations without validation improvement before decaying the learning rate')
+flags.DEFINE_float('lrDecay', 1., '(DEFAULT: 1) - learning rate multiplier on validation plateau (e.g. 0.5), 1 disables decay')
+flags.DEFINE_float('minLearningRate', 1e-6, '(DEFAULT: 1e-6) - lower bound of the decayed learning rate')
 flags.DEFINE_integer('batchSize', 20, '(DEFAULT: 20) - batch size of training data')
 flags.DEFINE_float('learningRate', 0.001, '(DEFAULT: 0.001) - initial learning rate.')
 flags.DEFINE_string('resultsDir', '../results', '(DEFAULT: ../results) - directory where results from runName will be stored')
 flags.DEFINE_string('inputs', 'None', '(DEFAULT: None) - inputs')
 flags.DEFINE_string('outputs', 'None', '(DEFAULTs: None) - outputs')
+flags.DEFINE_string('storeDir', 'None', '(DEFAULT: None) - directory of per-track memory mapped stores, used instead of train.h5 and validation.h5')
+flags.DEFINE_string('regions', 'None', '(DEFAULT: None) - BED file (or .npz region index) of regions to cut from the track stores')
+flags.DEFINE_string('sampling', 'uniform', '(DEFAULT: uniform) - training example sampling [uniform, signal or quality]')
+flags.DEFINE_boolean('profile', False, '(DEFAULT: False) - report timing histograms of batch fetch, session runs, validation etc. per iteration (profile.jsonl)')
+flags.DEFINE_integer('timelineEvery', 0, '(DEFAULT: 0) - trace a training step every this many steps into timeline.json, 0 disables')
+flags.DEFINE_integer('numThreads', 0, '(DEFAULT: 0) - threads of the TensorFlow session (e.g. cores pinned to a sweep trial), 0 uses all cores')
 FLAGS = flags.FLAGS
 
 def main(_):
@@ -113,41 +135,72 @@ def main(_):
     json.dump(model.architecture, open(FLAGS.savePath + "/architecture.json", 'w'))
     json.dump(model.config, open(FLAGS.savePath + "/configuration.json", 'w'))
 
-    # read in training and validation data
-    train_h5_handle  = h5py.File(os.path.join(FLAGS.dataDir, config['Options']['DataName'], 'train.h5'),'r')
-    validation_h5_handle  = h5py.File(os.path.join(FLAGS.dataDir, config['Options']['DataName'], 'validation.h5'),'r')
-
-    # create iterator over training data
-    data = MultiModalData(train_h5_handle, batch_size=FLAGS.batchSize)
+    all_keys = list(set(model.architecture['Inputs'] + model.architecture['Outputs']))
+    if FLAGS.storeDir != 'None':
+        if FLAGS.sampling != 'uniform':
+            raise ValueError('Only uniform sampling is supported with --storeDir')
+        # cut training and validation windows from the genome on the fly
+        stores = {key: TrackStore(os.path.join(FLAGS.storeDir, key)) for key in all_keys}
+        data = GenomeWindowData(stores, read_regions(FLAGS.regions), batch_size=FLAGS.batchSize,
+                                width=model.architecture['Modules'][all_keys[0]]['input_width'])
+        print('Storing validation data to the memory\n\n')
+        validation_data = data.hold_out(min(data.size // 10, 1000))
+    else:
+        # read in training and validation data
+        train_h5_handle  = h5py.File(os.path.join(FLAGS.dataDir, config['Options']['DataName'], 'train.h5'),'r')
+        validation_h5_handle  = h5py.File(os.path.join(FLAGS.dataDir, config['Options']['DataName'], 'validation.h5'),'r')
+
+        # weight examples by output signal or quality labels, uses train_qc.h5 from data prep when present
+        sampler = None
+        if FLAGS.sampling != 'uniform':
+            print('Building ' + FLAGS.sampling + ' sampling index')
+            qc_path = os.path.join(FLAGS.dataDir, config['Options']['DataName'], 'train_qc.h5')
+            qc_h5_handle = h5py.File(qc_path, 'r') if os.path.exists(qc_path) else None
+            weights = example_weights(train_h5_handle, option=FLAGS.sampling, keys=model.architecture['Outputs'],
+                                      qc_h5_handle=qc_h5_handle)
+            np.save(os.path.join(FLAGS.savePath, 'sampling_weights.npy'), weights)
+            sampler = AliasSampler(weights)
+
+        # create iterator over training data
+        # only the datasets the model is trained on are read, not the raw outputs of precomputed targets or QC
+        data = MultiModalData(train_h5_handle, batch_size=FLAGS.batchSize, sampler=sampler,
+                              keys=model.training_keys(train_h5_handle))
+
+        to_size = min(validation_h5_handle.values()[0].shape[0], 1000)
+        print('Storing validation data to the memory\n\n')
+        try:
+            validation_data = {key: validation_h5_handle[key][:to_size] for key in all_keys}
+            # precomputed target distributions (data_prep/add_targets.py) skip the transform of the outputs
+            validation_data.update({key: validation_h5_handle[key][:to_size] for key in model.target_keys()
+                                    if key in validation_h5_handle})
+        except KeyError:
+            print('\nERROR: Make sure that the configurations file contains the correct track names (keys), which should match the hdf5 keys\n')
+            sys.exit()
     batcher = data.batcher()
 
-    to_size = min(validation_h5_handle.values()[0].shape[0], 1000)
-    print('Storing validation data to the memory\n\n')
-    try:
-        all_keys = list(set(model.architecture['Inputs'] + model.architecture['Outputs']))
-        validation_data = {key: validation_h5_handle[key][:to_size] for key in all_keys}
-    except KeyError:
-        print('\nERROR: Make sure that the configurations file contains the correct track names (keys), which should match the hdf5 keys\n')
-        sys.exit()
-
     ############################################################################
     #                               Launch graph                               #
     ############################################################################
 
     # instantiate neural network
-    model.initialize()
+    session_config = None
+    if FLAGS.numThreads > 0:
+        session_config = tf.ConfigProto(intra_op_parallelism_threads=FLAGS.numThreads,
+                                        inter_op_parallelism_threads=FLAGS.numThreads)
+    model.initialize(session_config)
     model.create_monitor_variables(show_filters=False)
     model.saver()
 
-    # instantiate training and validation log files
-    header_str = 'Loss'
-    for key in model.architecture['Outputs']:
-        header_str += '\t' + key + '_Accuracy'
-    header_str += '\n'
-    with open((FLAGS.savePath + "/" + "train.txt"), "w") as train_file:
-        train_file.write(header_str)
-    with open((FLAGS.savePath + "/" + "validation.txt"), "w") as validation_file:
-        validation_file.write(header_str)
+    # instantiate hot path instrumentation
+    profiler = Profiler(enabled=FLAGS.profile,
+                        log_path=os.path.join(FLAGS.savePath, 'profile.jsonl'),
+                        keep_events=FLAGS.timelineEvery > 0)
+    model.profiler = profiler
+    timeline_sampler = TimelineSampler(FLAGS.timelineEvery, path=os.path.join(FLAGS.savePath, 'timeline.json'))
+
+    # instantiate training and validation metrics logs (train.csv, validation.csv)
+    train_logger = MetricsLogger(os.path.join(FLAGS.savePath, 'train'), flush_every=100)
+    validation_logger = MetricsLogger(os.path.join(FLAGS.savePath, 'validation'), flush_every=1)
 
     # select quality signals for prediction overlay during training
     num_signals = 5
@@ -164,7 +217,12 @@ def main(_):
 
     globalMinLoss = 1e16 # some high number
     step = 0
-    train_size = train_h5_handle.values()[0].shape[0]
+    scheduler = TrainingScheduler(FLAGS.learningRate,
+                                  patience=FLAGS.patience,
+                                  lr_patience=FLAGS.lrPatience,
+                                  lr_decay=FLAGS.lrDecay,
+                                  min_learning_rate=FLAGS.minLearningRate,
+                                  max_epoch=FLAGS.maxEpoch)
 
     # print('Pre-train validation run:')
     # return_dict = model.validate(validation_data, accuracy=True)
@@ -177,106 +235,88 @@ def main(_):
         # linearly decreasing dropout probability from 20% (@ 1st iteration) to 0% (@ 1% of total iterations)
         # inputDropout = 0.2 - 0.2 * it / 10. if it <= (totalIterations // 100) else 0.
         inputDropout = 0.
-        epoch = int(it * 10 * FLAGS.batchSize/train_size)
 
-        print('\n\nEpoch: ' + str(epoch) + ', Iterations: ' + str(it))
-        print('Number of examples seen: ' + str(it * 10 * FLAGS.batchSize))
+        print('\n\nEpoch: ' + "%.2f" % data.epoch + ', Iterations: ' + str(it))
+        print('Number of examples seen: ' + str(data.examples_seen))
         print('Input dropout probability: ' + str(inputDropout))
 
-        t_batcher, t_trainer = 0, 0
-
-        for iterationNo in tq(range(10)):
-            with Timer() as t:
-                train_batch = batcher.next()
-            t_batcher += t.secs
-            with Timer() as t:
-                return_dict = model.train(train_batch, accuracy=True, inp_dropout=inputDropout, batch_size=FLAGS.batchSize)
-
-                train_summary = return_dict['summary']
-
-            t_trainer += t.secs
-            if iterationNo==0:
-                return_dict_train = return_dict.copy()
-            else:
-                return_dict_train = {key: return_dict_train[key]+val for key, val in return_dict.items()
-                                     if (type(val) is np.ndarray) or (type(val) is np.float32)}
-                return_dict_train.update({key: val for key, val in return_dict.items() if val is type('string')})
+        t_batcher, t_trainer, train_cost = 0, 0, 0
+
+        for iterationNo in tq(range(FLAGS.stepsPerIteration)):
+            with profiler.span('batch_fetch') as t_batch:
+                train_batch = next(batcher)
+            run_options, run_metadata = timeline_sampler.run_options(step)
+            with profiler.span('train_step') as t_train:
+                return_dict = model.train(train_batch, accuracy=True, inp_dropout=inputDropout, batch_size=FLAGS.batchSize,
+                                          options=run_options, run_metadata=run_metadata)
+            timeline_sampler.add(run_metadata, step)
+            train_summary = return_dict['summary']
             step += 1
-
+            t_batcher += t_batch.secs
+            t_trainer += t_train.secs
+            train_cost += return_dict['cost']
+            train_logger.log(scalar_metrics(return_dict), step=step, epoch=data.epoch,
+                             learning_rate=model.learning_rate, batch_secs=t_batch.secs, train_secs=t_train.secs)
 
         print('Batcher time: ' + "%.3f" % t_batcher)
         print('Trainer time: ' + "%.3f" % t_trainer)
 
-        for key, val in return_dict_train.items():
-            if type(val) is not type('some_str_type'):
-                return_dict_train[key] /= iterationNo
-
-        return_dict_train.update({key: np.sum(val) for key, val in return_dict_train.items()
-                                  if (type(val) is np.ndarray) or (type(val) is np.float32)})
-        return_dict_valid = model.validate(validation_data, accuracy=True)
-        return_dict_valid.update({key: np.sum(val) for key, val in return_dict_valid.items()
-                                  if (type(val) is np.ndarray) or (type(val) is np.float32)})
-        return_dict_valid.update({key: val for key, val in return_dict_valid.items()
-                                  if (type(val) is type('string'))})
+        with profiler.span('validation') as t_valid:
+            return_dict_valid = model.validate(validation_data, accuracy=True)
+        validation_logger.log(scalar_metrics(return_dict_valid), step=step, epoch=data.epoch,
+                              learning_rate=model.learning_rate, validation_secs=t_valid.secs)
+        print('Train cost: ' + str(train_cost / FLAGS.stepsPerIteration))
+        print('Validation cost: ' + str(return_dict_valid['cost']))
 
         if (it % FLAGS.savePredictionFreq == 0):
-            if 'dnaseq' not in model.outputs.keys():
-                predicted_dict = model.predict(input_for_prediction)
-                pickle.dump(predicted_dict, open((FLAGS.savePath + "/" + 'pred_viz_{}.pck'.format(it)), "wb"))
-                if FLAGS.visualizePrediction == 'online':
-                    viz.plot_prediction(predicted_dict, orig_output, name = 'iteration_{}'.format(it), save_dir = FLAGS.savePath, strand = model.config['Options']['Strand'])
-            else:
-                feed_d = {val: input_for_prediction[key] for key, val in model.inputs.items()}
-                feed_d.update({val: orig_output[key] for key, val in model.outputs.items()})
-                feed_d.update({model.dropout: 1.,
-                               model.keep_prob_input: 1.,
-                               model.inp_size: input_for_prediction.values()[0].shape[0],
-                               K.learning_phase(): 0})
-                weights, pred_vec = model.sess.run([model.dna_before_softmax, model.predictions['dnaseq']], feed_d)
-                predicted_dict = {'dna_before_softmax':weights,
-                                'prediction': pred_vec}
-                pickle.dump(predicted_dict, open((FLAGS.savePath + "/" + 'pred_viz_{}.pck'.format(it)), "wb"))
-                if FLAGS.visualizePrediction == 'online':
-                    viz.visualize_dna(weights, pred_vec, name = 'iteration_{}'.format(it), save_dir = FLAGS.savePath)
-
-        write_to_txt(return_dict_train)
-        write_to_txt(return_dict_valid, batch_size=validation_data.values()[0].shape[0], datatype='validation')
-        model.summarize(train_summary = train_summary, validation_summary = return_dict_valid['summary'], step = step)
+            with profiler.span('prediction_dump'):
+                if 'dnaseq' not in model.outputs.keys():
+                    predicted_dict = model.predict(input_for_prediction)
+                    pickle.dump(predicted_dict, open((FLAGS.savePath + "/" + 'pred_viz_{}.pck'.format(it)), "wb"))
+                    if FLAGS.visualizePrediction == 'online':
+                        import visualization as viz # matplotlib is only loaded for online plotting
+                        viz.plot_prediction(predicted_dict, orig_output, name = 'iteration_{}'.format(it), save_dir = FLAGS.savePath, strand = model.config['Options']['Strand'])
+                else:
+                    feed_d = {val: input_for_prediction[key] for key, val in model.inputs.items()}
+                    feed_d.update(model.target_feed(orig_output))
+                    feed_d.update({model.dropout: 1.,
+                                   model.keep_prob_input: 1.,
+                                   model.inp_size: input_for_prediction.values()[0].shape[0],
+                                   K.learning_phase(): 0})
+                    weights, pred_vec = model.sess.run([model.dna_before_softmax, model.predictions['dnaseq']], feed_d)
+                    predicted_dict = {'dna_before_softmax':weights,
+                                    'prediction': pred_vec}
+                    pickle.dump(predicted_dict, open((FLAGS.savePath + "/" + 'pred_viz_{}.pck'.format(it)), "wb"))
+                    if FLAGS.visualizePrediction == 'online':
+                        import visualization as viz
+                        viz.visualize_dna(weights, pred_vec, name = 'iteration_{}'.format(it), save_dir = FLAGS.savePath)
+
+        with profiler.span('summaries'):
+            model.summarize(train_summary = train_summary, validation_summary = return_dict_valid['summary'], step = step)
 
         if (return_dict_valid['cost'] < globalMinLoss) and (it>20):
             globalMinLoss = return_dict_valid['cost']
-            for track_name, saver in model.savers_dict.items():
-                save_path = saver.save(model.sess, os.path.join(FLAGS.savePath, track_name+'_model.ckpt'))
+            with profiler.span('checkpoint'):
+                for track_name, saver in model.savers_dict.items():
+                    save_path = saver.save(model.sess, os.path.join(FLAGS.savePath, track_name+'_model.ckpt'))
+                # substituted for input tracks missing at inference
+                model.save_mean_representations(validation_data)
             print('Model saved in file: %s' % FLAGS.savePath)
 
-    model.sess.close()
-
+        profiler.end_interval(step)
 
+        learning_rate = scheduler.step(return_dict_valid['cost'], data.epoch)
+        if learning_rate != model.learning_rate:
+            model.set_learning_rate(learning_rate)
+        if scheduler.should_stop:
+            print('Stopping training at epoch ' + "%.2f" % data.epoch + ': ' + scheduler.stop_reason)
+            break
 
-def write_to_txt(return_dict, batch_size = FLAGS.batchSize, datatype = 'train', verbose = True):
-    """Writes to text file the contents of return_dict, saves in FLAGS.savePath
-
-    Args:
-        :param return_dict: of datasets {key=loss, value=accuracy}
-        :param batch_size: size of inputed data batches
-        :param datatype: representation of data type in return_dict
-        :param verbose: level of information displayed
-    """
-
-    line_to_write = ''
-    for key, val in return_dict.items():
-        if key == 'cost':
-            cur_line = str(return_dict['cost']) + '\t'
-            line_to_write += str(return_dict[key])
-        elif (key == '_') or (key == 'summary'):
-            continue
-        else:
-            cur_line = str(return_dict[key] / batch_size)
-            line_to_write += cur_line + '\t'
-        if verbose:
-            print(datatype + '\t' + key + ': ' + cur_line)
-    with open((FLAGS.savePath + "/" + datatype + ".txt"), "a") as fp:
-        fp.write(line_to_write + '\n')
+    train_logger.close()
+    validation_logger.close()
+    if FLAGS.timelineEvery > 0:
+        timeline_sampler.save(profiler)
+    model.sess.close()
 
 
 if __name__ == '__main__':
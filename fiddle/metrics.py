@@ -0,0 +1,270 @@
+"""'metrics.py' evaluates the predictions.h5 written by analysis.py against the
+test data with vectorized NumPy metrics, without building the TensorFlow
+graph. Examples are processed chunk by chunk on multiple cores, so the
+evaluation scales to millions of examples.
+
+Per example: KL and Jensen-Shannon divergence, Pearson and Spearman
+correlation over positions, peak distance and top-k peak recall.
+Per position: Pearson correlation across examples.
+
+Example:
+    Assuming analysis.py was run for the experiment, the following command
+    writes "metrics.h5" to the results directory and prints a summary.
+
+        $ python metrics.py --runName your_experiment --processes 8
+
+FLAGS:
+    flag:                   default:                description:
+
+    --runName               'experiment'            name of run
+    --resultsDir            '../results'            directory where results from runName are stored
+    --dataDir               '../data/hdf5datasets'  directory where hdf5datasets are stored
+    --chunkSize             10000                   number of examples evaluated at once
+    --processes             4                       number of worker processes
+    --topK                  10                      number of highest positions compared by the peak recall
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import json
+from multiprocessing import Pool
+from optparse import OptionParser
+
+import numpy as np
+import h5py
+
+from io_tools import transform_targets
+
+EPSILON = 1e-7
+PER_EXAMPLE_METRICS = ['kl', 'js', 'pearson', 'spearman', 'peak_distance', 'top_k_recall']
+
+
+################################################################################
+# Metrics, rows are examples
+################################################################################
+def kl_divergence(p, q, epsilon=EPSILON):
+    """KL(p || q) of each row of two arrays of distributions"""
+    p = np.maximum(p, epsilon)
+    q = np.maximum(q, epsilon)
+    return (p * (np.log(p) - np.log(q))).sum(axis=1)
+
+
+def js_divergence(p, q, epsilon=EPSILON):
+    """Jensen-Shannon divergence (natural log, bounded by log 2) of each row"""
+    m = 0.5 * (p + q)
+    return 0.5 * kl_divergence(p, m, epsilon) + 0.5 * kl_divergence(q, m, epsilon)
+
+
+def pearson_rows(x, y):
+    """Pearson correlation of each row of x with the same row of y, nan for constant rows"""
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean(axis=1, keepdims=True)
+    denominator = np.sqrt((x * x).sum(axis=1) * (y * y).sum(axis=1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (x * y).sum(axis=1) / denominator
+
+
+def rank_rows(x):
+    """Ranks (1 based) of the values of each row, ties get their average rank
+
+    Args:
+        :param x: (numpy array) (N, L)
+
+    Returns:
+        numpy array: (N, L) float64 ranks
+    """
+    num_rows, length = x.shape
+    rows = np.arange(num_rows)[:, None]
+    sorter = np.argsort(x, axis=1, kind='mergesort')
+    x_sorted = x[rows, sorter]
+    # a new group starts at every row start and wherever the sorted value changes
+    is_start = np.ones(x.shape, dtype=bool)
+    is_start[:, 1:] = x_sorted[:, 1:] != x_sorted[:, :-1]
+    is_start = is_start.ravel()
+    group_starts = np.flatnonzero(is_start)
+    group_sizes = np.diff(np.append(group_starts, is_start.size))
+    average_ranks = group_starts % length + (group_sizes - 1) / 2. + 1
+    ranks = np.empty(x.shape)
+    ranks[rows, sorter] = average_ranks[np.cumsum(is_start) - 1].reshape(x.shape)
+    return ranks
+
+
+def spearman_rows(x, y):
+    """Spearman correlation of each row of x with the same row of y"""
+    return pearson_rows(rank_rows(x), rank_rows(y))
+
+
+def peak_distance(y_true, y_pred, height=1):
+    """Distance between the highest positions of the true and predicted profiles, averaged over strands
+
+    Args:
+        :param y_true: (numpy array) (N, height * width) profiles
+        :param y_pred: (numpy array) (N, height * width) profiles
+        :param height: (int, default = 1) number of strands the rows are made of
+
+    Returns:
+        numpy vector: peak distance of each example, in positions
+    """
+    true_peaks = y_true.reshape(y_true.shape[0], height, -1).argmax(axis=2)
+    pred_peaks = y_pred.reshape(y_pred.shape[0], height, -1).argmax(axis=2)
+    return np.abs(true_peaks - pred_peaks).mean(axis=1)
+
+
+def top_k_recall(y_true, y_pred, k=10):
+    """Fraction of the k highest true positions that are among the k highest predicted positions"""
+    k = min(k, y_true.shape[1])
+    rows = np.arange(y_true.shape[0])[:, None]
+    true_top = np.zeros(y_true.shape, dtype=bool)
+    pred_top = np.zeros(y_pred.shape, dtype=bool)
+    true_top[rows, np.argpartition(-y_true, k - 1, axis=1)[:, :k]] = True
+    pred_top[rows, np.argpartition(-y_pred, k - 1, axis=1)[:, :k]] = True
+    return (true_top & pred_top).sum(axis=1) / float(k)
+
+
+def example_metrics(y_true, y_pred, height=1, k=10, distributions=True):
+    """All per example metrics of a chunk
+
+    Args:
+        :param y_true: (numpy array) (N, L) target profiles
+        :param y_pred: (numpy array) (N, L) predicted profiles
+        :param height: (int, default = 1) number of strands the rows are made of
+        :param k: (int, default = 10) number of positions compared by top_k_recall
+        :param distributions: (boolean, default = True) rows are distributions, False skips KL and JS
+
+    Returns:
+        dictionary: {key = metric name, value = numpy vector}
+    """
+    result = {'pearson': pearson_rows(y_true, y_pred),
+              'spearman': spearman_rows(y_true, y_pred),
+              'peak_distance': peak_distance(y_true, y_pred, height),
+              'top_k_recall': top_k_recall(y_true, y_pred, k)}
+    if distributions:
+        result['kl'] = kl_divergence(y_true, y_pred)
+        result['js'] = js_divergence(y_true, y_pred)
+    return result
+
+
+def position_moments(y_true, y_pred):
+    """Sums needed for the per position Pearson correlation, which can be added across chunks"""
+    return np.stack([y_true.sum(axis=0), y_pred.sum(axis=0), (y_true * y_true).sum(axis=0),
+                     (y_pred * y_pred).sum(axis=0), (y_true * y_pred).sum(axis=0)])
+
+
+def position_pearson(moments, count):
+    """Per position Pearson correlation across examples from summed position_moments"""
+    sum_t, sum_p, sum_tt, sum_pp, sum_tp = moments
+    covariance = sum_tp - sum_t * sum_p / count
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return covariance / np.sqrt((sum_tt - sum_t ** 2 / count) * (sum_pp - sum_p ** 2 / count))
+
+
+################################################################################
+# Chunked evaluation
+################################################################################
+def _evaluate_chunk(task):
+    """Worker: reads one chunk of both files and computes its metrics"""
+    predictions_path, test_path, key, start, stop, option, strand, k = task
+    with h5py.File(predictions_path, 'r') as pred_h5_handle, h5py.File(test_path, 'r') as test_h5_handle:
+        y_pred = pred_h5_handle[key][start:stop].astype(np.float64)
+        y_true = transform_targets(test_h5_handle[key][start:stop], option=option, strand=strand).astype(np.float64)
+        height = 1 if strand == 'Single' else test_h5_handle[key].shape[1]
+    y_pred = y_pred.reshape(y_true.shape)
+    return start, example_metrics(y_true, y_pred, height, k, distributions=(option == 'pdf')), \
+        position_moments(y_true, y_pred)
+
+
+def evaluate(predictions_path, test_path, keys, strand='Single', option='pdf', chunk_size=10000, processes=4, k=10):
+    """Evaluates predictions against test data chunk by chunk
+
+    Args:
+        :param predictions_path: (string) predictions.h5 written by analysis.py
+        :param test_path: (string) test.h5 the predictions were made for
+        :param keys: (list) output tracks to evaluate
+        :param strand: (string, default = Single) strand option of configurations.json
+        :param option: (string, default = pdf) target transform of configurations.json
+        :param chunk_size: (int, default = 10000) number of examples evaluated at once
+        :param processes: (int, default = 4) number of worker processes, 1 evaluates in this process
+        :param k: (int, default = 10) number of positions compared by top_k_recall
+
+    Returns:
+        dictionary: {key = track name, value = dictionary of per example metric vectors and 'position_pearson'}
+    """
+    results = {}
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        for key in keys:
+            with h5py.File(predictions_path, 'r') as pred_h5_handle:
+                size = pred_h5_handle[key].shape[0]
+            tasks = [(predictions_path, test_path, key, start, min(start + chunk_size, size), option, strand, k)
+                     for start in range(0, size, chunk_size)]
+            chunks = pool.imap_unordered(_evaluate_chunk, tasks) if pool is not None else map(_evaluate_chunk, tasks)
+            metrics, moments = {}, 0
+            for start, chunk_metrics, chunk_moments in chunks:
+                for name, values in chunk_metrics.items():
+                    if name not in metrics:
+                        metrics[name] = np.empty(size)
+                    metrics[name][start:start + len(values)] = values
+                moments = moments + chunk_moments
+            metrics['position_pearson'] = position_pearson(moments, size)
+            results[key] = metrics
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return results
+
+
+def write_metrics(results, output_path):
+    """Writes evaluation results to hdf5, one group per track"""
+    with h5py.File(output_path, 'w') as h5_handle:
+        for key, metrics in results.items():
+            group = h5_handle.create_group(key)
+            for name, values in metrics.items():
+                group.create_dataset(name, data=values)
+
+
+def summarize(results):
+    """Prints mean and median of every per example metric"""
+    for key, metrics in sorted(results.items()):
+        print('\n' + key)
+        print('{:<16} {:>10} {:>10}'.format('metric', 'mean', 'median'))
+        for name in PER_EXAMPLE_METRICS + ['position_pearson']:
+            if name in metrics:
+                print('{:<16} {:>10.4f} {:>10.4f}'.format(name, np.nanmean(metrics[name]), np.nanmedian(metrics[name])))
+
+
+################################################################################
+# Main
+################################################################################
+def main():
+    parser = OptionParser('usage: %prog [options]')
+    parser.add_option('--runName', dest='runName', default='experiment', help='(DEFAULT: experiment) - name of run')
+    parser.add_option('--resultsDir', dest='resultsDir', default='../results', help='(DEFAULT: ../results) - directory where results from runName are stored')
+    parser.add_option('--dataDir', dest='dataDir', default='../data/hdf5datasets', help='(DEFAULT: ../data/hdf5datasets) - directory where hdf5datasets are stored')
+    parser.add_option('--chunkSize', dest='chunkSize', type='int', default=10000, help='(DEFAULT: 10000) - number of examples evaluated at once')
+    parser.add_option('--processes', dest='processes', type='int', default=4, help='(DEFAULT: 4) - number of worker processes')
+    parser.add_option('--topK', dest='topK', type='int', default=10, help='(DEFAULT: 10) - number of highest positions compared by the peak recall')
+    (FLAGS, args) = parser.parse_args()
+
+    save_path = os.path.join(FLAGS.resultsDir, FLAGS.runName)
+    with open(os.path.join(save_path, 'configuration.json')) as fp:
+        config = json.load(fp)
+    keys = [key for key in config['Options']['Outputs'] if key != 'dnaseq']
+    results = evaluate(os.path.join(save_path, 'predictions.h5'),
+                       os.path.join(FLAGS.dataDir, config['Options']['DataName'], 'test.h5'),
+                       keys,
+                       strand=config['Options']['Strand'],
+                       option=config['Options'].get('Targets', 'pdf'),
+                       chunk_size=FLAGS.chunkSize,
+                       processes=FLAGS.processes,
+                       k=FLAGS.topK)
+    write_metrics(results, os.path.join(save_path, 'metrics.h5'))
+    summarize(results)
+    print('\nSaved ' + os.path.join(save_path, 'metrics.h5'))
+
+
+if __name__ == '__main__':
+    main()
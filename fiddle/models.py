@@ -14,21 +14,15 @@ from __future__ import absolute_import
 from __future__ import print_function
 from __future__ import division
 
-###################################################################
-# Running on a shared cluster specific tools
-import sys
-sys.path.append('/home/ue4/tfvenv/lib/python2.7/site-packages/')
-##################################################################
-
 import pdb, traceback, sys
 import tensorflow as tf
 import numpy as np
 from keras.layers import Input, Dense, Lambda, Conv2D, concatenate, Reshape, AveragePooling2D, Flatten, BatchNormalization, MaxPooling2D
 from keras.models import Model
 from keras import backend as K
-from keras.objectives import kullback_leibler_divergence
 import json, six, copy, os
-from visualization import put_kernels_on_grid, plot_prediction
+from profiling import Profiler
+from io_tools import TARGET_TRANSFORMS, transform_targets, target_key
 
 ################################################################################
 #                              Global Variables                                #
@@ -41,6 +35,8 @@ TRAIN_FETCHES = {}
 VALIDATION_FETCHES = {}
 PREDICTION_FETCHES ={}
 
+MEAN_REPRESENTATIONS_FILE = 'mean_representations.npz' # fallback representations of missing input tracks
+
 ################################################################################
 #                             Auxiliary Methods                                #
 ################################################################################
@@ -62,33 +58,6 @@ def multi_softmax(target, axis = 1, name = None):
         Z = tf.reduce_sum(Q, axis, keep_dims = True)
     return Q / Z
 
-def transform_track(track_ph, option = 'pdf'):
-    """Calculates probability distribution - continuous, categorical, standardized - of inputted tensor, usually DNA region
-
-    Args:
-        :param track_ph: (tf.placeholder) initialized tensor of data to be transformed
-        :param option: (string, default = pdf) type of probability distribution calculation desired on track_ph tensor
-
-    Returns:
-        Description of probability distribution of inputted tensor
-
-    Todo:
-        :param categorical: discretisizes the continuous input (To be implemented)
-        :param standardize: zero mean, unit variance
-    """
-
-    if option == 'pdf':
-        epsilon = K.epsilon() # default = 1e-07
-        track_ph_axis_1 = track_ph.get_shape()[1] # usually one DNA strand
-        track_ph_axis_2 = track_ph.get_shape()[2] # usually the other DNA strand
-        output_tensor = tf.reshape(track_ph, [-1, (track_ph_axis_1 * track_ph_axis_2).value]) + epsilon
-        output_tensor = tf.divide(output_tensor, tf.reduce_sum(output_tensor, 1, keep_dims = True))
-    elif option == 'standardize': #TODO: implement categorical and standardized probability distribution outputs
-        raise NotImplementedError
-        from scipy import stats
-        output_tensor = stats.zscore(output_tensor, axis=1)
-    return output_tensor
-
 def byteify(json_out):
     """Recursively reads in .json file content and converts to easily manipulable python dictionary format
 
@@ -151,6 +120,11 @@ class Integrator(object):
         self.representations = {}  # initializes representations dictionary
         self.tracks = {}  # initializes dictionary of key = input track, value = CNN Container
         self.inputs = {}  # initializes input dictionary of key = input track, value = inputs to corresponding CNN Container
+        self.profiler = Profiler(enabled=False) # replaced by an enabled profiling.Profiler to time feed construction and session runs
+        self._attribution_ops = {} # gradient ops of attributions, built on first use, see gradients
+        self.target_option = self.config['Options'].get('Targets', 'pdf') # target transform of output tracks, pdf or standardize
+        if self.target_option not in TARGET_TRANSFORMS:
+            raise ConfigurationParsingError('Configuration file should have Targets field as either pdf or standardize')
 
         
         self.router = Router() # router object gathers the representations from encoders (prev. known as 
@@ -175,6 +149,7 @@ class Integrator(object):
                                                     inp_size=self.inp_size,
                                                     batch_norm=batch_norm,
                                                     strand=self.config['Options']['Strand'],
+                                                    target_option=self.target_option,
                                                     name=track_name)
                 self.decoders[track_name].representations = self.router.route(block_list=[track_name])
                 self.decoders[track_name].combine_representations() # combines representations into convolutional layer
@@ -185,23 +160,26 @@ class Integrator(object):
         self.output_tensor = {}  # initializes output_tensor
         self.outputs = {}  # initializes output dictionary
         self.cost_functions = {} # initializes cost functions dictionary
+        self.loss_names = {} # summary names of the cost functions
 
         # define output dictionary of key = output, values = tf.variables of prob representation
         for key in self.architecture['Outputs']:
             input_height = self.architecture['Modules'][key]["input_height"]
             input_width = self.architecture['Modules'][key]["input_width"]
-            self.outputs[key] = tf.placeholder(tf.float32, [None, input_height, input_width, 1], name = 'output_' + key)
             if key != 'dnaseq':
-                if self.config['Options']['Strand'] == 'Single':
-                    self.positive_strand = tf.slice(self.outputs[key], [0, 0, 0, 0], [-1, 1, -1, -1])
-                    self.output_tensor[key] = transform_track(self.positive_strand, option = 'pdf')
+                # targets are fed already transformed (io_tools.transform_targets or precomputed), see target_feed
+                target_width = input_width if self.config['Options']['Strand'] == 'Single' else input_height * input_width
+                self.outputs[key] = tf.placeholder(tf.float32, [None, target_width], name = 'output_' + key)
+                self.output_tensor[key] = self.outputs[key]
+                if self.target_option == 'pdf':
+                    self.cost_functions[key], self.loss_names[key] = kl_loss_from_logits, 'KL_Loss'
                 else:
-                    self.output_tensor[key] = transform_track(self.outputs[key], option = 'pdf')
-                self.cost_functions[key] = kl_loss
+                    self.cost_functions[key], self.loss_names[key] = squared_error_loss, 'Squared_Error_Loss'
             else:
+                self.outputs[key] = tf.placeholder(tf.float32, [None, input_height, input_width, 1], name = 'output_' + key)
                 #TODO: incorporate topologically relevant dataset options
                 self.output_tensor[key] = self.outputs[key]
-                self.cost_functions[key] = multi_softmax_classification
+                self.cost_functions[key], self.loss_names[key] = multi_softmax_classification, 'Cross_Entropy_Loss'
 
         self.freeze() # Looks at the configurations.json and freezes the weight updates for particular modules 
         self._create_loss_optimizer() # Define loss function gradient optimizer
@@ -239,10 +217,14 @@ class Integrator(object):
                         else:
                             self.architecture['Modules'][key][key_key] = sub_val
 
-    def initialize(self):
-        """Initialize the decoder model either from scratch or from saved checkpoints (pre-trained)"""
+    def initialize(self, session_config = None):
+        """Initialize the decoder model either from scratch or from saved checkpoints (pre-trained)
+
+        Args:
+            :param session_config: (tf.ConfigProto, default = None) e.g. to limit the threads of the session
+        """
 
-        self.sess = tf.Session()
+        self.sess = tf.Session(config = session_config)
         init = tf.global_variables_initializer()
         self.sess.run(init)
         print('Session initialized.')
@@ -297,6 +279,10 @@ class Integrator(object):
 
         # define Integrator attributes
         self.global_step = tf.Variable(0, name = 'globalStep', trainable = False)
+        # learning rate lives in the graph so that it can be decayed during training
+        self.learning_rate_variable = tf.Variable(self.learning_rate, name = 'learningRate', trainable = False, dtype = tf.float32)
+        self._new_learning_rate = tf.placeholder(tf.float32, [])
+        self._update_learning_rate = tf.assign(self.learning_rate_variable, self._new_learning_rate)
         self.accuracy = {}
         self.losses = {}
         self.cost = 0
@@ -304,8 +290,11 @@ class Integrator(object):
         # define Integrator cost and loss
         for key in self.architecture['Outputs']:
 
-            # apply cost function between output probability distribution and NN predictions
-            self.losses[key] = self.cost_functions[key](self.output_tensor[key], self.decoders[key].prediction)
+            # apply cost function between output probability distribution and NN predictions (logits for sequencing tracks)
+            if key != 'dnaseq':
+                self.losses[key] = self.cost_functions[key](self.output_tensor[key], self.decoders[key].logits)
+            else:
+                self.losses[key] = self.cost_functions[key](self.output_tensor[key], self.decoders[key].prediction)
             TRAIN_FETCHES.update({key + '_loss': self.losses[key]})
             VALIDATION_FETCHES.update({key + '_loss': self.losses[key]})
             self.cost += self.losses[key]
@@ -317,7 +306,7 @@ class Integrator(object):
             # self.performance[key] = self.performance_measures[key](self.output_tensor[key], self.decoders[key].prediction)
             trnbls = [var for var in self.trainables if ((key in var.name)&('decoder' in var.name))|('encoder' in var.name)]
             # define Integrator gradient optimizer
-            self.optimizer[key] = tf.train.AdamOptimizer(learning_rate=self.learning_rate). \
+            self.optimizer[key] = tf.train.AdamOptimizer(learning_rate=self.learning_rate_variable). \
                 minimize(self.cost,
                          global_step=self.global_step,
                          var_list=trnbls)
@@ -328,8 +317,18 @@ class Integrator(object):
 
 
 
+    def set_learning_rate(self, learning_rate):
+        """Changes the learning rate of the optimizers, e.g. on a validation plateau
+
+        Args:
+            :param learning_rate: (float) new learning rate
+        """
+
+        self.learning_rate = learning_rate
+        self.sess.run(self._update_learning_rate, {self._new_learning_rate: learning_rate})
+
     # TODO: accuracy not utilized ... remove?
-    def train(self, train_data, accuracy = None, inp_dropout = 0.1, batch_size = 128):
+    def train(self, train_data, accuracy = None, inp_dropout = 0.1, batch_size = 128, options = None, run_metadata = None):
         """Trains model based on mini-batch of input data, calculates cost of mini-batch input
 
         Args:
@@ -337,6 +336,8 @@ class Integrator(object):
             :param accuracy: (boolean, default = None) ...?
             :param inp_dropout: (double, default = 0.1) probability of hidden unit dropout
             :param batch_size: (int, default = 128) number of inputted data units
+            :param options: (tf.RunOptions, default = None) e.g. to trace this step
+            :param run_metadata: (tf.RunMetadata, default = None) receives the trace of this step
 
         Returns:
             Cost of mini-batch of training data in dictionary format
@@ -345,21 +346,23 @@ class Integrator(object):
         """
 
         # TODO: accuracy not utilized ... remove?
-        if train_data == []:
-            train_feed = {}
-        else:
-            train_feed = {self.outputs[key]: train_data[key] for key in self.architecture['Outputs']}
-            train_feed.update({self.inputs[key]: train_data[key] for key in self.architecture['Inputs']})
+        with self.profiler.span('feed_construction'):
+            if train_data == []:
+                train_feed = {}
+            else:
+                train_feed = self.target_feed(train_data)
+                train_feed.update({self.inputs[key]: train_data[key] for key in self.architecture['Inputs']})
 
 
-        train_feed.update({
-            self.dropout: self.architecture['Scaffold']['dropout'],
-            self.keep_prob_input: (1 - inp_dropout),
-            self.inp_size: batch_size,
-            K.learning_phase(): 1 })
+            train_feed.update({
+                self.dropout: self.architecture['Scaffold']['dropout'],
+                self.keep_prob_input: (1 - inp_dropout),
+                self.inp_size: batch_size,
+                K.learning_phase(): 1 })
 
         TRAIN_FETCHES.update({'summary': self.summary_op})
-        return_dict = self._run(TRAIN_FETCHES, train_feed)
+        with self.profiler.span('session_run'):
+            return_dict = self._run(TRAIN_FETCHES, train_feed, options = options, run_metadata = run_metadata)
         return return_dict
 
     def validate(self, validation_data, accuracy = None):
@@ -375,7 +378,7 @@ class Integrator(object):
 
         # TODO: accuracy not utilized ... remove?
         if not hasattr(self, 'test_feed'):
-            self.test_feed = {self.outputs[key]: validation_data[key] for key in self.architecture['Outputs']}
+            self.test_feed = self.target_feed(validation_data)
             self.test_feed.update({ self.inputs[key]: validation_data[key] for key in self.architecture['Inputs']})
             self.test_feed.update({
                 self.dropout: 1.,
@@ -384,62 +387,288 @@ class Integrator(object):
                 K.learning_phase():0 })
 
         VALIDATION_FETCHES.update({'summary': self.summary_op})
-        return_dict = self._run(VALIDATION_FETCHES, self.test_feed)
+        with self.profiler.span('validation_run'):
+            return_dict = self._run(VALIDATION_FETCHES, self.test_feed)
         return return_dict
 
-    def predict(self, predict_data):
-        """Tests model against predetermined indices
+    def target_keys(self):
+        """Names of the precomputed target datasets (data_prep/add_targets.py) used by target_feed"""
+
+        return [target_key(key, self.target_option, self.config['Options']['Strand'])
+                for key in self.architecture['Outputs'] if key != 'dnaseq']
+
+    def training_keys(self, available):
+        """Datasets a training batch is read from: the inputs, the precomputed targets of the outputs
+        and the raw outputs that have none
 
         Args:
-            :param predict_data: (dictionary) keys = input for prediction, values = indices of data signals
+            :param available: (container) names of the datasets in the training file
 
         Returns:
-            Cost of prediction in dictionary format
+            list: dataset names, each once
+        """
+
+        keys = list(self.architecture['Inputs'])
+        for key in self.architecture['Outputs']:
+            precomputed = target_key(key, self.target_option, self.config['Options']['Strand'])
+            keys.append(precomputed if key != 'dnaseq' and precomputed in available else key)
+        return sorted(set(keys), key = keys.index)
+
+    def target_feed(self, data):
+        """Feeds the targets of the output tracks of data
+
+        Precomputed targets (e.g. data['tssseq_pdf_single']) are fed as they are,
+        otherwise the raw tracks are transformed in numpy.
+
+        Args:
+            :param data: (dictionary) keys = track names, values = (N, height, width, 1) raw signal
+                         and optionally precomputed targets
+
+        Returns:
+            dictionary: {key = output placeholder, value = targets}
         """
 
-        pred_feed = {}
-        pred_feed.update({ self.inputs[key]: predict_data[key] for key in self.architecture['Inputs'] })
+        feed = {}
+        for key in self.architecture['Outputs']:
+            precomputed = target_key(key, self.target_option, self.config['Options']['Strand'])
+            if key == 'dnaseq':
+                feed[self.outputs[key]] = data[key]
+            elif precomputed in data:
+                feed[self.outputs[key]] = data[precomputed]
+            else:
+                feed[self.outputs[key]] = transform_targets(data[key], option = self.target_option,
+                                                            strand = self.config['Options']['Strand'])
+        return feed
+
+    def inference_feed(self, predict_data, representations = None):
+        """Feed of an inference run, input tracks missing from predict_data are skipped
+
+        The encoders of missing tracks are not run: the router feeds their
+        fallback representations (see Router.substitute) instead, so the cost
+        of a run scales with the tracks that are present. Representations
+        computed earlier (see encode) are fed the same way, e.g. to reuse the
+        unchanged tracks of a region across many variants of another track.
+
+        Args:
+            :param predict_data: (dictionary) keys = input track names, values = (N, height, width, 1) signal of
+                                 any subset of the input tracks
+            :param representations: (dictionary, default = None) keys = input track names, values =
+                                    (N, representation_width) representations fed instead of running their encoders
+
+        Returns:
+            dictionary: feed of the session run
+        """
+
+        representations = representations or {}
+        present = [key for key in self.architecture['Inputs'] if key in predict_data and key not in representations]
+        encoded = [key for key in self.architecture['Inputs'] if key in representations]
+        if not present + encoded:
+            raise ValueError('At least one of the input tracks ' + ', '.join(self.architecture['Inputs']) + ' is required')
+        batch_size = (predict_data[present[0]] if present else representations[encoded[0]]).shape[0]
+        pred_feed = {self.inputs[key]: predict_data[key] for key in present}
+        pred_feed.update({self.router.representations[key]: representations[key] for key in encoded})
+        pred_feed.update(self.router.substitute([key for key in self.architecture['Inputs']
+                                                 if key not in present + encoded], batch_size))
         pred_feed.update({
             self.dropout: 1.,
             self.keep_prob_input: 1.,
-            self.inp_size: predict_data.values()[0].shape[0],
+            self.inp_size: batch_size,
             K.learning_phase(): 0
         })
+        return pred_feed
 
+    def predict(self, predict_data, representations = None):
+        """Tests model against predetermined indices
+
+        Args:
+            :param predict_data: (dictionary) keys = input for prediction, values = indices of data signals,
+                                 missing input tracks are substituted (see inference_feed)
+            :param representations: (dictionary, default = None) precomputed representations of input tracks,
+                                    see inference_feed
+
+        Returns:
+            Cost of prediction in dictionary format
+        """
+
+        pred_feed = self.inference_feed(predict_data, representations)
         PREDICTION_FETCHES.update({key: self.decoders[key].prediction for key in self.decoders.keys()})
-        return_dict = self._run(PREDICTION_FETCHES, pred_feed)
+        with self.profiler.span('prediction_run'):
+            return_dict = self._run(PREDICTION_FETCHES, pred_feed)
         return return_dict
 
     def get_representations(self, predict_data):
         """Evaluates predictions at predetermined indices
 
         Args:
-            :param predict_data: (dictionary) keys = input for prediction, values = indices of data signals
+            :param predict_data: (dictionary) keys = input for prediction, values = indices of data signals,
+                                 missing input tracks are substituted (see inference_feed)
 
         Returns:
-            Predictions in manipulable dictionary format
+            Predictions in manipulable dictionary format, without the representations of missing tracks
         """
 
-        pred_feed = {}
-        pred_feed.update({
-            self.inputs[key]: predict_data[key]
-            for key in self.architecture['Inputs']
-        })
-
-        pred_feed.update({
-            self.dropout: 1.,
-            self.keep_prob_input: 1.,
-            self.inp_size: predict_data.values()[0].shape[0],
-            K.learning_phase(): 0
-        })
-
+        pred_feed = self.inference_feed(predict_data)
         fetches = {}
-        fetches.update(self.router.representations)
+        fetches.update({key: val for key, val in self.router.representations.items() if key in predict_data})
         fetches.update({'decoder_'+key: self.decoders[key].decoder_representation for key in self.decoders.keys()})
 
         return_dict = self._run(fetches, pred_feed)
         return return_dict
 
+    def encode(self, data):
+        """Runs only the encoders of the input tracks present in data
+
+        Args:
+            :param data: (dictionary) keys = input track names, values = (N, height, width, 1) signal
+
+        Returns:
+            dictionary: {key = input track name, value = (N, representation_width) representation},
+                        empty if data holds none of the input tracks
+        """
+
+        fetches = {key: val for key, val in self.router.representations.items() if key in data}
+        if not fetches:
+            return {}
+        return self._run(fetches, self.inference_feed(data))
+
+    def _attribution_op(self, output_key, quantity = 'logits'):
+        """Weight placeholder and gradients w.r.t. every input of the weighted sum of an output, built once
+
+        Examples are independent at inference, so the gradient of the sum over
+        the batch holds the gradient of every example.
+        """
+
+        if (output_key, quantity) not in self._attribution_ops:
+            if quantity not in ['logits', 'prediction']:
+                raise ValueError('quantity should be either logits or prediction')
+            target = getattr(self.decoders[output_key], quantity)
+            weights = tf.placeholder(tf.float32, target.get_shape(), name = 'attribution_weights_' + output_key)
+            input_keys = list(self.architecture['Inputs'])
+            grads = tf.gradients(tf.reduce_sum(target * weights), [self.inputs[key] for key in input_keys])
+            # an input routed away from this decoder has no gradient
+            grads = [tf.zeros_like(self.inputs[key]) if grad is None else grad for key, grad in zip(input_keys, grads)]
+            self._attribution_ops[(output_key, quantity)] = (weights, dict(zip(input_keys, grads)))
+        return self._attribution_ops[(output_key, quantity)]
+
+    def gradients(self, data, output_key, weights = None, quantity = 'logits'):
+        """Gradients of a weighted sum of an output track w.r.t. the input tracks present in data
+
+        Args:
+            :param data: (dictionary) keys = input track names, values = (N, height, width, 1) signal,
+                         missing input tracks are substituted (see inference_feed)
+            :param output_key: (string) output track whose predictions are attributed
+            :param weights: (numpy array, default = None) (width,) or (N, width) weights of the output positions,
+                            e.g. an indicator of a peak; None weighs all positions equally
+            :param quantity: (string, default = logits) attributed decoder tensor, logits or prediction
+
+        Returns:
+            dictionary: {key = input track name, value = (N, height, width, 1) gradients}
+        """
+
+        weights_ph, grads = self._attribution_op(output_key, quantity)
+        present = [key for key in self.architecture['Inputs'] if key in data]
+        size = data[present[0]].shape[0]
+        width = weights_ph.get_shape().as_list()[1]
+        weights = np.ones(width, dtype = np.float32) if weights is None else np.asarray(weights, dtype = np.float32)
+        feed = self.inference_feed(data)
+        feed[weights_ph] = np.broadcast_to(weights, (size, width))
+        return self._run({key: grads[key] for key in present}, feed)
+
+    def integrated_gradients(self, data, output_key, weights = None, quantity = 'logits', steps = 20,
+                             baselines = None, batch_size = 512):
+        """Integrated gradients (Sundararajan et al. 2017) of a weighted sum of an output track
+
+        The interpolation steps between baseline and input are stacked into the
+        batch dimension, batch_size // steps examples at a time; all present
+        input tracks are interpolated together.
+
+        Args:
+            :param data: (dictionary) keys = input track names, values = (N, height, width, 1) signal
+            :param output_key: (string) output track whose predictions are attributed
+            :param weights: (numpy array, default = None) weights of the output positions, see gradients
+            :param quantity: (string, default = logits) attributed decoder tensor, logits or prediction
+            :param steps: (int, default = 20) interpolation steps (midpoint rule)
+            :param baselines: (dictionary, default = None) (height, width, 1) baseline of each input track,
+                              uniform base probabilities for dnaseq and zeros for the other tracks if absent
+            :param batch_size: (int, default = 512) interpolated examples per session run
+
+        Returns:
+            dictionary: {key = input track name, value = (N, height, width, 1) attributions}
+        """
+
+        present = [key for key in self.architecture['Inputs'] if key in data]
+        size = data[present[0]].shape[0]
+        baselines = baselines or {}
+        baselines = {key: np.asarray(baselines[key], dtype = np.float32) if key in baselines else
+                     np.full(data[key].shape[1:], 0.25 if key == 'dnaseq' else 0., dtype = np.float32)
+                     for key in present}
+        weights = None if weights is None else np.asarray(weights, dtype = np.float32)
+        alphas = ((np.arange(steps) + 0.5) / steps).astype(np.float32).reshape(1, steps, 1, 1, 1)
+        examples_per_run = max(1, batch_size // steps)
+        attributions = {key: np.empty(data[key].shape, dtype = np.float32) for key in present}
+        for begin in range(0, size, examples_per_run):
+            end = min(begin + examples_per_run, size)
+            differences = {key: data[key][begin:end] - baselines[key] for key in present}
+            # (examples, steps, height, width, 1) -> (examples * steps, height, width, 1)
+            interpolated = {key: (baselines[key] + alphas * differences[key][:, None]).reshape(
+                (-1,) + data[key].shape[1:]) for key in present}
+            batch_weights = None
+            if weights is not None and weights.ndim == 2:
+                batch_weights = np.repeat(weights[begin:end], steps, axis = 0)
+            elif weights is not None:
+                batch_weights = weights
+            grads = self.gradients(interpolated, output_key, batch_weights, quantity)
+            for key in present:
+                mean_grads = grads[key].reshape((end - begin, steps) + data[key].shape[1:]).mean(axis = 1)
+                attributions[key][begin:end] = differences[key] * mean_grads
+        return attributions
+
+    def compute_mean_representations(self, data, batch_size = 1000):
+        """Averages the encoder representations of each input track over data
+
+        Args:
+            :param data: (dictionary) keys = input track names, values = (N, height, width, 1) signal
+            :param batch_size: (int, default = 1000) number of examples encoded at once
+
+        Returns:
+            dictionary: {key = input track name, value = (representation_width,) mean representation}
+        """
+
+        sums = {}
+        size = data[self.architecture['Inputs'][0]].shape[0]
+        for ix in range(0, size, batch_size):
+            batch = {key: data[key][ix:ix + batch_size] for key in self.architecture['Inputs']}
+            representations = self.encode(batch)
+            for key, val in representations.items():
+                sums[key] = sums.get(key, 0) + val.sum(axis = 0, dtype = np.float64)
+        return {key: (val / size).astype(np.float32) for key, val in sums.items()}
+
+    def save_mean_representations(self, data, batch_size = 1000):
+        """Computes the mean representations of data, saves them to the results directory and
+        uses them as fallbacks of missing tracks
+
+        Args:
+            :param data: (dictionary) keys = input track names, values = (N, height, width, 1) signal
+            :param batch_size: (int, default = 1000) number of examples encoded at once
+        """
+
+        self.router.defaults = self.compute_mean_representations(data, batch_size)
+        np.savez(os.path.join(self.model_path, MEAN_REPRESENTATIONS_FILE), **self.router.defaults)
+
+    def load_mean_representations(self):
+        """Uses the mean representations saved in the results directory as fallbacks of missing tracks
+
+        Returns:
+            boolean: whether mean representations were found
+        """
+
+        path = os.path.join(self.model_path, MEAN_REPRESENTATIONS_FILE)
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as npz:
+            self.router.defaults = {key: npz[key] for key in npz.files}
+        return True
+
     def summarize(self, train_summary, validation_summary, step):
         """Writes to results directory a summary of training and validation steps
 
@@ -461,6 +690,7 @@ class Integrator(object):
         """
 
         if show_filters:
+            from visualization import put_kernels_on_grid # plotting is only loaded when filters are shown
             for track_name in self.inputs.keys():
                 weights = [
                     v
@@ -476,13 +706,13 @@ class Integrator(object):
             tf.summary.scalar(key + '/Accuracy', val)
 
         for key, val in self.losses.items():
-            tf.summary.scalar(key + '/KL_Loss', val)
+            tf.summary.scalar(key + '/' + self.loss_names[key], val)
 
         self.summary_op = tf.summary.merge_all()
         self.summary_writer_train = tf.summary.FileWriter(self.model_path + '/training', self.sess.graph)
         self.summary_writer_valid = tf.summary.FileWriter(self.model_path + '/validation', self.sess.graph)
 
-    def _run(self, fetches, feed_dict):
+    def _run(self, fetches, feed_dict, options = None, run_metadata = None):
         """Wrapper for making Session.run() more user friendly.
         Adapted from @Styrke : https://github.com/tensorflow/tensorflow/issues/1941
         With this function, fetches can be either a list or a dictionary.
@@ -497,14 +727,16 @@ class Integrator(object):
         session -- An open TensorFlow session.
         fetches -- A list or dict of ops to fetch.
         feed_dict -- The dict of values to feed to the computation graph.
+        options -- tf.RunOptions, e.g. to trace the run.
+        run_metadata -- tf.RunMetadata receiving the trace of the run.
         """
 
         if isinstance(fetches, dict):
             keys, values = fetches.keys(), list(fetches.values())
-            res = self.sess.run(values, feed_dict)
+            res = self.sess.run(values, feed_dict, options = options, run_metadata = run_metadata)
             return {key: value for key, value in zip(keys, res)}
         else:
-            return self.sess.run(fetches, feed_dict)
+            return self.sess.run(fetches, feed_dict, options = options, run_metadata = run_metadata)
 
     def profile(self):
         """Allows profiling of 'models.py' to evaluate bottlenecks in computational cost"""
@@ -641,6 +873,7 @@ class Decoder():
                  batch_norm=False,
                  strand='Single',
                  unified=True,
+                 target_option='pdf',
                  name=None):
 
         self.architecture = architecture
@@ -650,6 +883,7 @@ class Decoder():
         self.batch_norm = batch_norm
         self.strand = strand
         self.unified = unified
+        self.target_option = target_option
         self.representations = {}
         self.scope = name
 
@@ -718,12 +952,17 @@ class Decoder():
             #TODO: perhaps raise ConfigurationParsingError earlier in main.py?
             raise ConfigurationParsingError('Configuration file should have Strand field as either Single or Double')
 
-        self.prediction = tf.nn.softmax(net, name = 'softmax')
+        self.logits = net # the KL loss works on the logits directly, see kl_loss_from_logits
+        if self.target_option == 'standardize':
+            self.prediction = tf.identity(net, name = 'standardized')
+        else:
+            self.prediction = tf.nn.softmax(net, name = 'softmax')
 
 
 class Router(object):
     def __init__(self):
         self.representations = {}
+        self.defaults = {} # fallback representations of input tracks missing at inference, zeros if absent
 
     def stack_input(self, new_representation, track_name):
         self.representations[track_name] = new_representation
@@ -731,26 +970,92 @@ class Router(object):
     def route(self, block_list):
         return {key: val for key, val in self.representations.items() if key not in block_list}
 
+    def substitute(self, missing, batch_size):
+        """Feeds fallback representations in place of the representations of missing tracks
+
+        A fed tensor is not computed, so the encoders of the missing tracks are
+        left out of the session run.
+
+        Args:
+            :param missing: (list) input tracks missing from the data
+            :param batch_size: (int) number of examples of the run
+
+        Returns:
+            dictionary: {key = representation tensor, value = (batch_size, representation_width) fallback}
+        """
+        feed = {}
+        for track_name in missing:
+            representation = self.representations[track_name]
+            default = self.defaults.get(track_name)
+            if default is None:
+                default = np.zeros(representation.get_shape().as_list()[1:], dtype = np.float32)
+            feed[representation] = np.tile(default, (batch_size, 1))
+        return feed
+
+def load_integrator(model_path, batch_norm=False, fill='mean'):
+    """Rebuilds a trained Integrator from its results directory and restores all of its checkpoints
+
+    Args:
+        :param model_path: (directory name) results directory of a main.py run (configuration.json,
+                           architecture.json and <track>_encoder/decoder_model.ckpt files)
+        :param batch_norm: (boolean, default = False) whether the model was trained with batch normalization
+        :param fill: (string, default = mean) representations substituted for missing input tracks, mean (saved
+                     during training, zeros if not found) or zero
+
+    Returns:
+        Integrator with an initialized session holding the trained weights
+    """
+
+    if fill not in ['mean', 'zero']:
+        raise ValueError('fill should be either mean or zero')
+    with open(os.path.join(model_path, 'configuration.json')) as fp:
+        config = byteify(json.load(fp))
+    config['Options']['Reload'] = 'all'
+    model = Integrator(config=config,
+                       architecture_path=os.path.join(model_path, 'architecture.json'),
+                       batch_norm=batch_norm,
+                       model_path=model_path)
+    model.initialize()
+    model._load()
+    if fill == 'mean' and not model.load_mean_representations():
+        print('No ' + MEAN_REPRESENTATIONS_FILE + ' in ' + model_path + ', missing tracks will be substituted by zeros')
+    return model
+
 ################################################################################
 #                     Loss Functions and Performance Measures                  #
 ################################################################################
-def kl_loss(y_true, y_pred):
-    """Calculates Kullback-Leibler divergence between prior and posterior distributions
+def kl_loss_from_logits(y_true, logits):
+    """Calculates Kullback-Leibler divergence between target distributions and the softmax of logits
+
+    Numerically stable: uses log_softmax of the logits instead of clipping and
+    taking the log of predicted probabilities.
 
     Args:
-        :param y_true: (tf.tensor) true distribution of data
-        :param y_pred: (tf.tensor) predicted distribution of data
+        :param y_true: (tf.tensor) target distributions, rows already normalized (io_tools.track_to_pdf)
+        :param logits: (tf.tensor) unnormalized log probabilities of the predicted distributions
+
+    Returns:
+        Average relative entropy between target and predicted distributions
+    """
+
+    log_q = tf.nn.log_softmax(logits)
+    # zero target probabilities contribute nothing, the floor only avoids log(0) * 0
+    log_p = tf.log(tf.maximum(y_true, 1e-30))
+    KLdiv = tf.reduce_sum(y_true * (log_p - log_q), axis = -1)
+    return tf.reduce_mean(KLdiv)
+
+def squared_error_loss(y_true, y_pred):
+    """Calculates the mean squared error between standardized targets and predictions
+
+    Args:
+        :param y_true: (tf.tensor) standardized targets (io_tools.track_to_standardized)
+        :param y_pred: (tf.tensor) linear predictions
 
     Returns:
-        Average relative entropy between prior and posterior distributions
+        Mean squared error
     """
 
-    KLdiv = kullback_leibler_divergence(y_true, y_pred)
-    # PREDICTION_FETCHES.update({'KL_divergence': KLdiv})
-    KLloss = tf.reduce_mean(KLdiv)
-    # DeltaKL = KLdiv - KLloss
-    # TRAIN_FETCHES.update({'DeltaKL': DeltaKL})
-    return KLloss
+    return tf.reduce_mean(tf.square(y_true - y_pred))
 
 def per_bp_accuracy(y_true, y_pred):
     pass
@@ -0,0 +1,249 @@
+"""'mutagenesis.py' runs in-silico saturation mutagenesis of the dnaseq input of
+a trained model.
+
+For every region, all 3 x L single-base substitutions of its DNA window are
+predicted and scored against the prediction of the reference sequence. The
+other input tracks of a region do not change across its variants, so their
+encoders are run once per region and their representations are fed for
+all variants (see Integrator.inference_feed). Variants of consecutive
+regions are stacked into large batches, results are streamed to hdf5
+chunk by chunk, and region ranges can be split across processes, each
+writing a shard that is merged at the end.
+
+Scores (per output track, per substitution):
+    kl      KL divergence of the variant prediction from the reference prediction (pdf targets)
+    l2      euclidean distance between the variant and reference predictions (standardized targets)
+
+Output (mutagenesis.h5):
+    <track>             (N, 4, L) scores, indexed like the one hot rows of dnaseq; reference bases are 0
+    reference_<track>   (N, prediction width) predictions of the reference sequences
+    example_index       (N,) example indices of test.h5
+
+Example:
+        $ python mutagenesis.py --runName your_experiment --start 0 --stop 1000 --processes 4
+
+FLAGS:
+    flag:                   default:                description:
+
+    --runName               'experiment'            name of run
+    --resultsDir            '../results'            directory where results from runName are stored
+    --dataDir               '../data/hdf5datasets'  directory where hdf5datasets are stored
+    --start                 0                       first test example
+    --stop                  -1                      end of the test examples, -1 for all
+    --batchSize             2048                    variants predicted per session run
+    --chunkSize             16                      regions written to hdf5 at once
+    --processes             1                       number of processes, each scoring a shard of the regions
+    --score                 'auto'                  kl, l2 or auto (kl for pdf targets, l2 for standardized targets)
+    --output                ''                      output file, defaults to mutagenesis.h5 in the results directory
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import json
+import subprocess
+
+import tensorflow as tf
+import numpy as np
+import h5py
+from tqdm import tqdm as tq
+
+### FIDDLE specific tools ###
+from models import load_integrator
+from metrics import kl_divergence
+#############################
+
+NUM_BASES = 4
+# the three alternative bases of each reference base
+ALTERNATIVES = np.array([[jx for jx in range(NUM_BASES) if jx != ix] for ix in range(NUM_BASES)])
+SCORES = ['kl', 'l2']
+
+
+def substitution_table(one_hot):
+    """Position and alternative base of every single-base substitution of a window
+
+    Args:
+        :param one_hot: (numpy array) (4, L, 1) or (4, L) one hot sequence, N (0.25) counts as the first base
+
+    Returns:
+        tuple: ((3L,) positions, (3L,) alternative bases)
+    """
+    reference = one_hot.reshape(NUM_BASES, -1).argmax(axis=0)
+    positions = np.repeat(np.arange(len(reference)), NUM_BASES - 1)
+    return positions, ALTERNATIVES[reference].ravel()
+
+
+def score_variants(reference, variants, score='kl'):
+    """Effect of each variant prediction relative to the reference prediction of its region
+
+    Args:
+        :param reference: (numpy array) (m, width) reference predictions, one row per variant
+        :param variants: (numpy array) (m, width) variant predictions
+        :param score: (string, default = kl) kl or l2
+
+    Returns:
+        numpy vector: (m,) scores
+    """
+    if score == 'kl':
+        return kl_divergence(reference.astype(np.float64), variants.astype(np.float64))
+    if score == 'l2':
+        return np.sqrt(((variants - reference) ** 2).sum(axis=1))
+    raise ValueError('Unknown score: ' + str(score))
+
+
+def mutagenize(model, data, batch_size=2048, score='kl'):
+    """Scores all single-base substitutions of a set of regions
+
+    Args:
+        :param model: (models.Integrator) trained model with a dnaseq input
+        :param data: (dictionary) keys = input track names, values = (R, height, width, 1) signal of R regions
+        :param batch_size: (int, default = 2048) variants predicted per session run
+        :param score: (string, default = kl) see score_variants
+
+    Returns:
+        tuple: ({key = output track, value = (R, 4, L) scores}, {key = output track, value = (R, width) reference predictions})
+    """
+    dna = data['dnaseq']
+    num_regions, length = dna.shape[0], dna.shape[2]
+    # unchanged tracks are encoded once per region and fed for all of its variants
+    others = {key: data[key] for key in model.architecture['Inputs'] if key != 'dnaseq' and key in data}
+    representations = model.encode(others) if others else {}
+    outputs = list(model.decoders.keys())
+    reference = model.predict({'dnaseq': dna}, representations)
+    reference = {key: reference[key].reshape(num_regions, -1) for key in outputs}
+
+    tables = [substitution_table(dna[rx]) for rx in range(num_regions)]
+    positions = np.concatenate([table[0] for table in tables])
+    bases = np.concatenate([table[1] for table in tables])
+    regions = np.repeat(np.arange(num_regions), (NUM_BASES - 1) * length)
+    identity = np.eye(NUM_BASES, dtype=dna.dtype)
+
+    scores = {key: np.zeros((num_regions, NUM_BASES, length), dtype=np.float32) for key in outputs}
+    for begin in range(0, len(regions), batch_size):
+        rows = slice(begin, begin + batch_size)
+        variants = dna[regions[rows]]
+        variants[np.arange(len(variants)), :, positions[rows], 0] = identity[bases[rows]]
+        predictions = model.predict({'dnaseq': variants},
+                                    {key: val[regions[rows]] for key, val in representations.items()})
+        for key in outputs:
+            scores[key][regions[rows], bases[rows], positions[rows]] = score_variants(
+                reference[key][regions[rows]], predictions[key].reshape(len(variants), -1), score)
+    return scores, reference
+
+
+def run_shard(model, test_path, start, stop, output_path, batch_size=2048, chunk_size=16, score='kl'):
+    """Scores the regions [start, stop) of test.h5 and streams them to output_path"""
+
+    keys = list(model.architecture['Inputs'])
+    with h5py.File(test_path, 'r') as test_h5_handle, h5py.File(output_path, 'w') as output_handle:
+        output_handle.create_dataset('example_index', data=np.arange(start, stop))
+        output_handle.attrs['score'] = score
+        datasets = {}
+        for begin in tq(range(start, stop, chunk_size), desc='regions {}-{}'.format(start, stop)):
+            end = min(begin + chunk_size, stop)
+            scores, reference = mutagenize(model, {key: test_h5_handle[key][begin:end] for key in keys},
+                                           batch_size, score)
+            for key in scores:
+                if key not in datasets:
+                    datasets[key] = output_handle.create_dataset(
+                        key, (stop - start,) + scores[key].shape[1:], dtype='float32',
+                        chunks=(min(chunk_size, stop - start),) + scores[key].shape[1:])
+                    datasets['reference_' + key] = output_handle.create_dataset(
+                        'reference_' + key, (stop - start, reference[key].shape[1]), dtype='float32')
+                datasets[key][begin - start:end - start] = scores[key]
+                datasets['reference_' + key][begin - start:end - start] = reference[key]
+
+
+def merge_shards(shard_paths, output_path, chunk_size=1000):
+    """Concatenates the datasets of shard files written by run_shard, in order"""
+
+    with h5py.File(output_path, 'w') as output_handle:
+        handles = [h5py.File(path, 'r') for path in shard_paths]
+        try:
+            sizes = [handle['example_index'].shape[0] for handle in handles]
+            output_handle.attrs['score'] = handles[0].attrs['score']
+            for key in handles[0].keys():
+                template = handles[0][key]
+                dataset = output_handle.create_dataset(key, (sum(sizes),) + template.shape[1:], dtype=template.dtype,
+                                                       chunks=template.chunks)
+                offset = 0
+                for handle in handles:
+                    for begin in range(0, handle[key].shape[0], chunk_size):
+                        block = handle[key][begin:begin + chunk_size]
+                        dataset[offset + begin:offset + begin + len(block)] = block
+                    offset += handle[key].shape[0]
+        finally:
+            for handle in handles:
+                handle.close()
+
+
+flags = tf.app.flags
+flags.DEFINE_string('runName', 'experiment', '(DEFAULT: experiment) - name of run')
+flags.DEFINE_string('resultsDir', '../results', '(DEFAULT: ../results) - directory where results from runName are stored')
+flags.DEFINE_string('dataDir', '../data/hdf5datasets', '(DEFAULT: ../data/hdf5datasets) - directory where hdf5datasets are stored')
+flags.DEFINE_integer('start', 0, '(DEFAULT: 0) - first test example')
+flags.DEFINE_integer('stop', -1, '(DEFAULT: -1) - end of the test examples, -1 for all')
+flags.DEFINE_integer('batchSize', 2048, '(DEFAULT: 2048) - variants predicted per session run')
+flags.DEFINE_integer('chunkSize', 16, '(DEFAULT: 16) - regions written to hdf5 at once')
+flags.DEFINE_integer('processes', 1, '(DEFAULT: 1) - number of processes, each scoring a shard of the regions')
+flags.DEFINE_string('score', 'auto', '(DEFAULT: auto) - kl, l2 or auto (kl for pdf targets, l2 for standardized targets)')
+flags.DEFINE_string('output', '', '(DEFAULT: mutagenesis.h5 in the results directory) - output file')
+FLAGS = flags.FLAGS
+
+def main(_):
+    """Score the regions in this process, or split them across processes and merge their shards"""
+
+    FLAGS.savePath = os.path.join(FLAGS.resultsDir, FLAGS.runName)
+    output_path = FLAGS.output or os.path.join(FLAGS.savePath, 'mutagenesis.h5')
+    with open(os.path.join(FLAGS.savePath, 'configuration.json')) as fp:
+        config = json.load(fp)
+    if 'dnaseq' not in config['Options']['Inputs']:
+        raise ValueError('Mutagenesis needs a model with a dnaseq input')
+    score = FLAGS.score
+    if score == 'auto':
+        score = 'kl' if config['Options'].get('Targets', 'pdf') == 'pdf' else 'l2'
+    if score not in SCORES:
+        raise ValueError('Unknown score: ' + score)
+    test_path = os.path.join(FLAGS.dataDir, config['Options']['DataName'], 'test.h5')
+    with h5py.File(test_path, 'r') as test_h5_handle:
+        size = test_h5_handle['dnaseq'].shape[0]
+    stop = size if FLAGS.stop < 0 else min(FLAGS.stop, size)
+
+    if FLAGS.processes <= 1:
+        model = load_integrator(FLAGS.savePath)
+        run_shard(model, test_path, FLAGS.start, stop, output_path, FLAGS.batchSize, FLAGS.chunkSize, score)
+        model.sess.close()
+        print('Saved ' + output_path)
+        return
+
+    # every shard runs in a fresh interpreter with its own graph and session
+    bounds = np.linspace(FLAGS.start, stop, FLAGS.processes + 1).astype(int)
+    shard_paths, processes = [], []
+    for ix in range(FLAGS.processes):
+        if bounds[ix] == bounds[ix + 1]:
+            continue
+        shard_paths.append('{}.shard{}'.format(output_path, ix))
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                           '--runName', FLAGS.runName,
+                                           '--resultsDir', FLAGS.resultsDir,
+                                           '--dataDir', FLAGS.dataDir,
+                                           '--start', str(bounds[ix]),
+                                           '--stop', str(bounds[ix + 1]),
+                                           '--batchSize', str(FLAGS.batchSize),
+                                           '--chunkSize', str(FLAGS.chunkSize),
+                                           '--score', score,
+                                           '--processes', '1',
+                                           '--output', shard_paths[-1]]))
+    if any([process.wait() for process in processes]):
+        raise RuntimeError('A mutagenesis shard failed, shards are kept in ' + os.path.dirname(output_path))
+    merge_shards(shard_paths, output_path)
+    for path in shard_paths:
+        os.remove(path)
+    print('Saved ' + output_path)
+
+
+if __name__ == '__main__':
+    tf.app.run()
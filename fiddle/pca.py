@@ -0,0 +1,255 @@
+"""'pca.py' reduces the representations.h5 written by analysis.py to their
+principal components out of core.
+
+Representations are streamed from hdf5 chunk by chunk and chunks are
+processed on multiple cores; only d x d (or d x l sketch) sums are kept in
+memory. Narrow representations get exact PCA from the covariance matrix,
+wide ones randomized subspace iteration on the covariance (Halko et al.
+2011), which needs a few extra passes over the file. The projected
+coordinates are written back to representations.h5 as <key>_pca datasets,
+ready for embedding visualizations of millions of regions, and the fitted
+mean, components and explained variances to pca.h5.
+
+Example:
+    Assuming analysis.py was run for the experiment, the following command
+    adds the first 10 principal components of every representation.
+
+        $ python pca.py --runName your_experiment --components 10 --processes 8
+
+FLAGS:
+    flag:                   default:                description:
+
+    --runName               'experiment'            name of run
+    --resultsDir            '../results'            directory where results from runName are stored
+    --keys                  'all'                   comma separated representations to reduce
+    --components            10                      number of principal components
+    --chunkSize             50000                   number of examples read at once
+    --processes             4                       number of worker processes
+    --exactLimit            1024                    widest representation reduced exactly, wider ones are sketched
+    --powerIterations       2                       power iterations of the randomized method
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import time
+from multiprocessing import Pool
+from optparse import OptionParser
+
+import numpy as np
+import h5py
+
+### FIDDLE specific tools ###
+from io_tools import PCA_SUFFIX, representation_keys
+#############################
+
+CHUNK_SIZE = 50000 # examples read from hdf5 at once
+
+
+################################################################################
+# Chunk workers
+################################################################################
+def _read_chunk(path, key, start, stop):
+    with h5py.File(path, 'r') as h5_handle:
+        chunk = h5_handle[key][start:stop]
+    return chunk.reshape(len(chunk), -1).astype(np.float64)
+
+
+def _chunk_task(task):
+    """Worker: reads one chunk and returns its contribution to a pass
+
+    Stages:
+        moments     (sum of rows, sum of squared norms)
+        covariance  Xc^T Xc of the centered chunk Xc
+        sketch      Xc^T (Xc Q) for a d x l basis Q
+        gram        (Xc Q)^T (Xc Q)
+        project     Xc Q
+    """
+    stage, path, key, start, stop, mean, basis = task
+    x = _read_chunk(path, key, start, stop)
+    if stage == 'moments':
+        return start, (x.sum(axis=0), (x * x).sum())
+    x -= mean
+    if stage == 'covariance':
+        return start, x.T.dot(x)
+    projected = x.dot(basis)
+    if stage == 'sketch':
+        return start, x.T.dot(projected)
+    if stage == 'gram':
+        return start, projected.T.dot(projected)
+    return start, projected.astype(np.float32)
+
+
+class ChunkedPass(object):
+    """Runs the stages of _chunk_task over all chunks of a dataset, in a pool of worker processes"""
+
+    def __init__(self, path, key, chunk_size=CHUNK_SIZE, processes=4):
+        self.path = path
+        self.key = key
+        with h5py.File(path, 'r') as h5_handle:
+            self.size = h5_handle[key].shape[0]
+            self.dim = int(np.prod(h5_handle[key].shape[1:]))
+        self.bounds = [(start, min(start + chunk_size, self.size)) for start in range(0, self.size, chunk_size)]
+        self.pool = Pool(processes) if processes > 1 else None
+
+    def run(self, stage, mean=None, basis=None):
+        """Yields (chunk start, result) of every chunk, in any order"""
+        tasks = [(stage, self.path, self.key, start, stop, mean, basis) for start, stop in self.bounds]
+        if self.pool is None:
+            return (_chunk_task(task) for task in tasks)
+        return self.pool.imap_unordered(_chunk_task, tasks)
+
+    def reduce(self, stage, mean=None, basis=None):
+        """Sum of the results of all chunks"""
+        total = None
+        for _, result in self.run(stage, mean, basis):
+            total = result if total is None else (tuple(a + b for a, b in zip(total, result))
+                                                 if isinstance(total, tuple) else total + result)
+        return total
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+
+################################################################################
+# PCA
+################################################################################
+def _orient(components):
+    """Flips components so that their largest loading is positive, for reproducible signs"""
+    signs = np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])
+    return components * np.where(signs == 0, 1, signs)[:, None]
+
+
+def fit_pca(chunks, num_components=10, exact_limit=1024, oversampling=10, power_iterations=2, seed=0):
+    """Fits the principal components of a dataset streamed by chunks
+
+    Args:
+        :param chunks: (ChunkedPass) dataset of representations
+        :param num_components: (int, default = 10) number of principal components
+        :param exact_limit: (int, default = 1024) widest representation reduced from the full covariance
+        :param oversampling: (int, default = 10) extra sketch dimensions of the randomized method
+        :param power_iterations: (int, default = 2) power iterations of the randomized method
+        :param seed: (int, default = 0) seed of the random sketch
+
+    Returns:
+        dictionary: mean (d,), components (k, d), explained_variance (k,), explained_variance_ratio (k,)
+    """
+    num_components = min(num_components, chunks.dim, chunks.size)
+    sums, squared_norms = chunks.reduce('moments')
+    mean = sums / chunks.size
+    total_variance = (squared_norms - chunks.size * mean.dot(mean)) / max(chunks.size - 1, 1)
+
+    if chunks.dim <= exact_limit:
+        covariance = chunks.reduce('covariance', mean) / max(chunks.size - 1, 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        basis, eigenvalues, eigenvectors = np.eye(chunks.dim), eigenvalues[::-1], eigenvectors[:, ::-1]
+    else:
+        rng = np.random.RandomState(seed)
+        basis = rng.randn(chunks.dim, min(num_components + oversampling, chunks.dim))
+        for _ in range(power_iterations + 1):
+            basis, _ = np.linalg.qr(chunks.reduce('sketch', mean, basis))
+        gram = chunks.reduce('gram', mean, basis) / max(chunks.size - 1, 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(gram)
+        eigenvalues, eigenvectors = eigenvalues[::-1], eigenvectors[:, ::-1]
+
+    components = _orient(basis.dot(eigenvectors[:, :num_components]).T)
+    explained_variance = np.maximum(eigenvalues[:num_components], 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        explained_variance_ratio = explained_variance / total_variance
+    return {'mean': mean, 'components': components, 'explained_variance': explained_variance,
+            'explained_variance_ratio': explained_variance_ratio}
+
+
+def transform(chunks, pca):
+    """Projects all examples on the principal components
+
+    Returns:
+        numpy array: (N, k) float32 coordinates
+    """
+    coordinates = np.empty((chunks.size, len(pca['components'])), dtype=np.float32)
+    for start, projected in chunks.run('project', pca['mean'], pca['components'].T):
+        coordinates[start:start + len(projected)] = projected
+    return coordinates
+
+
+def pca_representations(representations_path, pca_path, keys=None, num_components=10, chunk_size=CHUNK_SIZE,
+                        processes=4, **kwargs):
+    """Reduces representations to principal components, written back as <key>_pca datasets
+
+    Args:
+        :param representations_path: (string) representations.h5 written by analysis.py
+        :param pca_path: (string) hdf5 file the fitted models are written to, one group per representation
+        :param keys: (list, default = None) representations to reduce, None reduces all
+        :param num_components: (int, default = 10) number of principal components
+        :param chunk_size: (int, default = 50000) number of examples read at once
+        :param processes: (int, default = 4) number of worker processes, 1 runs in this process
+        :param kwargs: see fit_pca
+
+    Returns:
+        dictionary: {key = representation name, value = fitted model, see fit_pca}
+    """
+    if keys is None:
+        with h5py.File(representations_path, 'r') as h5_handle:
+            keys = representation_keys(h5_handle)
+    models = {}
+    for key in keys:
+        start = time.time()
+        chunks = ChunkedPass(representations_path, key, chunk_size, processes)
+        try:
+            models[key] = fit_pca(chunks, num_components, **kwargs)
+            coordinates = transform(chunks, models[key])
+        finally:
+            chunks.close()
+        # workers are done reading, the file can be opened for writing
+        with h5py.File(representations_path, 'a') as h5_handle:
+            if key + PCA_SUFFIX in h5_handle:
+                del h5_handle[key + PCA_SUFFIX]
+            dataset = h5_handle.create_dataset(key + PCA_SUFFIX, data=coordinates)
+            dataset.attrs['explained_variance_ratio'] = models[key]['explained_variance_ratio']
+        print('{}: {} x {} -> {} components, {:.1%} of the variance, {:.1f} s'.format(
+            key, chunks.size, chunks.dim, coordinates.shape[1], np.nansum(models[key]['explained_variance_ratio']),
+            time.time() - start))
+
+    with h5py.File(pca_path, 'a') as h5_handle:
+        for key, model in models.items():
+            if key in h5_handle:
+                del h5_handle[key]
+            group = h5_handle.create_group(key)
+            for name, values in model.items():
+                group.create_dataset(name, data=values)
+    return models
+
+
+################################################################################
+# Main
+################################################################################
+def main():
+    parser = OptionParser('usage: %prog [options]')
+    parser.add_option('--runName', dest='runName', default='experiment', help='(DEFAULT: experiment) - name of run')
+    parser.add_option('--resultsDir', dest='resultsDir', default='../results', help='(DEFAULT: ../results) - directory where results from runName are stored')
+    parser.add_option('--keys', dest='keys', default='all', help='(DEFAULT: all) - comma separated representations to reduce')
+    parser.add_option('--components', dest='components', type='int', default=10, help='(DEFAULT: 10) - number of principal components')
+    parser.add_option('--chunkSize', dest='chunkSize', type='int', default=CHUNK_SIZE, help='(DEFAULT: 50000) - number of examples read at once')
+    parser.add_option('--processes', dest='processes', type='int', default=4, help='(DEFAULT: 4) - number of worker processes')
+    parser.add_option('--exactLimit', dest='exactLimit', type='int', default=1024, help='(DEFAULT: 1024) - widest representation reduced exactly, wider ones are sketched')
+    parser.add_option('--powerIterations', dest='powerIterations', type='int', default=2, help='(DEFAULT: 2) - power iterations of the randomized method')
+    (FLAGS, args) = parser.parse_args()
+
+    save_path = os.path.join(FLAGS.resultsDir, FLAGS.runName)
+    pca_representations(os.path.join(save_path, 'representations.h5'),
+                        os.path.join(save_path, 'pca.h5'),
+                        keys=None if FLAGS.keys == 'all' else FLAGS.keys.split(','),
+                        num_components=FLAGS.components,
+                        chunk_size=FLAGS.chunkSize,
+                        processes=FLAGS.processes,
+                        exact_limit=FLAGS.exactLimit,
+                        power_iterations=FLAGS.powerIterations)
+    print('Saved ' + os.path.join(save_path, 'pca.h5'))
+
+
+if __name__ == '__main__':
+    main()
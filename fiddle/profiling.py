@@ -0,0 +1,210 @@
+"""'profiling.py' provides lightweight instrumentation of FIDDLE's hot paths.
+
+Named timing spans (batch fetch, feed construction, session runs, validation,
+checkpointing, prediction dumps ...) are aggregated into log-spaced duration
+histograms per reporting interval, and an opt-in sampler captures
+TensorFlow timelines every K steps and merges them into a single Chrome
+trace (open in chrome://tracing).
+
+Usage:
+    To utilize methods and classes in profiling.py, place the following import
+    command in the imports of a python file.
+
+        > from profiling import *
+
+        > profiler = Profiler()
+        > with profiler.span('batch_fetch') as span:
+        >     batch = next(batcher)
+        > profiler.end_interval(step)
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+# log-spaced duration bins from 1 microsecond to 1000 seconds, 10 per decade
+HISTOGRAM_EDGES = 10 ** np.arange(-6, 3.05, 0.1)
+
+
+class Span(object):
+    """Duration of one timed block, same attributes as io_tools.Timer"""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.end = None
+        self.secs = 0.
+        self.msecs = 0.
+
+    def stop(self):
+        self.end = time.time()
+        self.secs = self.end - self.start
+        self.msecs = self.secs * 1000
+
+
+class Profiler(object):
+    """Collects named timing spans into per-interval duration histograms"""
+
+    def __init__(self, enabled=True, log_path=None, keep_events=False, max_events=100000, verbose=True):
+        """
+        Args:
+            :param enabled: (boolean, default = True) when False spans are timed but not recorded
+            :param log_path: (string, default = None) json lines file the interval histograms are appended to
+            :param keep_events: (boolean, default = False) keep individual spans to add them to a Chrome trace
+            :param max_events: (int, default = 100000) maximum number of individual spans kept
+            :param verbose: (boolean, default = True) print a summary at the end of each interval
+        """
+        self.enabled = enabled
+        self.log_path = log_path
+        self.keep_events = keep_events
+        self.max_events = max_events
+        self.verbose = verbose
+        self.events = []
+        self._durations = OrderedDict()
+        self._interval_start = time.time()
+
+    @contextmanager
+    def span(self, name):
+        """Times the enclosed block under name
+
+        Args:
+            :param name: (string) name of the span, e.g. 'session_run'
+
+        Returns:
+            Span: elapsed time is available as .secs once the block exits
+        """
+        span = Span(name)
+        try:
+            yield span
+        finally:
+            span.stop()
+            if self.enabled:
+                self.record(name, span.secs, span.start)
+
+    def record(self, name, secs, start=None):
+        """Adds a duration measured elsewhere"""
+        self._durations.setdefault(name, []).append(secs)
+        if self.keep_events and start is not None and len(self.events) < self.max_events:
+            self.events.append((name, start, secs))
+
+    def histograms(self):
+        """Duration histograms of the current interval
+
+        Returns:
+            dictionary: {key = span name, value = dictionary of count, total_secs, mean_secs,
+                         p50_secs, p99_secs, max_secs and the histogram counts over HISTOGRAM_EDGES}
+        """
+        result = OrderedDict()
+        for name, durations in self._durations.items():
+            durations = np.asarray(durations)
+            counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES, durations), minlength=len(HISTOGRAM_EDGES) + 1)
+            result[name] = {'count': len(durations),
+                            'total_secs': float(durations.sum()),
+                            'mean_secs': float(durations.mean()),
+                            'p50_secs': _histogram_quantile(counts, 0.5),
+                            'p99_secs': _histogram_quantile(counts, 0.99),
+                            'max_secs': float(durations.max()),
+                            'histogram': counts.tolist()}
+        return result
+
+    def end_interval(self, step):
+        """Reports and resets the histograms of the current interval
+
+        Args:
+            :param step: (int) training step the interval ends at
+
+        Returns:
+            dictionary: histograms of the interval, as returned by histograms()
+        """
+        histograms = self.histograms()
+        now = time.time()
+        if self.verbose and histograms:
+            print(format_histograms(histograms, now - self._interval_start))
+        if self.log_path is not None and histograms:
+            with open(self.log_path, 'a') as fp:
+                fp.write(json.dumps({'step': step, 'wall_secs': now - self._interval_start,
+                                     'spans': histograms}) + '\n')
+        self._durations = OrderedDict()
+        self._interval_start = now
+        return histograms
+
+
+def _histogram_quantile(counts, quantile):
+    """Upper bin edge below which the quantile of the durations lies"""
+    idx = int(np.searchsorted(np.cumsum(counts), quantile * counts.sum()))
+    return float(HISTOGRAM_EDGES[min(idx, len(HISTOGRAM_EDGES) - 1)])
+
+
+def format_histograms(histograms, wall_secs):
+    """Formats interval histograms as a table, one line per span"""
+    lines = ['{:<20} {:>7} {:>10} {:>10} {:>10} {:>10} {:>7}'.format(
+        'span', 'count', 'total(s)', 'mean(ms)', 'p50(ms)', 'p99(ms)', '% wall')]
+    for name, hist in histograms.items():
+        lines.append('{:<20} {:>7d} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>7.1f}'.format(
+            name, hist['count'], hist['total_secs'], 1e3 * hist['mean_secs'], 1e3 * hist['p50_secs'],
+            1e3 * hist['p99_secs'], 100. * hist['total_secs'] / max(wall_secs, 1e-9)))
+    return '\n'.join(lines)
+
+
+class TimelineSampler(object):
+    """Captures TensorFlow timelines every K steps and merges them into one Chrome trace"""
+
+    def __init__(self, every, path='timeline.json', max_traces=20):
+        """
+        Args:
+            :param every: (int) trace one session run every this many steps, 0 disables
+            :param path: (string, default = timeline.json) merged Chrome trace file
+            :param max_traces: (int, default = 20) maximum number of traced steps kept
+        """
+        self.every = every
+        self.path = path
+        self.max_traces = max_traces
+        self.num_traces = 0
+        self.trace_events = []
+
+    def should_trace(self, step):
+        return (self.every > 0) and (step % self.every == 0) and (self.num_traces < self.max_traces)
+
+    def run_options(self, step):
+        """Returns (tf.RunOptions, tf.RunMetadata) for a traced step, (None, None) otherwise"""
+        if not self.should_trace(step):
+            return None, None
+        import tensorflow as tf
+        return tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), tf.RunMetadata()
+
+    def add(self, run_metadata, step):
+        """Adds the timeline of a traced step to the merged trace
+
+        Args:
+            :param run_metadata: (tf.RunMetadata) filled in by a traced Session.run
+            :param step: (int) training step of the trace
+        """
+        if run_metadata is None:
+            return
+        from tensorflow.python.client import timeline
+        trace = json.loads(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+        pid_offset = 1000 * (self.num_traces + 1)
+        for event in trace['traceEvents']:
+            if 'pid' in event:
+                event['pid'] += pid_offset
+            if event.get('ph') == 'M' and event.get('name') == 'process_name':
+                event['args']['name'] = 'step {}: {}'.format(step, event['args']['name'])
+            self.trace_events.append(event)
+        self.num_traces += 1
+
+    def save(self, profiler=None):
+        """Writes the merged Chrome trace, including the spans kept by profiler if given"""
+        events = list(self.trace_events)
+        if profiler is not None and profiler.events:
+            events.append({'ph': 'M', 'name': 'process_name', 'pid': 0, 'args': {'name': 'FIDDLE spans'}})
+            events += [{'ph': 'X', 'name': name, 'pid': 0, 'tid': 0, 'ts': 1e6 * start, 'dur': 1e6 * secs}
+                       for name, start, secs in profiler.events]
+        with open(self.path, 'w') as fp:
+            json.dump({'traceEvents': events}, fp)
@@ -0,0 +1,359 @@
+"""'representation_store.py' compacts the representations.h5 written by analysis.py
+into quantized codes with an approximate nearest neighbour index, to find the
+regions whose representations are most similar to a given one.
+
+The index is an inverted file (IVF): representations are assigned to the
+nearest of a set of k-means centroids and stored list by list, so a query
+only scans the few lists closest to it. Representations are stored either
+as float16 vectors or as product quantization (PQ) codes of their residual
+to the list centroid, one byte per subspace, compared to queries through
+distance lookup tables. Only NumPy and h5py are needed.
+
+Example:
+    Assuming analysis.py was run for the experiment, the following command
+    writes "representation_index.h5" to the results directory and prints the
+    10 regions closest to test example 123 in the tssseq decoder representation.
+
+        $ python representation_store.py --runName your_experiment --codec pq --subquantizers 8
+        $ python representation_store.py --runName your_experiment --query 123 --key decoder_tssseq -k 10
+
+FLAGS:
+    flag:                   default:                description:
+
+    --runName               'experiment'            name of run
+    --resultsDir            '../results'            directory where results from runName are stored
+    --keys                  'all'                   comma separated representations to index
+    --codec                 'float16'               storage of the representations [float16 or pq]
+    --lists                 0                       number of inverted lists, 0 uses 4 * sqrt(number of examples)
+    --subquantizers         8                       bytes per representation with the pq codec
+    --sample                100000                  examples the centroids and codebooks are trained on
+    --normalize             False                   index unit length representations (cosine similarity)
+    --query                 None                    example to find the neighbours of, skips building
+    --key                   None                    representation queried
+    -k                      10                      number of neighbours
+    --nprobe                8                       inverted lists scanned per query
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import time
+from optparse import OptionParser
+
+import numpy as np
+import h5py
+
+### FIDDLE specific tools ###
+from io_tools import representation_keys
+#############################
+
+CHUNK_SIZE = 100000 # examples read from hdf5 at once
+CODECS = ['float16', 'pq']
+
+
+################################################################################
+# k-means
+################################################################################
+def squared_distances(x, centroids):
+    """(n, k) squared euclidean distances of the rows of x to the centroids"""
+    distances = (x * x).sum(axis=1)[:, None] - 2 * x.dot(centroids.T) + (centroids * centroids).sum(axis=1)[None, :]
+    return np.maximum(distances, 0)
+
+
+def assign(x, centroids, chunk_size=10000):
+    """Index of the nearest centroid of every row of x"""
+    return np.concatenate([squared_distances(x[ix:ix + chunk_size], centroids).argmin(axis=1)
+                           for ix in range(0, len(x), chunk_size)]) if len(x) else np.zeros(0, dtype=np.int64)
+
+
+def kmeans(x, k, iterations=20, seed=0):
+    """Lloyd's k-means, empty clusters are re-seeded with random examples
+
+    Args:
+        :param x: (numpy array) (n, d) float32 training examples
+        :param k: (int) number of centroids, at most n
+        :param iterations: (int, default = 20) number of Lloyd iterations
+        :param seed: (int, default = 0) seed of the initialization
+
+    Returns:
+        numpy array: (k, d) float32 centroids
+    """
+    rng = np.random.RandomState(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        labels = assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        order = np.argsort(labels, kind='mergesort')
+        empty = counts == 0
+        # sums of the examples of each (non-empty) cluster, contiguous after sorting by label
+        sums = np.add.reduceat(x[order].astype(np.float64), np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty])
+        centroids[~empty] = sums / counts[~empty, None]
+        centroids[empty] = x[rng.choice(len(x), empty.sum(), replace=False)]
+    return centroids
+
+
+################################################################################
+# Index
+################################################################################
+class RepresentationIndex(object):
+    """Inverted file index over quantized representations, held in memory"""
+
+    def __init__(self, centroids, list_offsets, ids, codes, codec='float16', codebooks=None, normalize=False):
+        """
+        Args:
+            :param centroids: (numpy array) (lists, d) coarse centroids
+            :param list_offsets: (numpy vector) (lists + 1,) start of each list in ids and codes
+            :param ids: (numpy vector) (N,) example indices of representations.h5, list by list
+            :param codes: (numpy array) (N, d) float16 vectors or (N, subquantizers) uint8 pq codes, list by list
+            :param codec: (string, default = float16) float16 or pq
+            :param codebooks: (numpy array, default = None) (subquantizers, 256, d / subquantizers) pq codebooks
+            :param normalize: (boolean, default = False) representations were scaled to unit length
+        """
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.ids = ids
+        self.codes = codes
+        self.codec = codec
+        self.codebooks = codebooks
+        self.normalize = normalize
+        self._positions = None
+
+    @property
+    def size(self):
+        return len(self.ids)
+
+    def _prepare(self, queries):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.normalize:
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        return queries
+
+    def _list_distances(self, query, list_ix):
+        """Squared distances of a query to the representations of one list"""
+        begin, end = self.list_offsets[list_ix], self.list_offsets[list_ix + 1]
+        codes = self.codes[begin:end]
+        if self.codec == 'float16':
+            diff = codes.astype(np.float32) - query
+            return (diff * diff).sum(axis=1)
+        residual = (query - self.centroids[list_ix]).reshape(len(self.codebooks), 1, -1)
+        tables = ((self.codebooks - residual) ** 2).sum(axis=2) # (subquantizers, 256)
+        return tables[np.arange(len(self.codebooks)), codes].sum(axis=1)
+
+    def search(self, queries, k=10, nprobe=8):
+        """Approximate k nearest neighbours (squared euclidean distance) of each query
+
+        Args:
+            :param queries: (numpy array) (q, d) or (d,) representations
+            :param k: (int, default = 10) number of neighbours
+            :param nprobe: (int, default = 8) number of closest inverted lists scanned
+
+        Returns:
+            tuple: ((q, k) squared distances, (q, k) example indices), -1 where fewer than k were found
+        """
+        queries = self._prepare(queries)
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(squared_distances(queries, self.centroids), nprobe - 1, axis=1)[:, :nprobe]
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        neighbours = np.full((len(queries), k), -1, dtype=np.int64)
+        for qx, query in enumerate(queries):
+            candidate_distances = np.concatenate([self._list_distances(query, list_ix) for list_ix in probes[qx]])
+            candidates = np.concatenate([self.ids[self.list_offsets[list_ix]:self.list_offsets[list_ix + 1]]
+                                         for list_ix in probes[qx]])
+            found = min(k, len(candidates))
+            if found == 0:
+                continue
+            top = np.argpartition(candidate_distances, found - 1)[:found]
+            top = top[np.argsort(candidate_distances[top])]
+            distances[qx, :found] = candidate_distances[top]
+            neighbours[qx, :found] = candidates[top]
+        return distances, neighbours
+
+    def reconstruct(self, ids):
+        """Decoded (approximate) representations of examples of representations.h5"""
+        if self._positions is None:
+            self._positions = np.empty(self.size, dtype=np.int64)
+            self._positions[self.ids] = np.arange(self.size)
+        positions = self._positions[np.atleast_1d(ids)]
+        if self.codec == 'float16':
+            return self.codes[positions].astype(np.float32)
+        lists = np.searchsorted(self.list_offsets, positions, side='right') - 1
+        codes = self.codes[positions]
+        decoded = np.concatenate([self.codebooks[jx][codes[:, jx]] for jx in range(len(self.codebooks))], axis=1)
+        return self.centroids[lists] + decoded
+
+    def search_similar(self, ids, k=10, nprobe=8):
+        """Neighbours of examples of representations.h5, the examples themselves excluded"""
+        distances, neighbours = self.search(self.reconstruct(ids), k + 1, nprobe)
+        ids = np.atleast_1d(ids)
+        result_distances = np.full((len(ids), k), np.inf, dtype=np.float32)
+        result_neighbours = np.full((len(ids), k), -1, dtype=np.int64)
+        for qx in range(len(ids)):
+            keep = neighbours[qx] != ids[qx]
+            result_distances[qx] = distances[qx][keep][:k]
+            result_neighbours[qx] = neighbours[qx][keep][:k]
+        return result_distances, result_neighbours
+
+    def save(self, h5_group):
+        h5_group.attrs['codec'] = self.codec
+        h5_group.attrs['normalize'] = self.normalize
+        for name in ['centroids', 'list_offsets', 'ids', 'codes', 'codebooks']:
+            if getattr(self, name) is not None:
+                h5_group.create_dataset(name, data=getattr(self, name))
+
+    @classmethod
+    def load(cls, h5_group):
+        return cls(h5_group['centroids'][:], h5_group['list_offsets'][:], h5_group['ids'][:], h5_group['codes'][:],
+                   codec=str(h5_group.attrs['codec']),
+                   codebooks=h5_group['codebooks'][:] if 'codebooks' in h5_group else None,
+                   normalize=bool(h5_group.attrs['normalize']))
+
+
+################################################################################
+# Building
+################################################################################
+def _read_chunks(dataset, chunk_size=CHUNK_SIZE, normalize=False):
+    """Yields (start, (n, d) float32 chunk) of a dataset of representations"""
+    for start in range(0, dataset.shape[0], chunk_size):
+        chunk = dataset[start:start + chunk_size].reshape(-1, int(np.prod(dataset.shape[1:]))).astype(np.float32)
+        if normalize:
+            chunk /= np.maximum(np.linalg.norm(chunk, axis=1, keepdims=True), 1e-12)
+        yield start, chunk
+
+
+def build_index(dataset, codec='float16', num_lists=0, subquantizers=8, sample_size=100000, normalize=False,
+                chunk_size=CHUNK_SIZE, seed=0):
+    """Builds the index of a dataset of representations in two passes over the file
+
+    The first pass draws a random sample to train the centroids (and pq
+    codebooks) on, the second encodes all representations chunk by chunk.
+    Only the compact codes are held in memory.
+
+    Args:
+        :param dataset: (h5py.Dataset) (N, ...) representations
+        :param codec: (string, default = float16) float16 or pq
+        :param num_lists: (int, default = 0) number of inverted lists, 0 uses 4 * sqrt(N)
+        :param subquantizers: (int, default = 8) pq bytes per representation, must divide the dimension
+        :param sample_size: (int, default = 100000) training examples
+        :param normalize: (boolean, default = False) scale representations to unit length (cosine similarity)
+        :param chunk_size: (int, default = 100000) examples read at once
+        :param seed: (int, default = 0) seed of the sampling and k-means initializations
+
+    Returns:
+        RepresentationIndex
+    """
+    if codec not in CODECS:
+        raise ValueError('Unknown codec: ' + str(codec))
+    size = dataset.shape[0]
+    dim = int(np.prod(dataset.shape[1:]))
+    if codec == 'pq' and dim % subquantizers != 0:
+        raise ValueError('{} subquantizers do not divide the representation width {}'.format(subquantizers, dim))
+    rng = np.random.RandomState(seed)
+    num_lists = min(num_lists or int(4 * np.sqrt(size)), size, sample_size)
+
+    sample = np.concatenate([chunk[rng.rand(len(chunk)) < sample_size / size]
+                             for _, chunk in _read_chunks(dataset, chunk_size, normalize)])
+    if len(sample) < num_lists:
+        sample = np.concatenate([chunk for _, chunk in _read_chunks(dataset, chunk_size, normalize)])[:sample_size]
+    centroids = kmeans(sample, num_lists, seed=seed)
+
+    codebooks = None
+    if codec == 'pq':
+        residuals = (sample - centroids[assign(sample, centroids)]).reshape(len(sample), subquantizers, -1)
+        num_codes = min(256, len(sample))
+        codebooks = np.stack([kmeans(residuals[:, jx], num_codes, seed=seed + jx) for jx in range(subquantizers)])
+
+    labels = np.empty(size, dtype=np.int64)
+    codes = np.empty((size, dim), dtype=np.float16) if codec == 'float16' else np.empty((size, subquantizers), dtype=np.uint8)
+    for start, chunk in _read_chunks(dataset, chunk_size, normalize):
+        chunk_labels = assign(chunk, centroids)
+        labels[start:start + len(chunk)] = chunk_labels
+        if codec == 'float16':
+            codes[start:start + len(chunk)] = chunk
+        else:
+            residuals = (chunk - centroids[chunk_labels]).reshape(len(chunk), subquantizers, -1)
+            for jx in range(subquantizers):
+                codes[start:start + len(chunk), jx] = assign(residuals[:, jx], codebooks[jx])
+
+    ids = np.argsort(labels, kind='mergesort')
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=num_lists))])
+    return RepresentationIndex(centroids, list_offsets, ids, codes[ids], codec=codec, codebooks=codebooks,
+                               normalize=normalize)
+
+
+def build_store(representations_path, output_path, keys=None, **kwargs):
+    """Indexes representations of representations.h5 into one group per representation of output_path
+
+    Args:
+        :param representations_path: (string) representations.h5 written by analysis.py
+        :param output_path: (string) index file, overwritten
+        :param keys: (list, default = None) representations to index, None indexes all (not their <key>_pca projections)
+        :param kwargs: see build_index
+
+    Returns:
+        dictionary: {key = representation name, value = RepresentationIndex}
+    """
+    indexes = {}
+    with h5py.File(representations_path, 'r') as input_handle, h5py.File(output_path, 'w') as output_handle:
+        for key in keys or representation_keys(input_handle):
+            start = time.time()
+            indexes[key] = build_index(input_handle[key], **kwargs)
+            indexes[key].save(output_handle.create_group(key))
+            print('{}: {} representations, {} lists, {:.1f} s'.format(key, indexes[key].size,
+                                                                       len(indexes[key].centroids), time.time() - start))
+    return indexes
+
+
+def load_store(path, key):
+    """Loads the index of one representation from a file written by build_store"""
+    with h5py.File(path, 'r') as h5_handle:
+        return RepresentationIndex.load(h5_handle[key])
+
+
+################################################################################
+# Main
+################################################################################
+def main():
+    parser = OptionParser('usage: %prog [options]')
+    parser.add_option('--runName', dest='runName', default='experiment', help='(DEFAULT: experiment) - name of run')
+    parser.add_option('--resultsDir', dest='resultsDir', default='../results', help='(DEFAULT: ../results) - directory where results from runName are stored')
+    parser.add_option('--keys', dest='keys', default='all', help='(DEFAULT: all) - comma separated representations to index')
+    parser.add_option('--codec', dest='codec', default='float16', help='(DEFAULT: float16) - storage of the representations [float16 or pq]')
+    parser.add_option('--lists', dest='lists', type='int', default=0, help='(DEFAULT: 0) - number of inverted lists, 0 uses 4 * sqrt(number of examples)')
+    parser.add_option('--subquantizers', dest='subquantizers', type='int', default=8, help='(DEFAULT: 8) - bytes per representation with the pq codec')
+    parser.add_option('--sample', dest='sample', type='int', default=100000, help='(DEFAULT: 100000) - examples the centroids and codebooks are trained on')
+    parser.add_option('--normalize', dest='normalize', action='store_true', default=False, help='(DEFAULT: False) - index unit length representations (cosine similarity)')
+    parser.add_option('--query', dest='query', type='int', default=None, help='(DEFAULT: None) - example to find the neighbours of, skips building')
+    parser.add_option('--key', dest='key', default=None, help='(DEFAULT: None) - representation queried')
+    parser.add_option('-k', dest='k', type='int', default=10, help='(DEFAULT: 10) - number of neighbours')
+    parser.add_option('--nprobe', dest='nprobe', type='int', default=8, help='(DEFAULT: 8) - inverted lists scanned per query')
+    (FLAGS, args) = parser.parse_args()
+
+    save_path = os.path.join(FLAGS.resultsDir, FLAGS.runName)
+    index_path = os.path.join(save_path, 'representation_index.h5')
+    if FLAGS.query is None:
+        build_store(os.path.join(save_path, 'representations.h5'), index_path,
+                    keys=None if FLAGS.keys == 'all' else FLAGS.keys.split(','),
+                    codec=FLAGS.codec,
+                    num_lists=FLAGS.lists,
+                    subquantizers=FLAGS.subquantizers,
+                    sample_size=FLAGS.sample,
+                    normalize=FLAGS.normalize)
+        print('Saved ' + index_path)
+        return
+
+    if FLAGS.key is None:
+        parser.error('--key is required with --query')
+    index = load_store(index_path, FLAGS.key)
+    start = time.time()
+    distances, neighbours = index.search_similar(FLAGS.query, k=FLAGS.k, nprobe=FLAGS.nprobe)
+    print('{} nearest neighbours of example {} in {} ({:.2f} ms)'.format(FLAGS.k, FLAGS.query, FLAGS.key,
+                                                                         (time.time() - start) * 1000))
+    for distance, neighbour in zip(distances[0], neighbours[0]):
+        if neighbour >= 0:
+            print('{:>10} {:>12.4f}'.format(neighbour, distance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""'server.py' serves predictions and representations of a trained model over
+local HTTP.
+
+The model is restored once and kept in a warm session. Concurrent requests
+are queued and micro-batched: the batching thread waits for the first
+request, collects further requests until the batch is full or the maximum
+latency has passed, runs them as a single session run and hands every
+request its own slice of the result.
+
+Endpoints:
+    GET  /health            model inputs and outputs, batching statistics
+    POST /predict           predictions of the output tracks
+    POST /representations   encoder and decoder representations
+
+Requests carry one (N, height, width, 1) array per input track of the model
+(tracks left out are substituted by the model, see Integrator.inference_feed),
+either as an .npz body (Content-Type: application/octet-stream, answered
+with .npz) or as JSON {"inputs": {track: nested lists}} (answered with JSON).
+
+Example:
+        $ python server.py --runName your_experiment --port 8470
+        $ python ../benchmarks/load_test.py --url http://127.0.0.1:8470 -c 16 -n 2000
+
+FLAGS:
+    flag:                   default:                description:
+
+    --runName               'experiment'            name of run
+    --resultsDir            '../results'            directory where results from runName are stored
+    --host                  '127.0.0.1'             address to listen on
+    --port                  8470                    port to listen on
+    --maxBatchSize          256                     maximum number of examples run at once
+    --maxLatencyMs          5.                      maximum time the first request of a batch waits for others
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import io
+import json
+import time
+import threading
+
+import numpy as np
+from six.moves import queue, socketserver, BaseHTTPServer
+import tensorflow as tf
+
+### FIDDLE specific tools ###
+from models import load_integrator
+#############################
+
+PREDICT = 'predict'
+REPRESENTATIONS = 'representations'
+
+
+class RequestError(ValueError):
+    """Malformed request, answered with 400"""
+    pass
+
+
+class _Pending(object):
+    """A queued request waiting for its slice of a batch"""
+
+    def __init__(self, kind, inputs):
+        self.kind = kind
+        self.inputs = inputs
+        self.size = inputs.values()[0].shape[0]
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """Batches concurrent requests into single session runs on a dedicated thread"""
+
+    def __init__(self, model, max_batch_size=256, max_latency=0.005):
+        """
+        Args:
+            :param model: (models.Integrator) model with an initialized session
+            :param max_batch_size: (int, default = 256) maximum number of examples run at once
+            :param max_latency: (float, default = 0.005) seconds the first request of a batch waits for others
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.input_shapes = {key: model.inputs[key].get_shape().as_list()[1:] for key in model.architecture['Inputs']}
+        self.stats = {'requests': 0, 'examples': 0, 'batches': 0, 'run_secs': 0.}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='micro-batcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, kind, inputs):
+        """Queues a request and blocks until its results are ready
+
+        Args:
+            :param kind: (string) PREDICT or REPRESENTATIONS
+            :param inputs: (dictionary) {key = input track name, value = (N, height, width, 1) numpy array}
+
+        Returns:
+            dictionary: {key = fetch name, value = numpy array of the N examples}
+        """
+        inputs = self.check_inputs(inputs)
+        pending = _Pending(kind, inputs)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def check_inputs(self, inputs):
+        """Casts inputs to float32 and validates their shapes against the model
+
+        Any non-empty subset of the input tracks is accepted, the model substitutes the missing ones.
+        """
+        unknown = set(inputs) - set(self.input_shapes)
+        if unknown or not inputs:
+            raise RequestError('Inputs should be a non-empty subset of: ' + ', '.join(sorted(self.input_shapes)))
+        checked = {}
+        for key in inputs:
+            shape = self.input_shapes[key]
+            array = np.asarray(inputs[key], dtype=np.float32)
+            if array.ndim == len(shape):
+                array = array[None]
+            if list(array.shape[1:]) != shape:
+                raise RequestError('{} has shape {}, expected (N, {})'.format(
+                    key, array.shape, ', '.join(str(dim) for dim in shape)))
+            checked[key] = array
+        sizes = set(array.shape[0] for array in checked.values())
+        if len(sizes) != 1 or 0 in sizes:
+            raise RequestError('Inputs must hold the same, non-zero number of examples')
+        return checked
+
+    def _collect(self):
+        """Blocks for a request, then gathers more until the batch is full or the latency window closes"""
+        batch = [self._queue.get()]
+        size = batch[0].size
+        deadline = time.time() + self.max_latency
+        while size < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += pending.size
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            # requests are run together if they ask for the same thing with the same tracks
+            groups = {}
+            for pending in batch:
+                groups.setdefault((pending.kind, tuple(sorted(pending.inputs))), []).append(pending)
+            for (kind, keys), group in groups.items():
+                self._run(group, kind, keys)
+
+    def _run(self, batch, kind, keys):
+        """Runs requests of one kind and input tracks as a single batch and splits the results"""
+        try:
+            inputs = {key: np.concatenate([pending.inputs[key] for pending in batch]) for key in keys}
+            total = sum(pending.size for pending in batch)
+            start = time.time()
+            if kind == PREDICT:
+                results = self.model.predict(inputs)
+                results = {key: results[key] for key in self.model.decoders.keys()}
+            else:
+                results = self.model.get_representations(inputs)
+            self.stats['run_secs'] += time.time() - start
+            self.stats['batches'] += 1
+            self.stats['requests'] += len(batch)
+            self.stats['examples'] += total
+            offset = 0
+            for pending in batch:
+                pending.result = {key: val[offset:offset + pending.size] for key, val in results.items()
+                                  if np.ndim(val) > 0 and len(val) == total}
+                offset += pending.size
+        except Exception as error:
+            for pending in batch:
+                pending.error = error
+        for pending in batch:
+            pending.done.set()
+
+
+################################################################################
+# HTTP
+################################################################################
+def decode_body(body, content_type):
+    """Reads the input arrays of a request body, returns (inputs, whether to answer in JSON)"""
+    if content_type.startswith('application/json'):
+        try:
+            return json.loads(body.decode('utf-8'))['inputs'], True
+        except (ValueError, KeyError, TypeError):
+            raise RequestError('JSON body must be {"inputs": {track: nested lists}}')
+    try:
+        with np.load(io.BytesIO(body)) as npz:
+            return {key: npz[key] for key in npz.files}, False
+    except (IOError, ValueError):
+        raise RequestError('Body must be an .npz archive or JSON')
+
+
+def encode_result(result, as_json):
+    """Serializes result arrays, returns (body, content type)"""
+    if as_json:
+        return json.dumps({key: val.tolist() for key, val in result.items()}).encode('utf-8'), 'application/json'
+    buf = io.BytesIO()
+    np.savez(buf, **result)
+    return buf.getvalue(), 'application/octet-stream'
+
+
+class PredictionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    routes = {'/predict': PREDICT, '/representations': REPRESENTATIONS}
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self._reply(404, json.dumps({'error': 'Unknown path ' + self.path}).encode('utf-8'))
+        batcher = self.server.batcher
+        status = {'inputs': batcher.input_shapes,
+                  'outputs': list(batcher.model.decoders.keys()),
+                  'max_batch_size': batcher.max_batch_size,
+                  'max_latency': batcher.max_latency,
+                  'stats': batcher.stats}
+        self._reply(200, json.dumps(status).encode('utf-8'))
+
+    def do_POST(self):
+        if self.path not in self.routes:
+            return self._reply(404, json.dumps({'error': 'Unknown path ' + self.path}).encode('utf-8'))
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            inputs, as_json = decode_body(body, self.headers.get('Content-Type', ''))
+            result = self.server.batcher.submit(self.routes[self.path], inputs)
+        except RequestError as error:
+            return self._reply(400, json.dumps({'error': str(error)}).encode('utf-8'))
+        except Exception as error:
+            return self._reply(500, json.dumps({'error': repr(error)}).encode('utf-8'))
+        self._reply(200, *encode_result(result, as_json))
+
+    def _reply(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PredictionServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTP server handling every connection on its own thread, all sharing one MicroBatcher"""
+    daemon_threads = True
+
+    def __init__(self, address, batcher):
+        BaseHTTPServer.HTTPServer.__init__(self, address, PredictionHandler)
+        self.batcher = batcher
+
+
+################################################################################
+# Main
+################################################################################
+flags = tf.app.flags
+flags.DEFINE_string('runName', 'experiment', '(DEFAULT: experiment) - name of run')
+flags.DEFINE_string('resultsDir', '../results', '(DEFAULT: ../results) - directory where results from runName are stored')
+flags.DEFINE_string('host', '127.0.0.1', '(DEFAULT: 127.0.0.1) - address to listen on')
+flags.DEFINE_integer('port', 8470, '(DEFAULT: 8470) - port to listen on')
+flags.DEFINE_integer('maxBatchSize', 256, '(DEFAULT: 256) - maximum number of examples run at once')
+flags.DEFINE_float('maxLatencyMs', 5., '(DEFAULT: 5.) - maximum time (ms) the first request of a batch waits for others')
+FLAGS = flags.FLAGS
+
+def main(_):
+    """Restore the model once and serve it until interrupted"""
+
+    model = load_integrator(os.path.join(FLAGS.resultsDir, FLAGS.runName))
+    batcher = MicroBatcher(model, max_batch_size=FLAGS.maxBatchSize, max_latency=FLAGS.maxLatencyMs / 1000.)
+    server = PredictionServer((FLAGS.host, FLAGS.port), batcher)
+    print('Serving {} on http://{}:{}'.format(FLAGS.runName, FLAGS.host, FLAGS.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        model.sess.close()
+
+
+if __name__ == '__main__':
+    tf.app.run()
@@ -0,0 +1,406 @@
+"""'sweep.py' runs a hyperparameter sweep of main.py on a single machine.
+
+Trials are small, so several of them are packed onto one node: each trial
+is a main.py process pinned to its own set of cores (taskset) with a
+TensorFlow session of as many threads. All trials read the same, read-only
+train.h5 and validation.h5, so the operating system keeps one copy of
+them in the page cache for the whole sweep.
+
+Unpromising trials are stopped early by asynchronous successive halving:
+rungs are placed at minIterations * eta^k validation runs, and a trial
+reaching a rung is stopped unless its best validation cost so far is in
+the top 1 / eta of the trials that reached the same rung before it. The
+validation costs are read from the validation.csv of the running trials.
+Trials run with --patience 0, so successive halving alone stops them early.
+
+Search space (json):
+    keys are main.py flags (e.g. learningRate, batchSize) or dotted paths
+    into the architecture (e.g. Modules.Layer1.number_of_filters), values are
+        {"values": [...]}               choice from a list
+        {"uniform": [low, high]}        uniform float
+        {"log_uniform": [low, high]}    log uniform float
+        {"int_uniform": [low, high]}    uniform integer, high included
+
+    With --trials 0 the full grid of the value lists is run (only "values"
+    allowed), otherwise --trials random samples.
+
+Output (<resultsDir>/<sweepName>/):
+    trial_<n>/                      results directory of each trial (main.py --runName)
+    trial_<n>_architecture.json     architecture of each trial
+    trial_<n>.log                   stdout and stderr of each trial
+    summary.tsv                     parameters, status, iterations and best validation cost of every trial
+
+Example:
+        $ python sweep.py --space search_space.json --trials 24 --threadsPerTrial 4 --totalIterations 200
+
+    Flags after -- are passed to every trial:
+        $ python sweep.py --space search_space.json -- --stepsPerIteration 20 --batchSize 64
+
+FLAGS:
+    flag:                   default:                description:
+
+    --space                 'search_space.json'     search space of the sweep [json file]
+    --sweepName             'sweep'                 results subdirectory of the sweep
+    --resultsDir            '../results'            directory where the sweep is stored
+    --dataDir               '../data/hdf5datasets'  directory where hdf5datasets are stored
+    --configuration         'configurations.json'   parameters of data inputs and outputs [json file]
+    --architecture          'architecture.json'     architecture the sampled values are written into [json file]
+    --trials                0                       number of random trials, 0 runs the full grid
+    --seed                  0                       seed of the random trials
+    --threadsPerTrial       1                       cores pinned to (and threads used by) each trial
+    --concurrent            0                       trials run at once, 0 fits as many as the cores allow
+    --totalIterations       100                     maximum number of training iterations of a trial
+    --minIterations         10                      iterations of the first successive halving rung
+    --eta                   3                       rung spacing and reduction factor, 0 disables early stopping
+    --pollSecs              10                      seconds between checks of the running trials
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import csv
+import copy
+import json
+import time
+import itertools
+import subprocess
+import multiprocessing
+from optparse import OptionParser
+
+import numpy as np
+
+SPACE_TYPES = ['values', 'uniform', 'log_uniform', 'int_uniform']
+
+
+############################################################################################
+# Search space
+############################################################################################
+
+def load_space(path):
+    """Reads a search space and checks that every parameter has exactly one known distribution"""
+    with open(path) as fp:
+        space = json.load(fp)
+    for name, spec in space.items():
+        if not isinstance(spec, dict) or len(spec) != 1 or list(spec.keys())[0] not in SPACE_TYPES:
+            raise ValueError('Parameter {} needs exactly one of {}'.format(name, ', '.join(SPACE_TYPES)))
+    return space
+
+
+def sample_trials(space, num_trials=0, seed=0):
+    """Parameters of the trials of a sweep
+
+    Args:
+        :param space: (dictionary) search space, see load_space
+        :param num_trials: (int, default = 0) number of random trials, 0 for the full grid of the value lists
+        :param seed: (int, default = 0) seed of the random trials
+
+    Returns:
+        list: one dictionary {parameter: value} per trial
+    """
+    names = sorted(space.keys())
+    if num_trials <= 0:
+        if any('values' not in space[name] for name in names):
+            raise ValueError('A grid sweep needs value lists for every parameter, use --trials for distributions')
+        return [dict(zip(names, values)) for values in itertools.product(*[space[name]['values'] for name in names])]
+
+    rng = np.random.RandomState(seed)
+    trials = []
+    for _ in range(num_trials):
+        params = {}
+        for name in names:
+            kind, arg = list(space[name].items())[0]
+            if kind == 'values':
+                params[name] = arg[rng.randint(len(arg))]
+            elif kind == 'uniform':
+                params[name] = float(rng.uniform(arg[0], arg[1]))
+            elif kind == 'log_uniform':
+                params[name] = float(np.exp(rng.uniform(np.log(arg[0]), np.log(arg[1]))))
+            else:
+                params[name] = int(rng.randint(arg[0], arg[1] + 1))
+        trials.append(params)
+    return trials
+
+
+def is_architecture_field(name):
+    """Dotted parameters address the architecture, the others are main.py flags"""
+    return '.' in name
+
+
+def trial_architecture(architecture, params):
+    """Copy of the architecture with the dotted parameters of a trial written into it"""
+    architecture = copy.deepcopy(architecture)
+    for name, value in params.items():
+        if not is_architecture_field(name):
+            continue
+        fields = name.split('.')
+        node = architecture
+        for field in fields[:-1]:
+            node = node.setdefault(field, {})
+        node[fields[-1]] = value
+    return architecture
+
+
+############################################################################################
+# Trials
+############################################################################################
+
+def find_executable(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def core_sets(num_slots, threads_per_trial):
+    """Disjoint cores of each concurrent slot"""
+    return [list(range(slot * threads_per_trial, (slot + 1) * threads_per_trial)) for slot in range(num_slots)]
+
+
+def read_validation_costs(path):
+    """Validation costs logged so far by a trial, empty while its validation.csv does not exist"""
+    if not os.path.exists(path):
+        return []
+    costs = []
+    with open(path) as fp:
+        for row in csv.DictReader(fp):
+            try:
+                costs.append(float(row['cost']))
+            except (KeyError, TypeError, ValueError):
+                # the last line may still be being written
+                break
+    return costs
+
+
+class Trial(object):
+    """A main.py process training one set of parameters"""
+
+    def __init__(self, index, params, sweep_path):
+        self.index = index
+        self.params = params
+        self.name = 'trial_{:03d}'.format(index)
+        self.sweep_path = sweep_path
+        self.architecture_path = os.path.join(sweep_path, self.name + '_architecture.json')
+        self.process = None
+        self.log_file = None
+        self.cores = None
+        self.status = 'pending'
+        self.costs = []
+        self.start_time = None
+        self.end_time = None
+
+    def command(self, options, threads, extra_args=()):
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'),
+                   '--runName', self.name,
+                   '--resultsDir', self.sweep_path,
+                   '--dataDir', options.dataDir,
+                   '--configuration', options.configuration,
+                   '--architecture', self.architecture_path,
+                   '--totalIterations', str(options.totalIterations),
+                   '--numThreads', str(threads),
+                   # successive halving decides the early stopping
+                   '--patience', '0']
+        for name in sorted(self.params):
+            if not is_architecture_field(name):
+                command += ['--' + name, str(self.params[name])]
+        return command + list(extra_args)
+
+    def start(self, command, cores=None):
+        """Launches the trial, pinned to cores if given"""
+        if cores is not None:
+            taskset = find_executable('taskset')
+            if taskset is not None:
+                command = [taskset, '-c', ','.join(str(core) for core in cores)] + command
+        self.cores = cores
+        self.log_file = open(os.path.join(self.sweep_path, self.name + '.log'), 'w')
+        self.process = subprocess.Popen(command, stdout=self.log_file, stderr=subprocess.STDOUT)
+        self.status = 'running'
+        self.start_time = time.time()
+
+    def update(self):
+        """Reads the validation costs, returns True once the process has exited"""
+        # polled first, so the costs of an exited process are complete
+        exited = self.process.poll() is not None
+        self.costs = read_validation_costs(os.path.join(self.sweep_path, self.name, 'validation.csv'))
+        if not exited:
+            return False
+        self.status = 'completed' if self.process.returncode == 0 else 'failed'
+        self._finish()
+        return True
+
+    def stop(self):
+        """Terminates an unpromising trial"""
+        self.process.terminate()
+        self.process.wait()
+        self.status = 'stopped'
+        self._finish()
+
+    def _finish(self):
+        self.end_time = time.time()
+        self.log_file.close()
+
+    @property
+    def best_cost(self):
+        return min(self.costs) if self.costs else float('nan')
+
+    @property
+    def seconds(self):
+        if self.start_time is None:
+            return 0.
+        return (self.end_time or time.time()) - self.start_time
+
+
+############################################################################################
+# Asynchronous successive halving
+############################################################################################
+
+class SuccessiveHalving(object):
+    """Stops trials that are not in the top 1 / eta of their rung"""
+
+    def __init__(self, min_iterations=10, eta=3, max_iterations=100):
+        """
+        Args:
+            :param min_iterations: (int, default = 10) iterations of the first rung
+            :param eta: (int, default = 3) rung spacing and reduction factor, 0 disables early stopping
+            :param max_iterations: (int, default = 100) iterations of a trial that is never stopped
+        """
+        self.eta = eta
+        self.rungs = []
+        if eta > 1:
+            rung = min_iterations
+            while rung < max_iterations:
+                self.rungs.append(rung)
+                rung *= eta
+        # best cost of every trial at each rung: {rung: {trial index: cost}}
+        self.records = {rung: {} for rung in self.rungs}
+
+    def keep(self, index, costs):
+        """Records every rung a trial reached, False if it should be stopped at any of them"""
+        keep = True
+        for rung in self.rungs:
+            if len(costs) < rung:
+                break
+            records = self.records[rung]
+            if index in records:
+                continue
+            records[index] = min(costs[:rung])
+            # the first trials of a rung have nothing to be compared to
+            if len(records) < self.eta:
+                continue
+            cutoff = np.sort(list(records.values()))[len(records) // self.eta - 1]
+            keep = keep and records[index] <= cutoff
+        return keep
+
+
+############################################################################################
+# Sweep
+############################################################################################
+
+def write_summary(trials, path):
+    """Writes a table of the trials, ordered by best validation cost"""
+    names = sorted(set(name for trial in trials for name in trial.params))
+    ordered = sorted(trials, key=lambda trial: (np.isnan(trial.best_cost), trial.best_cost))
+    with open(path, 'w') as fp:
+        fp.write('\t'.join(['trial', 'status', 'iterations', 'best_cost', 'seconds'] + names) + '\n')
+        for trial in ordered:
+            fp.write('\t'.join([trial.name, trial.status, str(len(trial.costs)), '{:.6g}'.format(trial.best_cost),
+                                '{:.0f}'.format(trial.seconds)] +
+                               [str(trial.params.get(name, '')) for name in names]) + '\n')
+    return ordered
+
+
+def run_sweep(trials, options, num_slots, threads_per_trial, extra_args=(), poll_secs=10):
+    """Runs the trials num_slots at a time, stopping unpromising ones, until all of them have finished
+
+    Args:
+        :param trials: (list) Trial objects
+        :param options: main.py options shared by the trials (dataDir, configuration, totalIterations)
+        :param num_slots: (int) trials run at once
+        :param threads_per_trial: (int) cores pinned to each trial
+        :param extra_args: (list, default = ()) further main.py arguments of every trial
+        :param poll_secs: (float, default = 10) seconds between checks of the running trials
+
+    Returns:
+        list: the trials, ordered by best validation cost
+    """
+    halving = SuccessiveHalving(options.minIterations, options.eta, options.totalIterations)
+    num_cores = multiprocessing.cpu_count()
+    pin = num_slots * threads_per_trial <= num_cores
+    pending = list(trials)
+    running = {}
+    summary_path = os.path.join(trials[0].sweep_path, 'summary.tsv')
+    try:
+        while pending or running:
+            for slot, cores in enumerate(core_sets(num_slots, threads_per_trial)):
+                if slot not in running and pending:
+                    trial = pending.pop(0)
+                    trial.start(trial.command(options, threads_per_trial, extra_args), cores if pin else None)
+                    running[slot] = trial
+                    print('{} started on cores {}: {}'.format(trial.name, trial.cores, json.dumps(trial.params)))
+            time.sleep(poll_secs)
+            for slot, trial in list(running.items()):
+                if trial.update():
+                    # rungs passed since the last poll still count towards the cutoffs of later trials
+                    halving.keep(trial.index, trial.costs)
+                    del running[slot]
+                    print('{} {} after {} iterations, best cost {:.6g}'.format(
+                        trial.name, trial.status, len(trial.costs), trial.best_cost))
+                elif not halving.keep(trial.index, trial.costs):
+                    trial.stop()
+                    del running[slot]
+                    print('{} stopped at {} iterations, best cost {:.6g}'.format(
+                        trial.name, len(trial.costs), trial.best_cost))
+            write_summary(trials, summary_path)
+    finally:
+        for trial in running.values():
+            trial.stop()
+    return write_summary(trials, summary_path)
+
+
+def main():
+    parser = OptionParser('usage: %prog [options] [-- main.py options]')
+    parser.add_option('--space', dest='space', default='search_space.json', help='(DEFAULT: search_space.json) - search space of the sweep [json file]')
+    parser.add_option('--sweepName', dest='sweepName', default='sweep', help='(DEFAULT: sweep) - results subdirectory of the sweep')
+    parser.add_option('--resultsDir', dest='resultsDir', default='../results', help='(DEFAULT: ../results) - directory where the sweep is stored')
+    parser.add_option('--dataDir', dest='dataDir', default='../data/hdf5datasets', help='(DEFAULT: ../data/hdf5datasets) - directory where hdf5datasets are stored')
+    parser.add_option('--configuration', dest='configuration', default='configurations.json', help='(DEFAULT: configurations.json) - parameters of data inputs and outputs [json file]')
+    parser.add_option('--architecture', dest='architecture', default='architecture.json', help='(DEFAULT: architecture.json) - architecture the sampled values are written into [json file]')
+    parser.add_option('--trials', dest='trials', type='int', default=0, help='(DEFAULT: 0) - number of random trials, 0 runs the full grid')
+    parser.add_option('--seed', dest='seed', type='int', default=0, help='(DEFAULT: 0) - seed of the random trials')
+    parser.add_option('--threadsPerTrial', dest='threadsPerTrial', type='int', default=1, help='(DEFAULT: 1) - cores pinned to (and threads used by) each trial')
+    parser.add_option('--concurrent', dest='concurrent', type='int', default=0, help='(DEFAULT: 0) - trials run at once, 0 fits as many as the cores allow')
+    parser.add_option('--totalIterations', dest='totalIterations', type='int', default=100, help='(DEFAULT: 100) - maximum number of training iterations of a trial')
+    parser.add_option('--minIterations', dest='minIterations', type='int', default=10, help='(DEFAULT: 10) - iterations of the first successive halving rung')
+    parser.add_option('--eta', dest='eta', type='int', default=3, help='(DEFAULT: 3) - rung spacing and reduction factor, 0 disables early stopping')
+    parser.add_option('--pollSecs', dest='pollSecs', type='float', default=10, help='(DEFAULT: 10) - seconds between checks of the running trials')
+    (FLAGS, args) = parser.parse_args()
+
+    space = load_space(FLAGS.space)
+    params = sample_trials(space, FLAGS.trials, FLAGS.seed)
+    with open(FLAGS.architecture) as fp:
+        architecture = json.load(fp)
+
+    sweep_path = os.path.join(FLAGS.resultsDir, FLAGS.sweepName)
+    if not os.path.exists(sweep_path):
+        os.makedirs(sweep_path)
+    trials = [Trial(ix, trial_params, sweep_path) for ix, trial_params in enumerate(params)]
+    for trial in trials:
+        with open(trial.architecture_path, 'w') as fp:
+            json.dump(trial_architecture(architecture, trial.params), fp, indent=4)
+
+    num_slots = FLAGS.concurrent or max(1, multiprocessing.cpu_count() // FLAGS.threadsPerTrial)
+    print('Running {} trials, {} at a time with {} threads each'.format(len(trials), num_slots, FLAGS.threadsPerTrial))
+    ordered = run_sweep(trials, FLAGS, num_slots, FLAGS.threadsPerTrial, args, FLAGS.pollSecs)
+
+    print('\n{:<12}{:<12}{:>12}{:>14}  {}'.format('trial', 'status', 'iterations', 'best cost', 'parameters'))
+    for trial in ordered:
+        print('{:<12}{:<12}{:>12}{:>14.6g}  {}'.format(trial.name, trial.status, len(trial.costs), trial.best_cost,
+                                                      json.dumps(trial.params, sort_keys=True)))
+    print('Saved ' + os.path.join(sweep_path, 'summary.tsv'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""'variant_effect.py' scores the effect of SNVs and small indels from a VCF file
+on the predictions of a trained model.
+
+Every variant is placed in a reference window from the dnaseq track store.
+Window starts are snapped to a grid, so nearby variants share the same
+window. The reference prediction and the representations of the other
+input tracks of a window are computed once and cached (least recently
+used), and alternative windows are then predicted in large batches. Only
+the dnaseq encoder runs on them, since the cached representations are fed
+for the unchanged tracks (see Integrator.inference_feed). Alternative
+sequences are built on the uint8 character codes of the genome and one hot
+encoded with the io_tools lookup table. Deletions are filled with the
+sequence following the window and insertions are trimmed at its end.
+
+The VCF file is streamed in blocks and the scores are written as a tab
+separated table, one line per alternative allele:
+    <track>_kl              KL divergence of the alternative from the reference prediction (pdf targets)
+    <track>_l2              euclidean distance between the predictions (standardized targets)
+    <track>_max_delta       largest absolute change of the predicted profile
+    <track>_peak_shift      shift (in positions) of the highest predicted position
+
+Example:
+        $ python variant_effect.py --runName your_experiment --vcf variants.vcf.gz --storeDir ../data/stores
+
+FLAGS:
+    flag:                   default:                description:
+
+    --runName               'experiment'            name of run
+    --resultsDir            '../results'            directory where results from runName are stored
+    --storeDir              '../data/stores'        directory of per-track memory mapped stores of the model inputs
+    --vcf                   ''                      (optionally gzipped) VCF file
+    --output                ''                      output table, defaults to variant_effects.tsv in the results directory
+    --grid                  50                      window starts are multiples of this, variants sharing a start share its window
+    --batchSize             512                     windows predicted per session run
+    --blockSize             100000                  variants read from the VCF at once
+    --cacheSize             20000                   reference windows kept in the cache
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+
+import os
+import gzip
+from collections import namedtuple, OrderedDict
+
+import tensorflow as tf
+import numpy as np
+
+### FIDDLE specific tools ###
+from models import load_integrator
+from io_tools import TrackStore, sequence_to_codes, _ONE_HOT_LOOKUP
+from metrics import kl_divergence
+#############################
+
+Variant = namedtuple('Variant', ['chrom', 'pos', 'id', 'ref', 'alt']) # pos is 0-based
+ALLOWED_BASES = set('ACGTN')
+
+
+def read_vcf(path):
+    """Yields a Variant for every alternative allele of a VCF file, skipping symbolic alleles"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path) as fp:
+        for line in fp:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            chrom, pos, variant_id, ref = fields[0], int(fields[1]) - 1, fields[2], fields[3].upper()
+            for alt in fields[4].upper().split(','):
+                if set(ref) <= ALLOWED_BASES and set(alt) <= ALLOWED_BASES:
+                    yield Variant(chrom, pos, variant_id, ref, alt)
+
+
+def read_blocks(variants, block_size):
+    """Groups an iterator of variants into lists of block_size"""
+    block = []
+    for variant in variants:
+        block.append(variant)
+        if len(block) == block_size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def alternative_codes(genome_codes, offset, ref, alt, width):
+    """Character codes of the alternative window
+
+    Args:
+        :param genome_codes: (numpy vector) codes of the reference window followed by enough sequence to fill deletions
+        :param offset: (int) position of the variant in the window
+        :param ref: (string) reference allele
+        :param alt: (string) alternative allele
+        :param width: (int) window width
+
+    Returns:
+        numpy vector: (width,) uint8 codes
+    """
+    codes = np.concatenate([genome_codes[:offset], sequence_to_codes(alt), genome_codes[offset + len(ref):]])
+    return codes[:width]
+
+
+class VariantScorer(object):
+    """Scores variants against a trained model, caching the reference windows"""
+
+    def __init__(self, model, stores, grid=50, batch_size=512, cache_size=20000):
+        """
+        Args:
+            :param model: (models.Integrator) trained model with a dnaseq input
+            :param stores: (dictionary) {key = input track name, value = io_tools.TrackStore}, needs dnaseq
+            :param grid: (int, default = 50) window starts are multiples of grid
+            :param batch_size: (int, default = 512) windows predicted per session run
+            :param cache_size: (int, default = 20000) reference windows kept in the cache
+        """
+        self.model = model
+        self.genome = stores['dnaseq']
+        self.tracks = {key: store for key, store in stores.items() if key != 'dnaseq'}
+        self.width = model.architecture['Modules']['dnaseq']['input_width']
+        self.chrom_sizes = self.genome.chrom_sizes
+        self.grid = grid
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.outputs = sorted(model.decoders.keys())
+        self.score_name = 'kl' if model.target_option == 'pdf' else 'l2'
+        self.cache = OrderedDict() # (chrom, start) -> (representations, reference predictions)
+        self.skipped = {'unknown_chromosome': 0, 'too_long': 0, 'reference_mismatch': 0}
+
+    @property
+    def columns(self):
+        columns = ['chrom', 'pos', 'id', 'ref', 'alt', 'window_start']
+        for key in self.outputs:
+            columns += [key + '_' + self.score_name, key + '_max_delta', key + '_peak_shift']
+        return columns
+
+    def window_start(self, variant):
+        """Grid aligned start of the window centering the variant best, or None if the variant cannot be placed"""
+        size = self.chrom_sizes.get(variant.chrom)
+        if size is None or size < self.width:
+            self.skipped['unknown_chromosome'] += 1
+            return None
+        if max(len(variant.ref), len(variant.alt)) > self.width // 4:
+            self.skipped['too_long'] += 1
+            return None
+        start = int(round((variant.pos - self.width // 2) / self.grid)) * self.grid
+        start = min(max(start, 0), size - self.width)
+        reference = self.genome.values(variant.chrom, variant.pos, variant.pos + len(variant.ref)).tobytes().upper()
+        if reference != variant.ref.encode('ascii') and 'N' not in variant.ref:
+            self.skipped['reference_mismatch'] += 1
+            return None
+        return start
+
+    def _run_batches(self, dna, representations):
+        """Predictions of dnaseq windows with fed representations, in batches"""
+        predictions = {key: [] for key in self.outputs}
+        for begin in range(0, len(dna), self.batch_size):
+            batch = self.model.predict({'dnaseq': dna[begin:begin + self.batch_size]},
+                                       {key: val[begin:begin + self.batch_size] for key, val in representations.items()})
+            for key in self.outputs:
+                predictions[key].append(batch[key].reshape(len(batch[key]), -1))
+        return {key: np.concatenate(val) for key, val in predictions.items()}
+
+    def reference(self, windows):
+        """Cached representations and reference predictions of windows, computing the missing ones in batches
+
+        Args:
+            :param windows: (list) unique (chrom, start) tuples
+
+        Returns:
+            tuple: ({key = input track, value = (n, representation_width)}, {key = output track, value = (n, width)})
+        """
+        missing = [window for window in windows if window not in self.cache]
+        if missing:
+            chroms = np.array([window[0] for window in missing])
+            starts = np.array([window[1] for window in missing])
+            representations = {}
+            for begin in range(0, len(missing), self.batch_size):
+                batch = {key: np.nan_to_num(store.extract(chroms[begin:begin + self.batch_size],
+                                                          starts[begin:begin + self.batch_size], self.width))
+                         for key, store in self.tracks.items()}
+                for key, val in (self.model.encode(batch) if batch else {}).items():
+                    representations.setdefault(key, []).append(val)
+            representations = {key: np.concatenate(val) for key, val in representations.items()}
+            predictions = self._run_batches(self.genome.extract(chroms, starts, self.width), representations)
+            for ix, window in enumerate(missing):
+                self.cache[window] = ({key: val[ix] for key, val in representations.items()},
+                                      {key: val[ix] for key, val in predictions.items()})
+        entries = []
+        for window in windows:
+            entries.append(self.cache.pop(window))
+            self.cache[window] = entries[-1] # most recently used last
+        while len(self.cache) > max(self.cache_size, len(windows)):
+            self.cache.popitem(last=False)
+        representations = {key: np.stack([entry[0][key] for entry in entries]) for key in entries[0][0]}
+        predictions = {key: np.stack([entry[1][key] for entry in entries]) for key in self.outputs}
+        return representations, predictions
+
+    def score(self, variants):
+        """Scores a block of variants
+
+        Returns:
+            list: rows of the output table, see columns
+        """
+        placed = [(variant, self.window_start(variant)) for variant in variants]
+        placed = [(variant, start) for variant, start in placed if start is not None]
+        if not placed:
+            return []
+        windows = sorted(set((variant.chrom, start) for variant, start in placed))
+        window_index = {window: ix for ix, window in enumerate(windows)}
+        representations, references = self.reference(windows)
+
+        rows = np.array([window_index[(variant.chrom, start)] for variant, start in placed])
+        dna = np.empty((len(placed), 4, self.width, 1), dtype=np.float32)
+        for ix, (variant, start) in enumerate(placed):
+            tail = self.width // 4 + 1
+            genome_codes = self.genome.values(variant.chrom, start, start + self.width + tail)
+            genome_codes = np.concatenate([genome_codes, np.full(self.width + tail - len(genome_codes), ord('N'), dtype=np.uint8)])
+            codes = alternative_codes(genome_codes, variant.pos - start, variant.ref, variant.alt, self.width)
+            dna[ix, :, :, 0] = _ONE_HOT_LOOKUP[codes].T
+        alternatives = self._run_batches(dna, {key: val[rows] for key, val in representations.items()})
+
+        columns = []
+        for key in self.outputs:
+            reference, alternative = references[key][rows], alternatives[key]
+            if self.score_name == 'kl':
+                score = kl_divergence(reference.astype(np.float64), alternative.astype(np.float64))
+            else:
+                score = np.sqrt(((alternative - reference) ** 2).sum(axis=1))
+            # strands are summed before locating the peak
+            peak_shift = (alternative.reshape(len(rows), -1, self.width).sum(axis=1).argmax(axis=1) -
+                          reference.reshape(len(rows), -1, self.width).sum(axis=1).argmax(axis=1))
+            columns += [score, np.abs(alternative - reference).max(axis=1), peak_shift]
+        return [[variant.chrom, variant.pos + 1, variant.id, variant.ref, variant.alt, start] +
+                [column[ix] for column in columns] for ix, (variant, start) in enumerate(placed)]
+
+
+def write_rows(fp, rows):
+    for row in rows:
+        fp.write('\t'.join(val if isinstance(val, str) else
+                           ('{:.6g}'.format(val) if isinstance(val, (float, np.floating)) else str(val))
+                           for val in row) + '\n')
+
+
+flags = tf.app.flags
+flags.DEFINE_string('runName', 'experiment', '(DEFAULT: experiment) - name of run')
+flags.DEFINE_string('resultsDir', '../results', '(DEFAULT: ../results) - directory where results from runName are stored')
+flags.DEFINE_string('storeDir', '../data/stores', '(DEFAULT: ../data/stores) - directory of per-track memory mapped stores of the model inputs')
+flags.DEFINE_string('vcf', '', '(optionally gzipped) VCF file')
+flags.DEFINE_string('output', '', '(DEFAULT: variant_effects.tsv in the results directory) - output table')
+flags.DEFINE_integer('grid', 50, '(DEFAULT: 50) - window starts are multiples of this, variants sharing a start share its window')
+flags.DEFINE_integer('batchSize', 512, '(DEFAULT: 512) - windows predicted per session run')
+flags.DEFINE_integer('blockSize', 100000, '(DEFAULT: 100000) - variants read from the VCF at once')
+flags.DEFINE_integer('cacheSize', 20000, '(DEFAULT: 20000) - reference windows kept in the cache')
+FLAGS = flags.FLAGS
+
+def main(_):
+    """Load the trained model, stream the VCF through the scorer, write the table"""
+
+    if not FLAGS.vcf:
+        raise ValueError('--vcf is required')
+    FLAGS.savePath = os.path.join(FLAGS.resultsDir, FLAGS.runName)
+    output_path = FLAGS.output or os.path.join(FLAGS.savePath, 'variant_effects.tsv')
+    model = load_integrator(FLAGS.savePath)
+    if 'dnaseq' not in model.architecture['Inputs']:
+        raise ValueError('Variant effects need a model with a dnaseq input')
+    # input tracks without a store are substituted by the model, see Integrator.inference_feed
+    stores = {key: TrackStore(os.path.join(FLAGS.storeDir, key)) for key in model.architecture['Inputs']
+              if os.path.exists(os.path.join(FLAGS.storeDir, key, 'metadata.json'))}
+    if 'dnaseq' not in stores:
+        raise ValueError('No dnaseq track store in ' + FLAGS.storeDir)
+    scorer = VariantScorer(model, stores, grid=FLAGS.grid, batch_size=FLAGS.batchSize, cache_size=FLAGS.cacheSize)
+
+    num_scored = 0
+    with open(output_path, 'w') as fp:
+        fp.write('\t'.join(scorer.columns) + '\n')
+        for block in read_blocks(read_vcf(FLAGS.vcf), FLAGS.blockSize):
+            rows = scorer.score(block)
+            write_rows(fp, rows)
+            num_scored += len(rows)
+            print('{} variants scored, {} reference windows cached'.format(num_scored, len(scorer.cache)))
+    print('Skipped: ' + ', '.join('{} {}'.format(val, key) for key, val in scorer.skipped.items()))
+    print('Saved ' + output_path)
+    model.sess.close()
+
+
+if __name__ == '__main__':
+    tf.app.run()
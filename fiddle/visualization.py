@@ -10,47 +10,60 @@ Example:
     github page have been followed, default flags and the following command will
     output the predicted profiles to a results directory "FIDDLE/results/experiment/".
 
-        $ python visualization.py --runName your_experiment --maxEpoch 100
+        $ python visualization.py --runName your_experiment
+
+    Plotting does not need TensorFlow, matplotlib and dev/viz_sequence.py are
+    only imported once something is plotted.
 
 FLAGS:
     flag:                   default:                description:
 
     --runName               'experiment'            name of run
     --resultsDir            '../results'            directory where results from runName will be stored
-    --makeGif               'True'                  make gif from png files
-    --makePng               'True'                  make png from saved prediction pickles
+    --makeGif               'True'                  make gif from png files (--nomakeGif to disable)
+    --makePng               'True'                  make png from saved prediction pickles (--nomakePng to disable)
     --vizType               'tssseq'                data type to be visualized
     --startFrom             '0'                     minimum iteration number to start plotting
 """
 
-from matplotlib import pylab as pl
 import numpy as np
-import h5py
 import os, io, sys
 from math import sqrt
-import tensorflow as tf
+from optparse import OptionParser
 from tqdm import tqdm as tq
 import cPickle as pickle
-import tensorflow as tf
 
-### FIDDLE specific tools ###
-sys.path.append('../dev/')
-from viz_sequence import *
-#############################
+DEV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dev')
+
+
+def _pylab():
+    """Imports matplotlib's pylab on first use"""
+    from matplotlib import pylab
+    return pylab
+
+
+def _viz_sequence():
+    """Imports the sequence logo tools of dev/viz_sequence.py on first use"""
+    if DEV_DIR not in sys.path:
+        sys.path.append(DEV_DIR)
+    import viz_sequence
+    return viz_sequence
 
 ################################################################################
 # Main
 ################################################################################
 def main():
 
-    flags = tf.app.flags
-    flags.DEFINE_string('runName', 'experiment', '(DEFAULT: experiment) - name of run')
-    flags.DEFINE_string('resultsDir', '../results', '(DEFAULT: ../result) - directory where results from runName will be stored')
-    flags.DEFINE_boolean('makeGif', True, '(DEFAULT: True) - make gif from png files')
-    flags.DEFINE_boolean('makePng', True, '(DEFAULT: True) - make png from saved prediction pickles')
-    flags.DEFINE_string('vizType', 'tssseq', '(DEFAULT: tssseq) - data type to be vizualized')
-    flags.DEFINE_integer('startFrom', 0, '(DEFAULT: 0) - minimum iteration number to start plotting')
-    FLAGS = flags.FLAGS
+    parser = OptionParser('usage: %prog [options]')
+    parser.add_option('--runName', dest='runName', default='experiment', help='(DEFAULT: experiment) - name of run')
+    parser.add_option('--resultsDir', dest='resultsDir', default='../results', help='(DEFAULT: ../result) - directory where results from runName will be stored')
+    parser.add_option('--makeGif', dest='makeGif', action='store_true', default=True, help='(DEFAULT: True) - make gif from png files')
+    parser.add_option('--nomakeGif', dest='makeGif', action='store_false')
+    parser.add_option('--makePng', dest='makePng', action='store_true', default=True, help='(DEFAULT: True) - make png from saved prediction pickles')
+    parser.add_option('--nomakePng', dest='makePng', action='store_false')
+    parser.add_option('--vizType', dest='vizType', default='tssseq', help='(DEFAULT: tssseq) - data type to be vizualized')
+    parser.add_option('--startFrom', dest='startFrom', type='int', default=0, help='(DEFAULT: 0) - minimum iteration number to start plotting')
+    (FLAGS, args) = parser.parse_args()
     save_dir = os.path.join(FLAGS.resultsDir,FLAGS.runName)
 
     if FLAGS.makePng:
@@ -111,6 +124,7 @@ def main():
 ################################################################################
 
 def plot_prediction(pred_vec, orig_vec=None, save_dir='../results/', name='profile_prediction', strand='Single',title='profile'):
+    pl = _pylab()
     pl.ioff()
     pred_vec = {'tssseq': pred_vec['tssseq']} # EDIT
     if len(pred_vec) == 1:
@@ -178,6 +192,8 @@ def put_kernels_on_grid(kernel, pad = 1):
       Tensor of shape [(Y+2*pad)*grid_Y, (X+2*pad)*grid_X, NumChannels, 1].
     """
 
+    import tensorflow as tf
+
     # get shape of the grid. NumKernels == grid_Y * grid_X
     def factorization(n):
         for i in range(int(sqrt(float(n))), 0, -1):
@@ -230,13 +246,18 @@ def plot_weights(array,
                  height_padding_factor=0.2,
                  length_padding=1.0,
                  subticks_frequency=1.0,
-                 colors=default_colors,
-                 plot_funcs=default_plot_funcs,
+                 colors=None,
+                 plot_funcs=None,
                  highlight={},
                  ax=[]):
     # fig = plt.figure(figsize=(20,2))
     # ax = fig.add_subplot(111)
-    plot_weights_given_ax(ax=ax, array=array,
+    viz_sequence = _viz_sequence()
+    if colors is None:
+        colors = viz_sequence.default_colors
+    if plot_funcs is None:
+        plot_funcs = viz_sequence.default_plot_funcs
+    viz_sequence.plot_weights_given_ax(ax=ax, array=array,
         height_padding_factor=height_padding_factor,
         length_padding=length_padding,
         subticks_frequency=subticks_frequency,
@@ -245,6 +266,7 @@ def plot_weights(array,
         highlight=highlight)
 
 def visualize_dna(weigths, pred_vec, save_dir='../results/', name='dna_prediction', verbose=True):
+    pl = _pylab()
     pl.ioff()
     fig = pl.figure(figsize=(20,20))
     for ix in tq(range(pred_vec.shape[0])):
@@ -256,9 +278,7 @@ def visualize_dna(weigths, pred_vec, save_dir='../results/', name='dna_predictio
         plot_weights(weigths[ix] * H,
                      height_padding_factor=0.2,
                      length_padding=1.0,
-                     colors=default_colors,
                      subticks_frequency=pred_vec.shape[2]/2,
-                     plot_funcs=default_plot_funcs,
                      highlight={},
                      ax=ax)
     pl.savefig(os.path.join(save_dir, name + '.png'), format='png')